@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import aiohttp
+
+ALERT_SPOOL_FILE = os.getenv('ALERT_SPOOL_FILE', "pending_alerts.json")
+ALERT_MAX_PENDING = int(os.getenv('ALERT_MAX_PENDING', "10000"))   # Oldest alerts are dropped beyond this
+ALERT_POST_TIMEOUT_SECONDS = float(os.getenv('ALERT_POST_TIMEOUT_SECONDS', "3.0"))
+ALERT_RETRY_INITIAL_SECONDS = 1.0
+ALERT_RETRY_MAX_SECONDS = 60.0
+ALERT_BATCH_SIZE = 50
+# Statuses meaning the alerts themselves are invalid; anything else (404 from a backend without
+# /alert/batch, 408, 429, 5xx) is retried
+REJECTED_STATUSES = (400, 413, 422)
+
+
+class AlertForwarder:
+    """Deliver alerts to the Flask server without blocking the BLE event loop.
+
+    submit() only records the alert: it is appended to an in-memory queue
+    and as one line to a spool journal on disk. A background task posts
+    queued alerts in order, batched to the server's /alert/batch route,
+    over a keep-alive aiohttp session with bounded timeouts and retries
+    with exponential backoff while the server is unreachable.
+
+    The journal is append-only: delivered and dropped alerts are recorded
+    as short lines too, and replaying it gives the pending queue back, so
+    alerts still pending at shutdown (or a crash) are delivered after the
+    next start. It is rewritten with just the pending alerts once those
+    make up less than half of it (checked after each delivery) or it
+    reaches twice ALERT_MAX_PENDING lines. At most ALERT_MAX_PENDING alerts are
+    kept; beyond that the oldest are dropped and counted.
+    """
+
+    def __init__(self, url, spool_file=ALERT_SPOOL_FILE):
+        self.url = url
+        self.batch_url = url.rstrip('/') + "/batch"
+        self.spool_file = spool_file
+        self.pending = []
+        self.dropped = 0
+        self.session = None
+        self._wakeup = None
+        self._task = None
+        self._journal = None
+        self._journal_lines = 0
+        self._in_flight = 0     # Alerts at the start of pending being posted right now
+
+    async def start(self):
+        self.pending = self._load_spool()
+        if len(self.pending) > ALERT_MAX_PENDING:
+            self.dropped += len(self.pending) - ALERT_MAX_PENDING
+            del self.pending[:-ALERT_MAX_PENDING]
+        if self.pending:
+            print(f"Loaded {len(self.pending)} undelivered alert(s) from {self.spool_file}")
+        self._compact_spool()
+        self._wakeup = asyncio.Event()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=4, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=ALERT_POST_TIMEOUT_SECONDS),
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.session:
+            await self.session.close()
+        self._compact_spool()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def submit(self, payload):
+        """Queue an alert for delivery. Never waits on the network."""
+        if len(self.pending) >= ALERT_MAX_PENDING:
+            # Drop the oldest alert that is not being posted right now
+            index = min(self._in_flight, len(self.pending) - 1)
+            del self.pending[index]
+            self._journal_write({"drop": index})
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"Alert queue full ({ALERT_MAX_PENDING}); {self.dropped} oldest alert(s) dropped so far")
+        self.pending.append(payload)
+        self._journal_write({"alert": payload})
+        if self._journal_lines > 2 * ALERT_MAX_PENDING:
+            self._compact_spool()   # A long outage: nothing is delivered, but dropped alerts still add lines
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        backoff = ALERT_RETRY_INITIAL_SECONDS
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            batch = self.pending[:ALERT_BATCH_SIZE]
+            self._in_flight = len(batch)
+            try:
+                done = await self._post(batch)
+            finally:
+                self._in_flight = 0
+            if done:
+                del self.pending[:done]
+                self._journal_write({"done": done})
+                if self._journal_lines > 2 * len(self.pending) + ALERT_BATCH_SIZE:
+                    self._compact_spool()
+            if done == len(batch):
+                backoff = ALERT_RETRY_INITIAL_SECONDS
+            else:
+                print(f"Retrying alert delivery in {backoff:.1f}s ({len(self.pending)} pending)")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, ALERT_RETRY_MAX_SECONDS)
+
+    async def _post(self, batch):
+        """Returns how many alerts from the start of batch no longer need to be retried."""
+        try:
+            async with self.session.post(self.batch_url, json={"alerts": batch}) as response:
+                body = await response.text()
+                if response.status == 200:
+                    print(f"{len(batch)} alert(s) successfully sent to server: {body}")
+                    return len(batch)
+                if response.status in REJECTED_STATUSES:
+                    # The server rejected the alerts themselves: retrying would not help
+                    print(f"Server rejected {len(batch)} alert(s) (status code {response.status}). Dropping them.")
+                    return len(batch)
+                if response.status == 404:
+                    # A backend without the batch route (e.g. during a rolling deploy)
+                    return await self._post_singly(batch)
+                print(f"Failed to send alert to server. Status code: {response.status}")
+                return 0
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error sending alert to server: {e!r}")
+            return 0
+
+    async def _post_singly(self, batch):
+        """Posts the alerts one by one to the single-alert route. Returns how many are done, in order."""
+        for done, alert in enumerate(batch):
+            try:
+                async with self.session.post(self.url, json=alert) as response:
+                    await response.text()
+                    if response.status in REJECTED_STATUSES:
+                        print(f"Server rejected an alert (status code {response.status}). Dropping it.")
+                    elif response.status != 200:
+                        print(f"Failed to send alert to server. Status code: {response.status}")
+                        return done
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error sending alert to server: {e!r}")
+                return done
+        print(f"{len(batch)} alert(s) sent to server one by one.")
+        return len(batch)
+
+    def _load_spool(self):
+        """Replays the spool journal into the list of pending alerts."""
+        if not os.path.exists(self.spool_file):
+            return []
+        pending = []
+        try:
+            with open(self.spool_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # A line cut short by a crash
+                    if isinstance(entry, list):
+                        pending.extend(entry)   # Spool written by earlier versions: one JSON array
+                    elif 'alert' in entry:
+                        pending.append(entry['alert'])
+                    elif 'done' in entry:
+                        del pending[:entry['done']]
+                    elif 'drop' in entry and entry['drop'] < len(pending):
+                        del pending[entry['drop']]
+        except (OSError, ValueError) as e:
+            print(f"Could not read alert spool {self.spool_file}: {e}")
+        return pending
+
+    def _journal_write(self, entry):
+        if self._journal is None:
+            return
+        try:
+            self._journal.write(json.dumps(entry) + "\n")
+            self._journal.flush()
+            self._journal_lines += 1
+        except OSError as e:
+            print(f"Could not write alert spool {self.spool_file}: {e}")
+
+    def _compact_spool(self):
+        """Rewrites the journal with only the pending alerts and keeps it open for appending."""
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+        try:
+            tmp_path = self.spool_file + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for alert in self.pending:
+                    f.write(json.dumps({"alert": alert}) + "\n")
+            os.replace(tmp_path, self.spool_file)
+            self._journal_lines = len(self.pending)
+            self._journal = open(self.spool_file, 'a', encoding='utf-8')
+        except OSError as e:
+            print(f"Could not write alert spool {self.spool_file}: {e}")
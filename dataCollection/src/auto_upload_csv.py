@@ -1,14 +1,20 @@
+import io
 import os
+import sys
+import json
 import time
 import logging
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaIoBaseUpload
+
+# Share the cached Drive client with the backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../webApp/backend'))
+from google_drive_utils import DriveServiceHolder
+from upload_queue import UploadQueue
+import metrics
 
 # --- CONFIGURATION ---
 # If modifying these scopes, delete the file token.json.
@@ -17,65 +23,198 @@ LOCAL_DIR_TO_WATCH = os.path.join(os.path.dirname(__file__), ".")
 DRIVE_FOLDER_ID = "1eT3I5RGrzFJRERu72Lw-N6YjeNgyzUD2" 
 CREDENTIALS_FILE = '../../config/credentials.json'
 TOKEN_FILE = '../../config/token.json'
+UPLOAD_STATE_FILE = os.path.join(LOCAL_DIR_TO_WATCH, ".upload_state.json")  # Bytes already uploaded per session CSV
+SEGMENT_INTERVAL_SECONDS = float(os.getenv('SEGMENT_INTERVAL_SECONDS', "60"))  # Minimum time between segments of one file
+FINALIZE_IDLE_SECONDS = float(os.getenv('FINALIZE_IDLE_SECONDS', "120"))       # A file unchanged this long is a closed session
+SEGMENT_NAME_FORMAT = "{stem}.part{index:04d}.csv"
+MANIFEST_NAME_FORMAT = "{stem}.manifest.json"
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', "4"))                       # Concurrent Drive uploads
+METRICS_LOG_INTERVAL_SECONDS = 60
+METRICS_FILE = os.getenv('UPLOADER_METRICS_FILE', os.path.join(LOCAL_DIR_TO_WATCH, "uploader_metrics.prom"))  # Prometheus textfile dump
+# Spool directory read by a backend on this host (its LOCAL_INGEST_DIR); "" keeps Drive as the only path
+LOCAL_INGEST_DIR = os.getenv('LOCAL_INGEST_DIR', "")
+HANDOFF_STATE_FILE = os.path.join(LOCAL_DIR_TO_WATCH, ".handoff_state.json")   # Bytes handed to the spool per session CSV
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
 
+drive_service_holder = DriveServiceHolder(scopes=SCOPES, token_file=TOKEN_FILE, credentials_file=CREDENTIALS_FILE)
+
+
 def get_drive_service():
-    """Google drive authentication and service creation."""
-    
-    creds = None
-    
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_FILE, SCOPES)
-            creds = flow.run_local_server(port=0) 
-        with open(TOKEN_FILE, 'w') as token:
-            token.write(creds.to_json())
+    """Returns the calling thread's cached Google Drive service client."""
+    return drive_service_holder.get_service()
 
-    try:
-        service = build('drive', 'v3', credentials=creds)
-        return service
-    except HttpError as error:
-        logging.error(f'An error occurred building the Drive service: {error}')
-        return None
 
+def upload_bytes_to_drive(service, data, name, drive_folder_id, mimetype='text/csv'):
+    """Uploads an in-memory payload as a new file in the specified Google Drive folder."""
 
-def upload_file_to_drive(service, filepath, drive_folder_id):
-    """Uploads a file to the specified Google Drive folder."""
-    
     file_metadata = {
-        'name': os.path.basename(filepath)
+        'name': name
     }
     if drive_folder_id:
         file_metadata['parents'] = [drive_folder_id]
 
-    media = MediaFileUpload(filepath, mimetype='text/csv', resumable=True)
+    media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype, resumable=True)
     try:
         file = service.files().create(body=file_metadata,
                                       media_body=media,
                                       fields='id').execute()
-        logging.info(f"File '{os.path.basename(filepath)}' uploaded successfully. File ID: {file.get('id')}")
+        logging.info(f"Segment '{name}' ({len(data)} bytes) uploaded successfully. File ID: {file.get('id')}")
         return file.get('id')
     except HttpError as error:
-        logging.error(f"An error occurred uploading '{os.path.basename(filepath)}': {error}")
+        logging.error(f"An error occurred uploading '{name}': {error}")
         return None
     except Exception as e:
-        logging.error(f"An unexpected error occurred uploading '{os.path.basename(filepath)}': {e}")
+        logging.error(f"An unexpected error occurred uploading '{name}': {e}")
         return None
 
+
+def upload_queue_metrics(queue):
+    """Metrics collector exposing an UploadQueue's counters in Prometheus form."""
+    def collect():
+        m = queue.metrics()
+        return [
+            ('posture_upload_queue_depth', 'gauge', 'Session files waiting for an upload worker', m['queue_depth']),
+            ('posture_upload_in_flight', 'gauge', 'Uploads currently running', m['in_flight']),
+            ('posture_uploads_total', 'counter', 'Segments and manifests uploaded', m['uploads']),
+            ('posture_upload_failures_total', 'counter', 'Uploads that failed and will be retried', m['failures']),
+            ('posture_upload_coalesced_total', 'counter', 'Upload requests merged into a pending one', m['coalesced']),
+            ('posture_upload_bytes_total', 'counter', 'Bytes uploaded to Drive', m['bytes']),
+            ('posture_upload_latency_avg_seconds', 'gauge', 'Average upload latency', m['avg_latency_seconds']),
+            ('posture_upload_latency_max_seconds', 'gauge', 'Slowest upload so far', m['max_latency_seconds']),
+            ('posture_upload_bytes_per_second', 'gauge', 'Recent upload throughput', m['bytes_per_second']),
+        ]
+    return collect
+
+
+def load_upload_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read upload state {state_file}: {e}. Starting fresh.")
+        return {}
+
+
+def save_upload_state(state_file, state):
+    tmp_path = state_file + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_file)
+
+
+class LocalHandoff:
+    """Hands new session CSV lines to a backend on the same host through a spool directory.
+
+    Uses the same append-only segment and manifest naming as the Drive
+    uploads, with its own offsets, but a segment is cut on every call (the
+    main loop calls about once a second) and only moved into the spool with
+    an atomic rename, so the backend never reads a partial segment. Writing
+    a local file takes microseconds, so this runs inline instead of on the
+    upload workers.
+    """
+
+    def __init__(self, spool_dir, state_file=HANDOFF_STATE_FILE):
+        self.spool_dir = spool_dir
+        self.state_file = state_file
+        self.state = load_upload_state(state_file)
+        self.lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def pending(self, name, size):
+        """True if a file of this name and size still has lines or a manifest to hand off."""
+        entry = self.state.get(name)
+        return entry is None or not entry['finalized'] or size != entry['offset']
+
+    def _write(self, name, data):
+        tmp_path = os.path.join(self.spool_dir, "." + name + ".tmp")   # Hidden: the backend skips dotfiles
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.spool_dir, name))
+
+    def hand_off(self, filepath, final=False):
+        """Moves the lines appended to filepath since the last call into the spool. Returns the bytes handed off."""
+        name = os.path.basename(filepath)
+        stem = os.path.splitext(name)[0]
+        with self.lock:
+            entry = dict(self.state.get(name) or {'offset': 0, 'parts': 0, 'finalized': False})
+            try:
+                size = os.path.getsize(filepath)
+                if size < entry['offset']:
+                    logging.warning(f"{name} shrank below the handed-off offset; handing it off again from the start.")
+                    entry['offset'] = 0
+                with open(filepath, 'rb') as f:
+                    f.seek(entry['offset'])
+                    data = f.read(size - entry['offset'])
+                if not final:
+                    data = data[:data.rfind(b'\n') + 1]
+                if data:
+                    self._write(SEGMENT_NAME_FORMAT.format(stem=stem, index=entry['parts']), data)
+                    entry['offset'] += len(data)
+                    entry['parts'] += 1
+                    entry['finalized'] = False
+                if final and not entry['finalized']:
+                    manifest = {'session': stem, 'parts': entry['parts'], 'bytes': entry['offset']}
+                    self._write(MANIFEST_NAME_FORMAT.format(stem=stem), json.dumps(manifest).encode('utf-8'))
+                    entry['finalized'] = True
+            except OSError as e:
+                logging.error(f"Could not hand off {name} to {self.spool_dir}: {e}")
+                return 0
+            if data or final:
+                self.state[name] = entry
+                try:
+                    save_upload_state(self.state_file, self.state)
+                except OSError as e:
+                    logging.error(f"Could not write handoff state {self.state_file}: {e}")
+            return len(data)
+
+
 # --- WATCHDOG EVENT HANDLER ---
 class CSVHandler(FileSystemEventHandler):
-    def __init__(self, drive_service, drive_folder_id):
-        self.drive_service = drive_service
+    """Uploads the session CSVs written by ble_receiver.py as append-only segments.
+
+    Each upload only sends the bytes appended since the previous one, cut at
+    the last complete line, as a new `<session>.partNNNN.csv` Drive file. The
+    uploaded offset of every file is persisted, so a restart resumes where it
+    stopped. When a session closes (the writer closes the file, or it stays
+    unchanged for FINALIZE_IDLE_SECONDS) the remaining tail is uploaded and a
+    small manifest listing the segments marks the session as complete.
+
+    Filesystem events only enqueue work: uploads run on the UploadQueue
+    worker pool, so a slow upload never holds up the observer thread.
+
+    With a LocalHandoff the same lines also reach a backend on this host
+    through its spool directory within a second (see hand_off_local), and
+    Drive becomes the backup copy; drive_backup=False skips Drive entirely.
+    """
+
+    def __init__(self, drive_folder_id, state_file=UPLOAD_STATE_FILE, workers=UPLOAD_WORKERS,
+                 handoff=None, drive_backup=True):
         self.drive_folder_id = drive_folder_id
-        self.processed_files = {}
+        self.handoff = handoff
+        self.drive_backup = drive_backup
+        self.state_file = state_file
+        self.state = load_upload_state(state_file)
+        self.lock = threading.Lock()    # Guards self.state and the state file
+        self.queue = UploadQueue(self.upload_new_data, workers=workers)
+        self.last_modified = {}     # path -> time of the latest filesystem event
+        self.last_uploaded = {}     # path -> time of the latest segment upload
+
+    def resume_pending(self, directory):
+        """Picks up session CSVs that changed while the uploader was not running."""
+        for name in os.listdir(directory):
+            filepath = os.path.join(directory, name)
+            if not name.lower().endswith(".csv") or not os.path.isfile(filepath):
+                continue
+            size = os.path.getsize(filepath)
+            entry = self.state.get(name)
+            drive_pending = entry is None or not entry['finalized'] or size != entry['offset']
+            if (self.drive_backup and drive_pending) or (self.handoff and self.handoff.pending(name, size)):
+                self.last_modified[filepath] = os.path.getmtime(filepath)
 
     def on_created(self, event):
         if not event.is_directory and event.src_path.lower().endswith(".csv"):
@@ -85,24 +224,122 @@ class CSVHandler(FileSystemEventHandler):
         if not event.is_directory and event.src_path.lower().endswith(".csv"):
             self._process_file(event.src_path, "modified")
 
+    def on_closed(self, event):
+        if not event.is_directory and event.src_path.lower().endswith(".csv"):
+            self._process_file(event.src_path, "closed")
+
     def _process_file(self, filepath, event_type):
-        
         current_time = time.time()
-        last_processed_time = self.processed_files.get(filepath, 0)
+        self.last_modified[filepath] = current_time
+        if event_type == "closed":
+            self._submit(filepath, final=True)
+        elif current_time - self.last_uploaded.get(filepath, 0) >= SEGMENT_INTERVAL_SECONDS:
+            self.last_uploaded[filepath] = current_time
+            self._submit(filepath)
 
-        if current_time - last_processed_time < 2: 
-            return
+    def _submit(self, filepath, final=False):
+        if final and self.handoff:
+            self.handoff.hand_off(filepath, final=True)
+        if self.drive_backup:
+            self.queue.submit(filepath, final=final)
+
+    def hand_off_local(self):
+        """Hands the new lines of every active session to the local spool."""
+        if self.handoff:
+            for filepath in list(self.last_modified):
+                self.handoff.hand_off(filepath)
+
+    def upload_due(self, force=False):
+        """Queues files whose latest changes have waited SEGMENT_INTERVAL_SECONDS (or all of them if force)."""
+        current_time = time.time()
+        for filepath, modified in list(self.last_modified.items()):
+            last_uploaded = self.last_uploaded.get(filepath, 0)
+            if modified > last_uploaded and (force or current_time - last_uploaded >= SEGMENT_INTERVAL_SECONDS):
+                self.last_uploaded[filepath] = current_time
+                self._submit(filepath)
+
+    def finalize_idle(self):
+        """Finalizes sessions whose file has not changed for FINALIZE_IDLE_SECONDS."""
+        current_time = time.time()
+        for filepath, modified in list(self.last_modified.items()):
+            if current_time - modified >= FINALIZE_IDLE_SECONDS:
+                self._submit(filepath, final=True)
+                self.last_modified.pop(filepath, None)
+                self.last_uploaded.pop(filepath, None)
 
-        logging.info(f"CSV file {event_type}: {filepath}")
-        time.sleep(1)
+    def upload_new_data(self, filepath, final=False):
+        """Uploads the bytes appended to filepath since the last segment.
+
+        Runs on an upload worker; the queue guarantees one call per file at a
+        time. Returns the number of bytes uploaded, or None on errors, in
+        which case the file is retried after SEGMENT_INTERVAL_SECONDS.
+        """
+        uploaded = self._upload_segment(filepath, final)
+        if uploaded is None:
+            self.last_modified[filepath] = time.time()
+        return uploaded
+
+    def _upload_segment(self, filepath, final):
+        name = os.path.basename(filepath)
+        stem = os.path.splitext(name)[0]
+        try:
+            size = os.path.getsize(filepath)
+        except OSError:
+            logging.warning(f"File {filepath} no longer exists. Skipping upload.")
+            return 0
+        with self.lock:
+            entry = dict(self.state.get(name) or {'offset': 0, 'parts': 0, 'finalized': False})
+        if size < entry['offset']:
+            logging.warning(f"{name} shrank below the uploaded offset; uploading it again from the start.")
+            entry['offset'] = 0
+        if size == entry['offset'] and (entry['finalized'] or not final):
+            return 0
+
+        try:
+            with open(filepath, 'rb') as f:
+                f.seek(entry['offset'])
+                data = f.read(size - entry['offset'])
+        except OSError as e:
+            logging.error(f"Error reading file {filepath}: {e}")
+            return None
+        if not final:
+            # Only upload complete lines; the rest goes with the next segment
+            data = data[:data.rfind(b'\n') + 1]
+
+        if data:
+            segment_name = SEGMENT_NAME_FORMAT.format(stem=stem, index=entry['parts'])
+            if not upload_bytes_to_drive(get_drive_service(), data, segment_name, self.drive_folder_id):
+                return None
+            entry['offset'] += len(data)
+            entry['parts'] += 1
+            entry['finalized'] = False
+            self._save_entry(name, entry)
+
+        if final and not entry['finalized']:
+            manifest = {
+                'session': stem,
+                'parts': [SEGMENT_NAME_FORMAT.format(stem=stem, index=i) for i in range(entry['parts'])],
+                'bytes': entry['offset'],
+            }
+            manifest_name = MANIFEST_NAME_FORMAT.format(stem=stem)
+            if not upload_bytes_to_drive(get_drive_service(), json.dumps(manifest).encode('utf-8'),
+                                         manifest_name, self.drive_folder_id, mimetype='application/json'):
+                return None
+            entry['finalized'] = True
+            self._save_entry(name, entry)
+            logging.info(f"Session {stem} finalized: {entry['parts']} segment(s), {entry['offset']} bytes.")
+        return len(data)
+
+    def _save_entry(self, name, entry):
+        with self.lock:
+            self.state[name] = entry
+            self._save_state()
+
+    def _save_state(self):
         try:
-            if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-                upload_file_to_drive(self.drive_service, filepath, self.drive_folder_id)
-                self.processed_files[filepath] = current_time
-            else:
-                logging.warning(f"File {filepath} is empty or no longer exists. Skipping upload.")
-        except Exception as e:
-            logging.error(f"Error processing file {filepath}: {e}")
+            save_upload_state(self.state_file, self.state)
+        except OSError as e:
+            logging.error(f"Could not write upload state {self.state_file}: {e}")
 
 
 if __name__ == "__main__":
@@ -117,20 +354,43 @@ if __name__ == "__main__":
     logging.info("Attempting to authenticate with Google Drive...")
     drive_service = get_drive_service()
 
-    if not drive_service:
+    if drive_service:
+        logging.info("Successfully authenticated with Google Drive.")
+    elif LOCAL_INGEST_DIR:
+        logging.warning("Could not connect to Google Drive. Sessions are only handed to the local backend.")
+    else:
         logging.error("Could not connect to Google Drive. Exiting.")
         exit()
-    logging.info("Successfully authenticated with Google Drive.")
+
+    handoff = None
+    if LOCAL_INGEST_DIR:
+        logging.info(f"Handing session data to the local backend through {LOCAL_INGEST_DIR}.")
+        handoff = LocalHandoff(LOCAL_INGEST_DIR)
 
     logging.info(f"Monitoring directory: {LOCAL_DIR_TO_WATCH} for .csv files...")
-    event_handler = CSVHandler(drive_service, DRIVE_FOLDER_ID)
+    event_handler = CSVHandler(DRIVE_FOLDER_ID, handoff=handoff, drive_backup=bool(drive_service))
+    event_handler.resume_pending(LOCAL_DIR_TO_WATCH)
     observer = Observer()
     observer.schedule(event_handler, LOCAL_DIR_TO_WATCH, recursive=False) # Set recursive=True if you want to watch subfolders
+    event_handler.queue.start()
     observer.start()
+    metrics.register_collector(upload_queue_metrics(event_handler.queue))
+    stop_metrics = metrics.start_textfile_writer(METRICS_FILE)
 
     try:
+        last_metrics_log = time.time()
         while True:
             time.sleep(1)
+            event_handler.hand_off_local()
+            event_handler.upload_due()
+            event_handler.finalize_idle()
+            if time.time() - last_metrics_log >= METRICS_LOG_INTERVAL_SECONDS:
+                queue_metrics = event_handler.queue.metrics()
+                logging.info(f"Upload queue: depth={queue_metrics['queue_depth']} in_flight={queue_metrics['in_flight']} "
+                             f"uploads={queue_metrics['uploads']} failures={queue_metrics['failures']} "
+                             f"avg_latency={queue_metrics['avg_latency_seconds']:.2f}s "
+                             f"rate={queue_metrics['bytes_per_second']:.0f}B/s")
+                last_metrics_log = time.time()
     except KeyboardInterrupt:
         logging.info("Monitoring stopped by user.")
     except Exception as e:
@@ -138,4 +398,10 @@ if __name__ == "__main__":
     finally:
         observer.stop()
         observer.join()
+        # Sessions may still be recording, so upload what is there without finalizing them
+        event_handler.hand_off_local()
+        event_handler.upload_due(force=True)
+        event_handler.queue.stop(drain=True)
+        stop_metrics.set()
+        metrics.write_textfile(METRICS_FILE)
         logging.info("Observer shut down.")
\ No newline at end of file
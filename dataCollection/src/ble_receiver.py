@@ -1,112 +1,396 @@
 import asyncio
 import csv
+import struct
+import time
 from datetime import datetime
 from bleak import BleakClient, BleakScanner
-import requests
+import numpy as np
 import os
+import sys
+from alert_forwarder import AlertForwarder
+from pose_pusher import PosePusher
+
+# Share the posture signal-processing stage with the backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../webApp/backend'))
+from posture_signal import PostureSignal
+import metrics
 
 FLASK_SERVER_URL = os.getenv('FLASK_SERVER_URL', "http://127.0.0.1:5000/alert")
+CSV_FLUSH_INTERVAL_SECONDS = float(os.getenv('CSV_FLUSH_INTERVAL_SECONDS', "1.0"))
+CSV_FLUSH_BYTES = int(os.getenv('CSV_FLUSH_BYTES', "16384"))
+VERBOSE = os.getenv('BLE_VERBOSE', "0") == "1" # Print every received sample
+MAX_DEVICES = int(os.getenv('BLE_MAX_DEVICES', "30"))
+# "binary" uses the packed 50 Hz characteristic when the firmware has it, "csv" keeps the 5 Hz text stream
+SAMPLE_PROTOCOL = os.getenv('BLE_SAMPLE_PROTOCOL', "binary")
+SCAN_INTERVAL_SECONDS = 10.0
+SCAN_TIMEOUT_SECONDS = 5.0
+RECONNECT_INITIAL_SECONDS = 2.0
+RECONNECT_MAX_SECONDS = 30.0
+SCAN_RETRY_MAX_SECONDS = 120.0  # Longest wait between scans while the adapter keeps failing
+# A board that stays disconnected this long is dropped (and freed from MAX_DEVICES) until a scan finds it again
+DEVICE_GIVE_UP_SECONDS = float(os.getenv('BLE_DEVICE_GIVE_UP_SECONDS', "300"))
+METRICS_FILE = os.getenv('RECEIVER_METRICS_FILE', "receiver_metrics.prom")  # Prometheus textfile dump
+POSE_PUSH_ENABLED = os.getenv('POSE_PUSH_ENABLED', "1") == "1"   # Stream live samples to the backend's /api/pose
 
+DEVICE_NAME = "NiclaSenseCSV"
 ORIENTATION_SERVICE_UUID = "19B10000-E8F2-537E-4F6C-D104768A1214"
 CSV_DATA_CHARACTERISTIC_UUID = "19B10001-E8F2-537E-4F6C-D104768A1214"
 ALERT_DATA_CHARACTERISTIC_UUID = "19B10002-E8F2-537E-4F6C-D104768A1214"
+BINARY_DATA_CHARACTERISTIC_UUID = "19B10003-E8F2-537E-4F6C-D104768A1214"
 
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-csv_filename = f"nicla_orientation_{timestamp}.csv"
-csv_file = None
-csv_writer = None
-header_written = False
+# Binary packet layout (little-endian), see hardware/src/main.cpp
+BINARY_HEADER = struct.Struct('<HBB')        # sequence number, sample count, format version
+BINARY_FORMAT_VERSION = 1
+BINARY_SAMPLE_DTYPE = np.dtype([('timestamp', '<u4'), ('pitch', '<i2'), ('roll', '<i2'), ('yaw', '<i2')])
+CSV_HEADER = ['timestamp', 'pitch', 'roll', 'yaw']
 
-def csv_callback(sender, data):
-    """Handle incoming data notifications from the BLE device"""
-    global csv_file, csv_writer, header_written
-    
-    data_string = data.decode('utf-8')
-    print(f"Received: {data_string}")
-    
-    values = data_string.strip().split(',')
-    
-    if not header_written and 'timestamp' in data_string:
-        csv_writer.writerow(values)
-        header_written = True
-    elif len(values) >= 4:
-        csv_writer.writerow(values)
-        # Ensure data is written to disk
+SAMPLES_RECEIVED = metrics.Counter('posture_ble_samples_total', 'Orientation samples received', ['device'])
+LOST_PACKETS = metrics.Counter('posture_ble_lost_packets_total', 'Binary packets missing from the sequence', ['device'])
+ALERTS_RECEIVED = metrics.Counter('posture_ble_alerts_total', 'Alerts received from the boards', ['device'])
+CONNECTED_DEVICES = metrics.Gauge('posture_ble_connected_devices', 'Boards currently recording')
+CSV_WRITE_SECONDS = metrics.Histogram('posture_csv_write_seconds', 'Time to write a batch of CSV rows or flush the file',
+                                      ['operation'])
+
+
+def decode_binary_packet(data):
+    """Decodes one binary notification into (sequence number, samples).
+
+    samples is a structured array with the device timestamp (ms) and
+    pitch/roll/yaw in hundredths of a degree. Raises ValueError for
+    packets that are truncated or of an unknown format version.
+    """
+    if len(data) < BINARY_HEADER.size:
+        raise ValueError(f"binary packet too short ({len(data)} bytes)")
+    sequence, count, version = BINARY_HEADER.unpack_from(data)
+    if version != BINARY_FORMAT_VERSION:
+        raise ValueError(f"unsupported binary format version {version}")
+    if len(data) < BINARY_HEADER.size + count * BINARY_SAMPLE_DTYPE.itemsize:
+        raise ValueError(f"binary packet truncated ({len(data)} bytes for {count} samples)")
+    return sequence, np.frombuffer(data, dtype=BINARY_SAMPLE_DTYPE, count=count, offset=BINARY_HEADER.size)
+
+
+async def csv_writer_task(queue, csv_file, on_sample=None):
+    """Drain received samples into the CSV file in batches.
+
+    The file is flushed once CSV_FLUSH_INTERVAL_SECONDS have passed or
+    CSV_FLUSH_BYTES are pending, instead of once per sample. A None item
+    stops the task after everything queued before it has been written.
+    Items are CSV notifications (bytes) or decoded binary samples (arrays).
+    on_sample(values) is called with the fields of every data row.
+    """
+    loop = asyncio.get_running_loop()
+    csv_writer = csv.writer(csv_file)
+    header_written = False
+    pending_bytes = 0
+    last_flush = loop.time()
+    stopping = False
+
+    try:
+        while not stopping:
+            timeout = max(0.0, CSV_FLUSH_INTERVAL_SECONDS - (loop.time() - last_flush))
+            try:
+                batch = [await asyncio.wait_for(queue.get(), timeout=timeout)]
+            except asyncio.TimeoutError:
+                batch = []
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+
+            rows = []
+            for data in batch:
+                if data is None:
+                    stopping = True
+                    break
+                if isinstance(data, np.ndarray):
+                    if not header_written:
+                        rows.append(CSV_HEADER)
+                        header_written = True
+                    for values in zip(data['timestamp'].tolist(), *(np.round(data[name] / 100, 2).tolist()
+                                                                       for name in ('pitch', 'roll', 'yaw'))):
+                        rows.append(values)
+                        if on_sample:
+                            on_sample(values)
+                    pending_bytes += data.nbytes
+                    continue
+                data_string = data.decode('utf-8', errors='replace')
+                if VERBOSE:
+                    print(f"Received: {data_string}")
+
+                values = data_string.strip().split(',')
+                if not header_written and 'timestamp' in data_string:
+                    rows.append(values)
+                    header_written = True
+                elif len(values) >= 4:
+                    rows.append(values)
+                    if on_sample:
+                        on_sample(values)
+                pending_bytes += len(data)
+
+            if rows:
+                with CSV_WRITE_SECONDS.labels('write').time():
+                    csv_writer.writerows(rows)
+            if pending_bytes and (pending_bytes >= CSV_FLUSH_BYTES or loop.time() - last_flush >= CSV_FLUSH_INTERVAL_SECONDS):
+                with CSV_WRITE_SECONDS.labels('flush').time():
+                    csv_file.flush()
+                pending_bytes = 0
+                last_flush = loop.time()
+            elif not pending_bytes:
+                last_flush = loop.time()
+    finally:
+        # Always persist whatever was received, also when the task is cancelled
         csv_file.flush()
+
+
+class DeviceSession:
+    """Recording state for one Nicla device.
+
+    Each connection gets its own CSV file and writer task, so a device that
+    reboots (and restarts its millis() clock) never mixes two timelines in
+    one file. The session reconnects with backoff until it is cancelled;
+    main() cancels it once the device has been gone for DEVICE_GIVE_UP_SECONDS.
+    """
+
+    def __init__(self, address, name, alert_forwarder, connect_lock, pose_pusher=None):
+        self.address = address
+        self.name = name or DEVICE_NAME
+        self.device_id = address.replace(':', '').replace('-', '').upper()
+        self.alert_forwarder = alert_forwarder
+        self.connect_lock = connect_lock
+        self.pose_pusher = pose_pusher
+        self.csv_filename = None
+        self.csv_file = None
+        self.sample_queue = None
+        self.writer_task = None
+        self.samples_metric = None
+        self.signal = None
+        self.episodes = 0
+        self.last_sequence = None
+        self.lost_packets = 0
+        self.task = None
+        self.connected = False
+        self.disconnected_since = time.monotonic()
+
+    def gone_for(self):
+        """Seconds since the device was last connected (0 while it is)."""
+        return 0.0 if self.connected else time.monotonic() - self.disconnected_since
+
+    def csv_callback(self, sender, data):
+        """Handle incoming data notifications from the BLE device"""
+        # Runs on the BLE notification path: only hand the raw payload to the writer task
+        self.sample_queue.put_nowait(bytes(data))
+
+    def binary_callback(self, sender, data):
+        """Handle packed binary sample notifications"""
+        try:
+            sequence, samples = decode_binary_packet(bytes(data))
+        except ValueError as e:
+            print(f"[{self.device_id}] Dropped binary packet: {e}")
+            return
+        if self.last_sequence is not None:
+            lost = (sequence - self.last_sequence - 1) & 0xFFFF
+            if lost:
+                self.lost_packets += lost
+                LOST_PACKETS.labels(self.device_id).inc(lost)
+                print(f"[{self.device_id}] Lost {lost} binary packet(s) before #{sequence}")
+        self.last_sequence = sequence
+        self.sample_queue.put_nowait(samples)
+
+    def on_sample(self, values):
+        """Feed one CSV row into the live posture state machine and the live pose push"""
+        try:
+            timestamp, pitch, roll, yaw = int(values[0]), float(values[1]), float(values[2]), float(values[3])
+        except ValueError:
+            return
+        self.samples_metric.inc()
+        if self.pose_pusher:
+            self.pose_pusher.add(self.device_id, timestamp, pitch, roll, yaw)
+        self.report_episode(self.signal.update(timestamp, pitch, roll))
+
+    def report_episode(self, episode):
+        if not episode:
+            return
+        self.episodes += 1
+        duration = (episode['end_ts'] - episode['start_ts']) / 1000
+        print(f"[{self.device_id}] Posture episode: {episode['type']} for {duration:.1f}s "
+              f"(peak {episode['peak_angle']:.1f} deg)")
+
+    def alert_callback(self, sender, data):
+        """Handle incoming alert messages"""
         
-def alert_callback(sender, data):
-    """Handle incoming alert messages"""
-   
-    alert_str = data.decode('utf-8')
-    
-    if alert_str and "ALERT" in alert_str:
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        formatted_alert = f"[{current_time}] {alert_str}"
-        
-        print("\033[91m" + formatted_alert + "\033[0m")  
+        alert_str = data.decode('utf-8')
         
-        # Forward the alert to Flask server
-        try:
+        if alert_str and "ALERT" in alert_str:
+            ALERTS_RECEIVED.labels(self.device_id).inc()
+            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            formatted_alert = f"[{current_time}] [{self.device_id}] {alert_str}"
+            
+            print("\033[91m" + formatted_alert + "\033[0m")  
+            
+            # Forward the alert to Flask server in the background
             payload = {
                 "timestamp": current_time,
-                "message": alert_str
+                "message": alert_str,
+                "device_id": self.device_id
             }
-            
-            response = requests.post(FLASK_SERVER_URL, json=payload)
-            if response.status_code == 200:
-                print(f"Alert successfully sent to server: {response.text}")
+            self.alert_forwarder.submit(payload)
+
+    async def run(self):
+        backoff = RECONNECT_INITIAL_SECONDS
+        while True:
+            try:
+                connected = await self._record_connection()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{self.device_id}] Error: {e}")
+                connected = False
+            if connected:
+                backoff = RECONNECT_INITIAL_SECONDS
+            print(f"[{self.device_id}] Reconnecting in {backoff:.0f}s...")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+
+    def start_recording(self):
+        """Open a new session CSV and start its writer task. The callbacks are live afterwards."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.csv_filename = f"nicla_orientation_{timestamp}_{self.device_id}.csv"
+        # Append: a reconnect within the same second reuses the file instead of truncating it
+        self.csv_file = open(self.csv_filename, 'a', newline='')
+        self.sample_queue = asyncio.Queue()
+        self.signal = PostureSignal()
+        self.episodes = 0
+        self.last_sequence = None
+        self.lost_packets = 0
+        self.writer_task = asyncio.create_task(csv_writer_task(self.sample_queue, self.csv_file, self.on_sample))
+        self.samples_metric = SAMPLES_RECEIVED.labels(self.device_id)
+        self.connected = True
+        CONNECTED_DEVICES.inc()
+
+    async def stop_recording(self):
+        """Write every queued sample, then close the session CSV."""
+        self.sample_queue.put_nowait(None)
+        try:
+            await self.writer_task
+        except asyncio.CancelledError:
+            pass
+        self.csv_file.close()
+        self.connected = False
+        self.disconnected_since = time.monotonic()
+        CONNECTED_DEVICES.inc(-1)
+        self.report_episode(self.signal.flush())
+        print(f"[{self.device_id}] Data saved to {self.csv_filename} ({self.episodes} posture episode(s), "
+              f"{self.lost_packets} lost binary packet(s))")
+
+    async def _record_connection(self):
+        """Record one connection until the device disconnects. Returns True if it connected."""
+        disconnected = asyncio.Event()
+        client = BleakClient(self.address, disconnected_callback=lambda c: disconnected.set())
+
+        # Most adapters cannot scan and connect at the same time
+        async with self.connect_lock:
+            await client.connect()
+
+        self.start_recording()
+        print(f"[{self.device_id}] Connected to {self.name}, logging data to {self.csv_filename}")
+
+        try:
+            binary = (SAMPLE_PROTOCOL == "binary"
+                      and client.services.get_characteristic(BINARY_DATA_CHARACTERISTIC_UUID) is not None)
+            if binary:
+                await client.start_notify(BINARY_DATA_CHARACTERISTIC_UUID, self.binary_callback)
             else:
-                print(f"Failed to send alert to server. Status code: {response.status_code}")
-        
-        except Exception as e:
-            print(f"Error sending alert to server: {e}")
+                await client.start_notify(CSV_DATA_CHARACTERISTIC_UUID, self.csv_callback)
+            print(f"[{self.device_id}] Receiving {'binary' if binary else 'CSV'} samples")
+            await client.start_notify(ALERT_DATA_CHARACTERISTIC_UUID, self.alert_callback)
+            await disconnected.wait()
+            print(f"[{self.device_id}] Disconnected from {self.name}")
+        finally:
+            if client.is_connected:
+                try:
+                    await client.disconnect()
+                except Exception as e:
+                    print(f"[{self.device_id}] Error while disconnecting: {e}")
+            await self.stop_recording()
+        return True
+
+
+async def prune_sessions(sessions):
+    """Drop sessions whose task ended or whose device has been gone for DEVICE_GIVE_UP_SECONDS."""
+    for address, session in list(sessions.items()):
+        if session.task.done():
+            if not session.task.cancelled() and session.task.exception():
+                print(f"[{session.device_id}] Session ended with an error: {session.task.exception()}")
+        elif session.gone_for() > DEVICE_GIVE_UP_SECONDS:
+            print(f"[{session.device_id}] Not seen for {DEVICE_GIVE_UP_SECONDS:.0f}s; dropping it until it is found again")
+            session.task.cancel()
+            await asyncio.gather(session.task, return_exceptions=True)
+        else:
+            continue
+        del sessions[address]
+
 
 async def main():
-    global csv_file, csv_writer
-    
-    print("Scanning for NiclaSenseCSV device...")
-    
-    device = await BleakScanner.find_device_by_name("NiclaSenseCSV")
-    
-    if device is None:
-        print("Could not find Nicla Sense device.")
-        return
+    alert_forwarder = AlertForwarder(FLASK_SERVER_URL)
+    await alert_forwarder.start()
+    metrics.register_collector(lambda: [
+        ('posture_alert_forward_pending', 'gauge', 'Alerts waiting to be delivered to the backend',
+         len(alert_forwarder.pending)),
+        ('posture_alert_forward_dropped_total', 'counter', 'Oldest alerts dropped because the queue was full',
+         alert_forwarder.dropped),
+    ])
+    pose_pusher = None
+    if POSE_PUSH_ENABLED:
+        pose_pusher = PosePusher()
+        await pose_pusher.start()
+        metrics.register_collector(lambda: [
+            ('posture_pose_push_dropped_total', 'counter', 'Live pose samples dropped while the backend was unreachable',
+             pose_pusher.dropped),
+        ])
+    stop_metrics = metrics.start_textfile_writer(METRICS_FILE)
+    connect_lock = asyncio.Lock()
+    sessions = {}
     
-    print(f"Found device: {device.name} [{device.address}]")
-    
-    csv_file = open(csv_filename, 'w', newline='')
-    csv_writer = csv.writer(csv_file)
-    
-    print(f"Starting to log data to {csv_filename}")
+    print(f"Scanning for {DEVICE_NAME} devices (up to {MAX_DEVICES})...")
     print("Press Ctrl+C to stop recording")
     
+    scan_wait = SCAN_INTERVAL_SECONDS
     try:
-        async with BleakClient(device) as client:
-            print(f"Connected to {device.name}")
-            
-            await client.start_notify(
-                CSV_DATA_CHARACTERISTIC_UUID, 
-                csv_callback
-            )
-            
-            await client.start_notify(
-                ALERT_DATA_CHARACTERISTIC_UUID, 
-                alert_callback
-            )
-            
-            print("Receiving data... (press Ctrl+C to stop)")
-            
-            while True:
-                await asyncio.sleep(1.0)
+        while True:
+            await prune_sessions(sessions)
+            if len(sessions) < MAX_DEVICES:
+                try:
+                    async with connect_lock:
+                        devices = await BleakScanner.discover(timeout=SCAN_TIMEOUT_SECONDS)
+                except Exception as e:
+                    # Adapter reset, BlueZ D-Bus error...: keep the connected sessions and scan again later
+                    print(f"Scan failed: {e}. Retrying in {scan_wait:.0f}s...")
+                    await asyncio.sleep(scan_wait)
+                    scan_wait = min(scan_wait * 2, SCAN_RETRY_MAX_SECONDS)
+                    continue
+                scan_wait = SCAN_INTERVAL_SECONDS
+                for device in devices:
+                    if device.name != DEVICE_NAME or device.address in sessions:
+                        continue
+                    if len(sessions) >= MAX_DEVICES:
+                        print(f"Device limit reached; ignoring {device.address}")
+                        break
+                    print(f"Found device: {device.name} [{device.address}]")
+                    session = DeviceSession(device.address, device.name, alert_forwarder, connect_lock,
+                                            pose_pusher)
+                    session.task = asyncio.create_task(session.run())
+                    sessions[device.address] = session
+            await asyncio.sleep(SCAN_INTERVAL_SECONDS)
                 
     except asyncio.CancelledError:
         print("Recording stopped")
-    except Exception as e:
-        print(f"Error: {e}")
     finally:
-        if csv_file:
-            csv_file.close()
-            print(f"Data saved to {csv_filename}")
+        for session in sessions.values():
+            session.task.cancel()
+        await asyncio.gather(*(s.task for s in sessions.values()), return_exceptions=True)
+        await alert_forwarder.close()
+        if pose_pusher:
+            await pose_pusher.close()
+        stop_metrics.set()
+        metrics.write_textfile(METRICS_FILE)
 
 if __name__ == "__main__":
     try:
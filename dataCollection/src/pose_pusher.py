@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from collections import deque
+import aiohttp
+
+POSE_PUSH_URL = os.getenv('POSE_PUSH_URL', "http://127.0.0.1:5000/api/pose/batch")
+POSE_PUSH_INTERVAL_SECONDS = float(os.getenv('POSE_PUSH_INTERVAL_SECONDS', "0.5"))
+POSE_PUSH_TIMEOUT_SECONDS = 2.0
+POSE_PUSH_MAX_PENDING = 500     # Samples kept per device while the server is unreachable (10 s at 50 Hz)
+POSE_PUSH_BATCH_SIZE = 5000     # Matches the backend's per-request limit
+
+
+class PosePusher:
+    """Stream live orientation samples to the backend's pose ring buffers.
+
+    add() only appends to a bounded in-memory queue per device; a
+    background task posts every device's new samples in one request each
+    POSE_PUSH_INTERVAL_SECONDS over a keep-alive aiohttp session.
+    Live poses are only worth something while they are fresh, so unlike
+    the AlertForwarder nothing is spooled or retried: when the server is
+    unreachable the oldest samples simply fall out of the queue (the CSV
+    file still has them).
+    """
+
+    def __init__(self, url=POSE_PUSH_URL, interval_seconds=POSE_PUSH_INTERVAL_SECONDS):
+        self.url = url
+        self.interval_seconds = interval_seconds
+        self.pending = {}
+        self.session = None
+        self.dropped = 0
+        self._task = None
+        self._failing = False
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=2, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=POSE_PUSH_TIMEOUT_SECONDS),
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.session:
+            await self.session.close()
+
+    def add(self, device_id, timestamp, pitch, roll, yaw):
+        """Queue one sample, stamped with the receiver's wall clock. Never waits on the network."""
+        queue = self.pending.get(device_id)
+        if queue is None:
+            queue = self.pending[device_id] = deque(maxlen=POSE_PUSH_MAX_PENDING)
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append((round(time.time(), 3), timestamp, pitch, roll, yaw))
+
+    def pending_count(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+    def _take_batch(self):
+        devices = {}
+        budget = POSE_PUSH_BATCH_SIZE
+        for device_id, queue in self.pending.items():
+            rows = []
+            while queue and budget:
+                rows.append(queue.popleft())
+                budget -= 1
+            if rows:
+                devices[device_id] = rows
+        return devices
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            devices = self._take_batch()
+            if devices:
+                await self._post(devices)
+
+    async def _post(self, devices):
+        try:
+            async with self.session.post(self.url, json={"devices": devices}) as response:
+                if response.status != 200:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+            if self._failing:
+                print("Live pose push to the server resumed")
+                self._failing = False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.dropped += sum(len(rows) for rows in devices.values())
+            if not self._failing:
+                # Printed once per outage: at 2 pushes a second this would flood the console
+                print(f"Live pose push failed, dropping samples until the server is back: {e!r}")
+                self._failing = True
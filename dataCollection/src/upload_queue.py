@@ -0,0 +1,126 @@
+import time
+import logging
+import threading
+
+UPLOAD_WORKERS = 4
+METRICS_WINDOW_SECONDS = 60.0
+
+
+class UploadQueue:
+    """Coalescing upload queue drained by a bounded pool of worker threads.
+
+    submit() never blocks: repeated requests for a path that is already
+    queued collapse into one entry, and a path that is being uploaded is
+    only marked dirty and queued again once its upload finishes. At most
+    one upload per path is in flight, so the queue never holds more than
+    one entry per file however fast the receivers write.
+
+    upload_fn(path, final) returns the number of bytes it uploaded, or
+    None if the upload failed.
+    """
+
+    def __init__(self, upload_fn, workers=UPLOAD_WORKERS):
+        self.upload_fn = upload_fn
+        self.workers = workers
+        self._pending = {}      # path -> final flag, in submission order
+        self._in_flight = set()
+        self._dirty = {}        # path -> final flag for paths re-submitted while uploading
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+        # Metrics
+        self._uploads = 0
+        self._failures = 0
+        self._coalesced = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._bytes = 0
+        self._recent = []       # (finish time, bytes) within METRICS_WINDOW_SECONDS
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"upload-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain=True, timeout=None):
+        """Stops the workers, after the queued uploads if drain is True."""
+        with self._cond:
+            if not drain:
+                self._pending.clear()
+                self._dirty.clear()
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, path, final=False):
+        with self._cond:
+            if path in self._in_flight:
+                self._dirty[path] = self._dirty.get(path, False) or final
+                self._coalesced += 1
+            elif path in self._pending:
+                self._pending[path] = self._pending[path] or final
+                self._coalesced += 1
+            else:
+                self._pending[path] = final
+                self._cond.notify()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                path = next(iter(self._pending))
+                final = self._pending.pop(path)
+                self._in_flight.add(path)
+
+            started = time.monotonic()
+            try:
+                uploaded = self.upload_fn(path, final)
+            except Exception as e:
+                logging.error(f"Unexpected error uploading {path}: {e}")
+                uploaded = None
+            finished = time.monotonic()
+
+            with self._cond:
+                self._in_flight.discard(path)
+                self._record(finished - started, uploaded, finished)
+                if path in self._dirty:
+                    self._pending[path] = self._dirty.pop(path)
+                    self._cond.notify()
+
+    def _record(self, latency, uploaded, finished):
+        if uploaded is None:
+            self._failures += 1
+            return
+        self._uploads += 1
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        self._bytes += uploaded
+        if uploaded:
+            self._recent.append((finished, uploaded))
+        cutoff = finished - METRICS_WINDOW_SECONDS
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.pop(0)
+
+    def metrics(self):
+        """Snapshot of queue depth, upload latency and recent throughput."""
+        with self._cond:
+            cutoff = time.monotonic() - METRICS_WINDOW_SECONDS
+            recent_bytes = sum(n for finished, n in self._recent if finished >= cutoff)
+            return {
+                'queue_depth': len(self._pending),
+                'in_flight': len(self._in_flight),
+                'uploads': self._uploads,
+                'failures': self._failures,
+                'coalesced': self._coalesced,
+                'bytes': self._bytes,
+                'avg_latency_seconds': self._latency_total / self._uploads if self._uploads else 0.0,
+                'max_latency_seconds': self._latency_max,
+                'bytes_per_second': recent_bytes / METRICS_WINDOW_SECONDS,
+            }
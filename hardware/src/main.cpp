@@ -13,8 +13,23 @@ BLEService orientationService("19B10000-E8F2-537E-4F6C-D104768A1214");
 BLEStringCharacteristic csvDataCharacteristic("19B10001-E8F2-537E-4F6C-D104768A1214", BLERead | BLENotify, 128);
 BLEStringCharacteristic alertCharacteristic("19B10002-E8F2-537E-4F6C-D104768A1214", BLERead | BLENotify, 128);
 
+// Binary sample stream (format version 1), all fields little-endian:
+//   header: uint16 sequence number, uint8 sample count, uint8 format version
+//   sample: uint32 millis(), int16 pitch, int16 roll, int16 yaw (hundredths of a degree)
+// Samples are only taken while a central is subscribed, so the CSV stream is unaffected.
+const unsigned long BINARY_SAMPLE_PERIOD_MS = 20;   // 50 Hz
+const int BINARY_SAMPLES_PER_PACKET = 8;
+const int BINARY_HEADER_SIZE = 4;
+const int BINARY_SAMPLE_SIZE = 10;
+const uint8_t BINARY_FORMAT_VERSION = 1;
+const int BINARY_PACKET_SIZE = BINARY_HEADER_SIZE + BINARY_SAMPLES_PER_PACKET * BINARY_SAMPLE_SIZE;
+BLECharacteristic binaryDataCharacteristic("19B10003-E8F2-537E-4F6C-D104768A1214", BLERead | BLENotify, BINARY_PACKET_SIZE);
+
 char csvData[128];
 char alertMessage[128];
+uint8_t binaryPacket[BINARY_PACKET_SIZE];
+int binarySampleCount = 0;
+uint16_t binarySequence = 0;
 
 const float ALERT_THRESHOLD = 5.0;
 
@@ -39,6 +54,41 @@ void quaternionToEuler(float w, float x, float y, float z, float& p, float& r, f
   ya = ya * 180.0 / M_PI;
 }
 
+void putUint16(uint8_t* p, uint16_t v) {
+  p[0] = v & 0xFF;
+  p[1] = v >> 8;
+}
+
+void putUint32(uint8_t* p, uint32_t v) {
+  for (int i = 0; i < 4; i++) {
+    p[i] = (v >> (8 * i)) & 0xFF;
+  }
+}
+
+int16_t toCentiDegrees(float degrees) {
+  return (int16_t) lroundf(constrain(degrees, -327.67, 327.67) * 100.0);
+}
+
+void sendBinaryPacket() {
+  if (binarySampleCount == 0) return;
+  putUint16(binaryPacket, binarySequence++);
+  binaryPacket[2] = binarySampleCount;
+  binaryPacket[3] = BINARY_FORMAT_VERSION;
+  binaryDataCharacteristic.writeValue(binaryPacket, BINARY_HEADER_SIZE + binarySampleCount * BINARY_SAMPLE_SIZE);
+  binarySampleCount = 0;
+}
+
+void addBinarySample(unsigned long timestamp) {
+  uint8_t* p = binaryPacket + BINARY_HEADER_SIZE + binarySampleCount * BINARY_SAMPLE_SIZE;
+  putUint32(p, timestamp);
+  putUint16(p + 4, (uint16_t) toCentiDegrees(pitch));
+  putUint16(p + 6, (uint16_t) toCentiDegrees(roll));
+  putUint16(p + 8, (uint16_t) toCentiDegrees(yaw));
+  if (++binarySampleCount == BINARY_SAMPLES_PER_PACKET) {
+    sendBinaryPacket();
+  }
+}
+
 void setup() {
   Serial.begin(9600);
   
@@ -61,6 +111,7 @@ void setup() {
   BLE.setAdvertisedService(orientationService);
   orientationService.addCharacteristic(csvDataCharacteristic);
   orientationService.addCharacteristic(alertCharacteristic);
+  orientationService.addCharacteristic(binaryDataCharacteristic);
   BLE.addService(orientationService);
 
   csvDataCharacteristic.writeValue("timestamp,pitch,roll,yaw,gyro_x,gyro_y,gyro_z");
@@ -79,6 +130,8 @@ void loop() {
     Serial.print("Connected to central: ");
     Serial.println(central.address());
     nicla::leds.setColor(green);
+    binarySampleCount = 0;
+    binarySequence = 0;
     
     while (central.connected()) {
       static unsigned long lastUpdateTime = 0;
@@ -104,6 +157,12 @@ void loop() {
         
         Serial.println(csvData);
       }
+
+      static unsigned long lastBinaryTime = 0;
+      if (binaryDataCharacteristic.subscribed() && currentTime - lastBinaryTime >= BINARY_SAMPLE_PERIOD_MS) {
+        lastBinaryTime = currentTime;
+        addBinarySample(currentTime);
+      }
       
       //for a vertical NICLA
       if (currentTime - lastAlertTime >= 1000){
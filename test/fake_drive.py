@@ -0,0 +1,83 @@
+# fake_drive.py
+import os
+import time
+import uuid
+import threading
+
+# --- CONFIGURATION ---
+DEFAULT_UPLOAD_LATENCY_SECONDS = 0.05   # Rough round trip of a small Drive upload
+
+
+class _Request:
+    def __init__(self, run):
+        self._run = run
+
+    def execute(self):
+        return self._run()
+
+
+class _Files:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def create(self, body=None, media_body=None, fields=None):
+        return _Request(lambda: self._drive.store(body or {}, media_body))
+
+    def list(self, q=None, pageSize=None, pageToken=None, fields=None):
+        return _Request(lambda: {'files': self._drive.listing()})
+
+
+class FakeDriveService:
+    """Local stand-in for the subset of the Drive v3 client the uploader uses.
+
+    Created files are written into `folder` (atomically, like the backend's
+    downloader), so pointing it at the backend's downloaded_csvs directory
+    stands in for both the Drive upload and the backend's Drive fetch.
+    Each call sleeps latency_seconds to mimic the network.
+    """
+
+    def __init__(self, folder, latency_seconds=DEFAULT_UPLOAD_LATENCY_SECONDS):
+        self.folder = folder
+        self.latency_seconds = latency_seconds
+        self.files_created = 0
+        self.bytes_created = 0
+        self._names = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def files(self):
+        return _Files(self)
+
+    def store(self, metadata, media_body):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        data = media_body.getbytes(0, media_body.size()) if media_body is not None else b''
+        name = metadata['name']
+        file_id = uuid.uuid4().hex
+        path = os.path.join(self.folder, name)
+        tmp_path = path + ".part"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._names[file_id] = name
+            self.files_created += 1
+            self.bytes_created += len(data)
+        return {'id': file_id}
+
+    def listing(self):
+        with self._lock:
+            return [{'id': file_id, 'name': name} for file_id, name in self._names.items()]
+
+
+class FakeDriveHolder:
+    """Drop-in for google_drive_utils.DriveServiceHolder that hands out one FakeDriveService."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def get_service(self):
+        return self.service
+
+    def thread_http(self):
+        return None
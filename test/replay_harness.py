@@ -0,0 +1,360 @@
+# replay_harness.py
+"""Replays recorded or synthetic Nicla sessions through the receiver, uploader and backend.
+
+Every simulated device is a ble_receiver.DeviceSession fed through the same
+notification callbacks a real board triggers, at N x realtime. Alerts follow
+the firmware rule and go to the backend through the AlertForwarder; session
+CSVs go through the segment uploader into a local fake Drive folder that the
+backend reads as its download directory. At the end it reports throughput,
+alert latency (callback to the backend's /alerts/stream) and the latency of
+the dashboard endpoints.
+
+Start the backend in a scratch directory first, e.g.
+    cd /tmp/replay && DRIVE_FETCHER_MODE=off python /path/to/webApp/backend/app.py
+and then
+    python test/replay_harness.py --devices 10 --speed 20 --duration 600 \\
+        --drive-dir /tmp/replay/downloaded_csvs
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import contextlib
+import numpy as np
+import aiohttp
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_DIR, 'dataCollection', 'src'))
+sys.path.append(os.path.join(REPO_DIR, 'webApp', 'backend'))
+
+import ble_receiver
+import auto_upload_csv
+import posture_analytics
+from posture_signal import PITCH_LIMIT, ROLL_MIN, ROLL_MAX, UPRIGHT_ROLL
+from alert_forwarder import AlertForwarder
+from fake_drive import FakeDriveService, FakeDriveHolder, DEFAULT_UPLOAD_LATENCY_SECONDS
+from watchdog.observers import Observer
+
+# --- CONFIGURATION ---
+SAMPLE_RATE_HZ = 5                  # Rate of the firmware's CSV characteristic
+ALERT_INTERVAL_MS = 1000            # The firmware sends at most one alert per second
+PACING_SLACK_SECONDS = 0.005        # Feeders only sleep once they are this far ahead of schedule
+STATS_ENDPOINTS = {
+    'posture-stats': '/api/posture-stats?days=7',
+    'posture-timeseries': '/api/posture-timeseries?hours=24&points=300',
+    'posture-episodes': '/api/posture-episodes?days=7',
+}
+ALERT_DRAIN_TIMEOUT_SECONDS = 30    # How long to wait for in-flight alerts after the replay
+MARKER_PATTERN = re.compile(r'\[replay (\S+)\]$')
+
+
+def firmware_alert(pitch, roll):
+    """The alert message the vertical-board firmware sends for one sample, or None."""
+    side = abs(pitch) > PITCH_LIMIT
+    forward = abs(roll) > ROLL_MAX or abs(roll) < ROLL_MIN
+    if side and forward:
+        return f"ALERT: Both side ({pitch:.1f}°) and forward/backward ({UPRIGHT_ROLL - roll:.1f}°) tilt exceed threshold"
+    if side:
+        return f"ALERT: Side tilt ({pitch:.1f}°) exceeds threshold"
+    if forward:
+        return f"ALERT: Forward/backward tilt ({UPRIGHT_ROLL - roll:.1f}°) exceeds threshold"
+    return None
+
+
+def synthetic_session(duration_seconds, seed, rate_hz=SAMPLE_RATE_HZ):
+    """A sitting session: upright with sensor noise, plus slouching spells of about a minute."""
+    rng = np.random.default_rng(seed)
+    n = int(duration_seconds * rate_hz)
+    timestamps = (rng.integers(5000, 60000) + np.arange(n) * (1000 // rate_hz)).astype(np.int64)
+    pitch_target = np.zeros(n)
+    roll_target = np.full(n, 90.0)
+    i = int(rng.exponential(90 * rate_hz))
+    while i < n:
+        length = int(rng.exponential(60 * rate_hz)) + rate_hz
+        if rng.random() < 0.5:
+            pitch_target[i:i + length] = rng.choice([-1, 1]) * rng.uniform(7, 15)
+        else:
+            roll_target[i:i + length] = 90 + rng.choice([-1, 1]) * rng.uniform(12, 25)
+        i += length + int(rng.exponential(120 * rate_hz))
+    drift = np.cumsum(rng.normal(0, 0.05, n))
+    return {
+        'timestamp': timestamps,
+        'pitch': (pitch_target + drift * 0.2 + rng.normal(0, 0.6, n)).astype(np.float32),
+        'roll': (roll_target + rng.normal(0, 0.6, n)).astype(np.float32),
+        'yaw': np.cumsum(rng.normal(0, 0.2, n)).astype(np.float32),
+    }
+
+
+def recorded_session(path):
+    samples = posture_analytics.sorted_samples(posture_analytics.load_samples(path))
+    if 'yaw' not in samples:
+        samples['yaw'] = np.zeros(len(samples['timestamp']), dtype=np.float32)
+    return samples
+
+
+def percentile_summary(values):
+    if not values:
+        return {'count': 0}
+    ms = np.asarray(values) * 1000
+    return {
+        'count': len(values),
+        'p50_ms': round(float(np.percentile(ms, 50)), 1),
+        'p99_ms': round(float(np.percentile(ms, 99)), 1),
+        'max_ms': round(float(ms.max()), 1),
+    }
+
+
+class AlertLatencyTracker:
+    """Matches alerts seen on the backend's event stream with the time the receiver got them."""
+
+    def __init__(self):
+        self.sent = {}          # marker -> perf_counter() when alert_callback ran
+        self.latencies = []
+        self.unmatched = 0
+        self.connected = asyncio.Event()
+
+    def mark_sent(self, marker):
+        self.sent[marker] = time.perf_counter()
+
+    @property
+    def outstanding(self):
+        return len(self.sent)
+
+    async def listen(self, session, url):
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=None, sock_read=None)) as response:
+            self.connected.set()
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').rstrip('\n')
+                if not line.startswith('data: '):
+                    continue
+                received = time.perf_counter()
+                match = MARKER_PATTERN.search(json.loads(line[6:]).get('message') or '')
+                sent = self.sent.pop(match.group(1), None) if match else None
+                if sent is None:
+                    self.unmatched += 1
+                else:
+                    self.latencies.append(received - sent)
+
+
+class UploaderThread:
+    """Runs the segment uploader over the receivers' output directory, like auto_upload_csv.py's main loop."""
+
+    def __init__(self, watch_dir, state_file):
+        self.watch_dir = watch_dir
+        self.handler = auto_upload_csv.CSVHandler('replay', state_file=state_file)
+        self.observer = Observer()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='replay-uploader', daemon=True)
+
+    def start(self):
+        self.observer.schedule(self.handler, self.watch_dir, recursive=False)
+        self.handler.queue.start()
+        self.observer.start()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(1):
+            self.handler.upload_due()
+            self.handler.finalize_idle()
+
+    def stop(self):
+        """Finalizes every session and waits for all uploads."""
+        self._stop.set()
+        self._thread.join()
+        self.observer.stop()
+        self.observer.join()
+        for name in os.listdir(self.watch_dir):
+            if name.endswith('.csv'):
+                self.handler.queue.submit(os.path.join(self.watch_dir, name), final=True)
+        self.handler.queue.stop(drain=True)
+        return self.handler.queue.metrics()
+
+
+async def feed_device(device, samples, speed, tracker, counters):
+    """Replays one session through the device's notification callbacks at speed x realtime."""
+    loop = asyncio.get_running_loop()
+    timestamps = samples['timestamp'].tolist()
+    pitch = samples['pitch'].tolist()
+    roll = samples['roll'].tolist()
+    yaw = samples['yaw'].tolist()
+    start = loop.time()
+    first_ts = timestamps[0]
+    last_alert_ts = None
+    alerts = 0
+    for ts, p, r, y in zip(timestamps, pitch, roll, yaw):
+        delay = start + (ts - first_ts) / 1000 / speed - loop.time()
+        if delay > PACING_SLACK_SECONDS:
+            await asyncio.sleep(delay)
+        device.csv_callback(None, f"{ts},{p:.2f},{r:.2f},{y:.2f}".encode('utf-8'))
+        counters['samples'] += 1
+        if last_alert_ts is None or ts - last_alert_ts >= ALERT_INTERVAL_MS:
+            message = firmware_alert(p, r)
+            if message:
+                last_alert_ts = ts
+                alerts += 1
+                marker = f"{device.device_id}:{alerts}"
+                tracker.mark_sent(marker)
+                device.alert_callback(None, f"{message} [replay {marker}]".encode('utf-8'))
+                counters['alerts'] += 1
+
+
+async def poll_endpoints(session, server, interval, stop, latencies):
+    while not stop.is_set():
+        for name, path in STATS_ENDPOINTS.items():
+            started = time.perf_counter()
+            try:
+                async with session.get(server + path) as response:
+                    await response.read()
+                    if response.status == 200:
+                        latencies[name].append(time.perf_counter() - started)
+                    else:
+                        latencies[name + ' errors'].append(0)
+            except aiohttp.ClientError:
+                latencies[name + ' errors'].append(0)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def replay(args, sources):
+    server = args.server.rstrip('/')
+    receiver_dir = os.path.join(args.work_dir, 'receiver')
+    os.makedirs(receiver_dir, exist_ok=True)
+
+    drive = FakeDriveService(args.drive_dir, latency_seconds=args.drive_latency)
+    auto_upload_csv.drive_service_holder = FakeDriveHolder(drive)
+    auto_upload_csv.SEGMENT_INTERVAL_SECONDS = args.segment_interval
+    uploader = UploaderThread(receiver_dir, os.path.join(args.work_dir, 'upload_state.json'))
+    uploader.start()
+
+    tracker = AlertLatencyTracker()
+    counters = {'samples': 0, 'alerts': 0}
+    endpoint_latencies = {name: [] for name in STATS_ENDPOINTS}
+    endpoint_latencies.update({name + ' errors': [] for name in STATS_ENDPOINTS})
+
+    forwarder = AlertForwarder(server + '/alert', spool_file=os.path.join(args.work_dir, 'pending_alerts.json'))
+    async with aiohttp.ClientSession() as session:
+        listener = asyncio.create_task(tracker.listen(session, server + '/alerts/stream'))
+        await asyncio.wait_for(tracker.connected.wait(), 10)
+        await forwarder.start()
+
+        # DeviceSession writes its CSV into the working directory, like the real receiver
+        os.chdir(receiver_dir)
+        devices = []
+        for i in range(args.devices):
+            device = ble_receiver.DeviceSession(f"RE:PL:AY:00:{i // 256:02X}:{i % 256:02X}", "ReplayNicla",
+                                                forwarder, asyncio.Lock())
+            device.start_recording()
+            devices.append(device)
+
+        stop_polling = asyncio.Event()
+        poller = asyncio.create_task(poll_endpoints(session, server, args.stats_interval, stop_polling,
+                                                    endpoint_latencies))
+        started = time.perf_counter()
+        await asyncio.gather(*(feed_device(device, sources[i % len(sources)], args.speed, tracker, counters)
+                               for i, device in enumerate(devices)))
+        replay_seconds = time.perf_counter() - started
+        for device in devices:
+            await device.stop_recording()
+
+        deadline = time.perf_counter() + ALERT_DRAIN_TIMEOUT_SECONDS
+        while (forwarder.pending or tracker.outstanding) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        stop_polling.set()
+        await poller
+        listener.cancel()
+        await forwarder.close()
+
+    upload_started = time.perf_counter()
+    upload_metrics = await asyncio.get_running_loop().run_in_executor(None, uploader.stop)
+    return {
+        'devices': args.devices,
+        'speed': args.speed,
+        'replay_seconds': round(replay_seconds, 2),
+        'samples': counters['samples'],
+        'samples_per_second': round(counters['samples'] / replay_seconds, 1),
+        'alerts_sent': counters['alerts'],
+        'alerts_per_second': round(counters['alerts'] / replay_seconds, 2),
+        'alerts_delivered': len(tracker.latencies),
+        'alerts_missing': tracker.outstanding,
+        'alert_latency': percentile_summary(tracker.latencies),
+        'endpoints': {name: percentile_summary(values) if not name.endswith('errors') else len(values)
+                      for name, values in endpoint_latencies.items()},
+        'upload': dict(upload_metrics, final_drain_seconds=round(time.perf_counter() - upload_started, 2),
+                       drive_files=drive.files_created, drive_bytes=drive.bytes_created),
+    }
+
+
+def print_report(report):
+    print(f"Replayed {report['samples']} samples from {report['devices']} device(s) at {report['speed']}x "
+          f"in {report['replay_seconds']}s ({report['samples_per_second']} samples/s)")
+    print(f"Alerts: {report['alerts_sent']} sent ({report['alerts_per_second']}/s), "
+          f"{report['alerts_delivered']} delivered, {report['alerts_missing']} missing")
+    latency = report['alert_latency']
+    if latency['count']:
+        print(f"  alert latency   p50 {latency['p50_ms']} ms  p99 {latency['p99_ms']} ms  max {latency['max_ms']} ms")
+    for name, summary in report['endpoints'].items():
+        if name.endswith('errors'):
+            if summary:
+                print(f"  {name}: {summary}")
+        elif summary['count']:
+            print(f"  {name:<18} p50 {summary['p50_ms']} ms  p99 {summary['p99_ms']} ms  "
+                  f"max {summary['max_ms']} ms  ({summary['count']} requests)")
+    upload = report['upload']
+    print(f"Uploads: {upload['uploads']} segment(s), {upload['failures']} failure(s), "
+          f"{upload['drive_bytes']} bytes to the fake Drive, avg latency {upload['avg_latency_seconds']:.3f}s, "
+          f"final drain {upload['final_drain_seconds']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sessions', nargs='*', help="recorded nicla_orientation_*.csv (or .npy) sessions to replay; "
+                                                     "synthetic sessions are generated when none are given")
+    parser.add_argument('--server', default='http://127.0.0.1:5000', help="backend base URL")
+    parser.add_argument('--devices', type=int, default=5, help="simulated devices (sessions are reused round-robin)")
+    parser.add_argument('--speed', type=float, default=10.0, help="replay speed as a multiple of realtime")
+    parser.add_argument('--duration', type=float, default=300.0, help="length of synthetic sessions in seconds")
+    parser.add_argument('--work-dir', default='replay_work', help="receiver CSVs, spool and upload state go here")
+    parser.add_argument('--drive-dir', default=None, help="fake Drive folder, normally the backend's downloaded_csvs "
+                                                           "(default: <work-dir>/drive)")
+    parser.add_argument('--drive-latency', type=float, default=DEFAULT_UPLOAD_LATENCY_SECONDS,
+                        help="simulated seconds per fake Drive upload")
+    parser.add_argument('--segment-interval', type=float, default=5.0, help="seconds between segment uploads")
+    parser.add_argument('--stats-interval', type=float, default=2.0, help="seconds between dashboard endpoint polls")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="show receiver and uploader output")
+    args = parser.parse_args()
+
+    args.work_dir = os.path.abspath(args.work_dir)
+    args.drive_dir = os.path.abspath(args.drive_dir or os.path.join(args.work_dir, 'drive'))
+    os.makedirs(args.work_dir, exist_ok=True)
+    if args.sessions:
+        sources = [recorded_session(path) for path in args.sessions]
+        sources = [s for s in sources if len(s['timestamp'])]
+        if not sources:
+            parser.error("none of the sessions contain samples")
+    else:
+        sources = [synthetic_session(args.duration, seed) for seed in range(args.devices)]
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    log_path = os.path.join(args.work_dir, 'replay.log')
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+        report = asyncio.run(replay(args, sources))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+        if not args.verbose:
+            print(f"Receiver output: {log_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# test_alert_forwarder.py
+"""Crash-recovery tests of the AlertForwarder spool journal (run with `python -m pytest test`)."""
+import os
+import sys
+import json
+import asyncio
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_DIR, 'dataCollection', 'src'))
+
+import alert_forwarder
+from alert_forwarder import AlertForwarder
+
+UNREACHABLE_URL = "http://127.0.0.1:9/alert"
+
+
+def alert(i):
+    return {"timestamp": f"2026-01-01 10:00:{i % 60:02d}", "message": f"Alert {i}", "device_id": "AA"}
+
+
+def forwarder_with_journal(spool_file):
+    """A forwarder replaying spool_file and appending to it, without the delivery task."""
+    forwarder = AlertForwarder(UNREACHABLE_URL, spool_file=str(spool_file))
+    forwarder.pending = forwarder._load_spool()
+    forwarder._compact_spool()
+    return forwarder
+
+
+def acknowledge(forwarder, done):
+    """What _run does once the server accepted the first `done` pending alerts."""
+    del forwarder.pending[:done]
+    forwarder._journal_write({"done": done})
+
+
+def test_replay_skips_a_truncated_last_line(tmp_path):
+    spool_file = tmp_path / "pending_alerts.json"
+    lines = [json.dumps({"alert": alert(i)}) for i in range(5)] + [json.dumps({"done": 2})]
+    spool_file.write_text("\n".join(lines) + "\n" + json.dumps({"alert": alert(5)})[:25])
+    assert AlertForwarder(UNREACHABLE_URL, spool_file=str(spool_file))._load_spool() == [alert(i) for i in range(2, 5)]
+
+
+def test_replay_skips_a_partial_acknowledgement(tmp_path):
+    spool_file = tmp_path / "pending_alerts.json"
+    lines = [json.dumps({"alert": alert(i)}) for i in range(3)]
+    spool_file.write_text("\n".join(lines) + "\n" + '{"done": 3')
+    assert AlertForwarder(UNREACHABLE_URL, spool_file=str(spool_file))._load_spool() == [alert(i) for i in range(3)]
+
+
+def test_replay_reads_the_legacy_array_spool(tmp_path):
+    spool_file = tmp_path / "pending_alerts.json"
+    spool_file.write_text(json.dumps([alert(0), alert(1)]))
+    assert AlertForwarder(UNREACHABLE_URL, spool_file=str(spool_file))._load_spool() == [alert(0), alert(1)]
+
+
+def test_journal_replays_to_the_pending_queue(tmp_path):
+    spool_file = tmp_path / "pending_alerts.json"
+    forwarder = forwarder_with_journal(spool_file)
+    for i in range(10):
+        forwarder.submit(alert(i))
+    acknowledge(forwarder, 4)
+    forwarder.submit(alert(10))
+    acknowledge(forwarder, 2)
+    # A crash now: the journal alone must give the same queue back
+    assert forwarder_with_journal(spool_file).pending == forwarder.pending == [alert(i) for i in range(6, 11)]
+
+
+def test_compaction_keeps_unacknowledged_alerts(tmp_path):
+    spool_file = tmp_path / "pending_alerts.json"
+    forwarder = forwarder_with_journal(spool_file)
+    for i in range(20):
+        forwarder.submit(alert(i))
+    acknowledge(forwarder, 15)
+    forwarder._compact_spool()
+    lines = spool_file.read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{"alert": alert(i)} for i in range(15, 20)]
+    forwarder.submit(alert(20))
+    assert forwarder_with_journal(spool_file).pending == [alert(i) for i in range(15, 21)]
+
+
+def test_full_queue_drops_the_oldest_alert_not_in_flight(tmp_path, monkeypatch):
+    monkeypatch.setattr(alert_forwarder, 'ALERT_MAX_PENDING', 5)
+    spool_file = tmp_path / "pending_alerts.json"
+    forwarder = forwarder_with_journal(spool_file)
+    for i in range(5):
+        forwarder.submit(alert(i))
+    forwarder._in_flight = 2    # The first two are being posted
+    forwarder.submit(alert(5))
+    forwarder.submit(alert(6))
+    assert forwarder.pending == [alert(0), alert(1), alert(4), alert(5), alert(6)]
+    assert forwarder.dropped == 2
+    assert forwarder_with_journal(spool_file).pending == forwarder.pending
+
+
+def test_start_keeps_only_the_newest_alerts(tmp_path, monkeypatch):
+    monkeypatch.setattr(alert_forwarder, 'ALERT_MAX_PENDING', 3)
+    monkeypatch.setattr(alert_forwarder, 'ALERT_RETRY_INITIAL_SECONDS', 60.0)
+    spool_file = tmp_path / "pending_alerts.json"
+    spool_file.write_text("".join(json.dumps({"alert": alert(i)}) + "\n" for i in range(8)))
+
+    async def start_and_close():
+        forwarder = AlertForwarder(UNREACHABLE_URL, spool_file=str(spool_file))
+        await forwarder.start()
+        await forwarder.close()
+        return forwarder
+
+    forwarder = asyncio.run(start_and_close())
+    assert forwarder.pending == [alert(i) for i in range(5, 8)]
+    assert forwarder.dropped == 5
+    assert AlertForwarder(UNREACHABLE_URL, spool_file=str(spool_file))._load_spool() == forwarder.pending
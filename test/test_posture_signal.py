@@ -0,0 +1,79 @@
+# test_posture_signal.py
+"""Checks that the vectorized detect_episodes agrees with the streaming PostureSignal (run with `python -m pytest test`)."""
+import os
+import sys
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_DIR, 'webApp', 'backend'))
+
+import posture_signal
+from posture_signal import PostureSignal, detect_episodes, RESET_GAP_MS
+
+
+def streamed_episodes(timestamps, pitch, roll, **options):
+    """Episodes PostureSignal emits when fed the samples one by one and flushed at the end."""
+    signal = PostureSignal(**options)
+    episodes = []
+    for sample in zip(timestamps.tolist(), pitch.tolist(), roll.tolist()):
+        episode = signal.update(*sample)
+        if episode:
+            episodes.append(episode)
+    episode = signal.flush()
+    if episode:
+        episodes.append(episode)
+    return episodes
+
+
+def random_session(rng, n):
+    """A wandering posture sampled at irregular intervals, with duplicate timestamps and disconnects."""
+    steps = rng.choice([20, 200, 20, 5, 0, RESET_GAP_MS + 1000], size=n, p=[.5, .2, .2, .05, .03, .02])
+    timestamps = np.cumsum(steps).astype(np.int64)
+    walk = np.cumsum(rng.normal(0, rng.uniform(.1, 2), n))
+    pitch = (walk * rng.uniform(.5, 3) + rng.normal(0, 2, n)).astype(np.float32)
+    roll = (90 + np.cumsum(rng.normal(0, 1, n)) + rng.normal(0, 3, n)).astype(np.float32)
+    return timestamps, pitch, roll
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_matches_streaming_signal(seed):
+    rng = np.random.default_rng(seed)
+    timestamps, pitch, roll = random_session(rng, int(rng.integers(1, 3000)))
+    assert detect_episodes(timestamps, pitch, roll) == streamed_episodes(timestamps, pitch, roll)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_streaming_signal_with_other_settings(seed):
+    rng = np.random.default_rng(1000 + seed)
+    timestamps, pitch, roll = random_session(rng, int(rng.integers(1, 3000)))
+    options = dict(enter_ms=0, exit_ms=int(rng.integers(0, 500)), time_constant_ms=int(rng.integers(0, 800)))
+    assert detect_episodes(timestamps, pitch, roll, **options) == streamed_episodes(timestamps, pitch, roll, **options)
+
+
+def test_gap_closes_an_open_episode():
+    timestamps = np.r_[np.arange(0, 3000, 20), np.arange(3000 + RESET_GAP_MS + 1, 6000 + RESET_GAP_MS, 20)]
+    pitch = np.full(len(timestamps), 20.0, dtype=np.float32)
+    roll = np.full(len(timestamps), 90.0, dtype=np.float32)
+    episodes = detect_episodes(timestamps, pitch, roll)
+    assert episodes == streamed_episodes(timestamps, pitch, roll)
+    assert len(episodes) == 2
+    assert all(episode['type'] == 'side_tilt' for episode in episodes)
+
+
+def test_duplicate_timestamps():
+    timestamps = np.repeat(np.arange(0, 4000, 40), 2).astype(np.int64)
+    pitch = np.where(timestamps < 2000, 0.0, 15.0).astype(np.float32)
+    roll = np.full(len(timestamps), 90.0, dtype=np.float32)
+    assert detect_episodes(timestamps, pitch, roll) == streamed_episodes(timestamps, pitch, roll)
+
+
+def test_ema_matches_filter_for_stacked_series():
+    rng = np.random.default_rng(7)
+    timestamps = np.cumsum(rng.choice([0, 20, 200], 500)).astype(np.int64)
+    values = rng.normal(0, 10, (2, 500))
+    smoothed = posture_signal.ema(timestamps, values, np.array([0]))
+    for series, expected in zip(values, smoothed):
+        ema_filter = posture_signal.EmaFilter()
+        streamed = [ema_filter.update(t, v) for t, v in zip(timestamps.tolist(), series.tolist())]
+        assert np.allclose(streamed, expected)
@@ -0,0 +1,93 @@
+# test_rollups.py
+"""Tests of LTTB downsampling and of the incremental merged rollups (run with `python -m pytest test`)."""
+import os
+import sys
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_DIR, 'webApp', 'backend'))
+
+import rollups
+
+
+@pytest.mark.parametrize('n, threshold', [(10, 3), (1000, 100), (1001, 500), (5000, 4999), (7, 5)])
+def test_lttb_keeps_endpoints_and_threshold_points(n, threshold):
+    rng = np.random.default_rng(n)
+    x = np.cumsum(rng.integers(1, 50, n))
+    y = rng.normal(0, 10, n)
+    kept = rollups.lttb_indices(x, y, threshold)
+    assert len(kept) == threshold
+    assert kept[0] == 0 and kept[-1] == n - 1
+    assert np.all(np.diff(kept) > 0)
+
+
+@pytest.mark.parametrize('threshold', [2, 10, 11, 50])
+def test_lttb_returns_everything_below_threshold_or_minimum(threshold):
+    x = np.arange(10)
+    y = np.sin(x)
+    assert np.array_equal(rollups.lttb_indices(x, y, threshold), np.arange(10))
+
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[437] = 90.0
+    assert 437 in rollups.lttb_indices(x, y, 20)
+
+
+def _write_session(path, rng, n):
+    timestamps = np.cumsum(rng.choice([20, 20, 2000, 60000], n))
+    with open(path, 'w') as f:
+        f.write(''.join(f"{t},{p:.2f},{r:.2f},0\n"
+                        for t, p, r in zip(timestamps, rng.normal(10, 20, n), rng.normal(90, 15, n))))
+
+
+def _files(sessions):
+    result = []
+    for path, user in sessions.values():
+        st = os.stat(path)
+        result.append((path, user, (st.st_size, st.st_mtime_ns)))
+    return result
+
+
+def _assert_same_rollups(actual, expected):
+    empty = np.empty(0, dtype=rollups.ROLLUP_DTYPE)
+    for merged in ('hourly', 'daily'):
+        mine, theirs = getattr(actual, merged), getattr(expected, merged)
+        for user in set(mine) | set(theirs):
+            a, b = mine.get(user, empty), theirs.get(user, empty)
+            assert len(a) == len(b), (merged, user)
+            for name in rollups.ROLLUP_DTYPE.names:
+                assert np.allclose(a[name].astype(np.float64), b[name].astype(np.float64)), (merged, user, name)
+
+
+def test_incremental_sync_matches_a_full_rebuild(tmp_path):
+    rng = np.random.default_rng(0)
+    store = rollups.RollupStore(str(tmp_path))
+    sessions = {}
+    for step in range(60):
+        op = rng.integers(0, 6)
+        if op <= 3 or not sessions:
+            name = f"nicla_orientation_202601{rng.integers(1, 4):02d}_{rng.integers(0, 24):02d}0000_D{step}.csv"
+            path = str(tmp_path / name)
+            _write_session(path, rng, int(rng.integers(1, 2000)))
+            sessions[name] = (path, str(rng.choice(['u1', 'u2'])))
+        elif op == 4:
+            name = rng.choice(sorted(sessions))
+            os.remove(sessions.pop(name)[0])
+        else:
+            name = rng.choice(sorted(sessions))
+            path, user = sessions[name]
+            sessions[name] = (path, 'u1' if user == 'u2' else 'u2')
+        store.sync(_files(sessions))
+
+    full = rollups.RollupStore(str(tmp_path))
+    full._loaded = True     # Build from the minute rollups, not from the saved merged ones
+    full.sync(_files(sessions))
+    _assert_same_rollups(store, full)
+
+    store._save_merged()
+    cold = rollups.RollupStore(str(tmp_path))
+    cold.sync(_files(sessions))
+    _assert_same_rollups(cold, full)
@@ -0,0 +1,173 @@
+# alert_store.py
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+# --- CONFIGURATION ---
+DEFAULT_USER_ID = "default_user"
+ALERT_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"    # Format used by ble_receiver.py
+
+# Messages produced by hardware/src/main.cpp
+BOTH_TILT_PATTERN = re.compile(r"Both side \((-?[\d.]+)°?\) and forward/backward \((-?[\d.]+)°?\)")
+SIDE_TILT_PATTERN = re.compile(r"Side tilt \((-?[\d.]+)°?\)")
+FORWARD_TILT_PATTERN = re.compile(r"Forward/backward tilt \((-?[\d.]+)°?\)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    device_id TEXT,
+    ts REAL NOT NULL,
+    tilt_type TEXT,
+    angle REAL,
+    message TEXT,
+    display TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_user_ts ON alerts (user_id, ts);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def parse_alert_message(message):
+    """Extracts (tilt_type, angle) from a firmware alert message. Unknown formats give (None, None)."""
+    if not message:
+        return None, None
+    match = BOTH_TILT_PATTERN.search(message)
+    if match:
+        side, forward = float(match.group(1)), float(match.group(2))
+        return 'both', side if abs(side) >= abs(forward) else forward
+    match = SIDE_TILT_PATTERN.search(message)
+    if match:
+        return 'side_tilt', float(match.group(1))
+    match = FORWARD_TILT_PATTERN.search(message)
+    if match:
+        return 'forward_lean', float(match.group(1))
+    return None, None
+
+
+def parse_alert_timestamp(value):
+    """Converts the receiver's timestamp string (or epoch seconds) to epoch seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if value:
+        try:
+            return datetime.strptime(value, ALERT_TIMESTAMP_FORMAT).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+class AlertStore:
+    """Embedded SQLite (WAL mode) store of every received alert.
+
+    Alerts are indexed on (user_id, ts), so history, range and count
+    queries are index lookups. Each thread gets its own connection; WAL
+    lets dashboard reads run while the ingest path writes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _row_for(self, alert):
+        timestamp = alert.get('timestamp')
+        message = alert.get('message')
+        tilt_type, angle = parse_alert_message(message)
+        return (
+            alert.get('user_id') or DEFAULT_USER_ID,
+            alert.get('device_id'),
+            parse_alert_timestamp(timestamp),
+            tilt_type,
+            angle,
+            message,
+            f"[{timestamp or 'No Timestamp'}] {message or 'No Message'}",
+        )
+
+    def add_many(self, alerts):
+        """Inserts alerts in one transaction. Returns the stored rows as dicts (with ids)."""
+        conn = self._connection()
+        stored = []
+        with conn:
+            for alert in alerts:
+                row = self._row_for(alert)
+                cursor = conn.execute(
+                    "INSERT INTO alerts (user_id, device_id, ts, tilt_type, angle, message, display) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+                stored.append({
+                    'id': cursor.lastrowid,
+                    'user_id': row[0],
+                    'device_id': row[1],
+                    'ts': row[2],
+                    'tilt_type': row[3],
+                    'angle': row[4],
+                    'message': row[5],
+                    'display': row[6],
+                    'timestamp': alert.get('timestamp'),
+                })
+        return stored
+
+    def add(self, alert):
+        return self.add_many([alert])[0]
+
+    def latest(self, limit, user_id=None):
+        """Most recent alerts, newest first."""
+        conn = self._connection()
+        if user_id:
+            rows = conn.execute(
+                "SELECT * FROM alerts WHERE user_id = ? ORDER BY ts DESC, id DESC LIMIT ?", (user_id, limit))
+        else:
+            rows = conn.execute("SELECT * FROM alerts ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    def query_range(self, user_id, start_ts, end_ts=None, limit=1000):
+        """Alerts of one user with start_ts <= ts < end_ts, oldest first."""
+        end_ts = end_ts if end_ts is not None else time.time() + 1
+        rows = self._connection().execute(
+            "SELECT * FROM alerts WHERE user_id = ? AND ts >= ? AND ts < ? ORDER BY ts LIMIT ?",
+            (user_id, start_ts, end_ts, limit))
+        return [dict(row) for row in rows]
+
+    def count(self, user_id, start_ts, end_ts=None):
+        """Number of alerts per tilt type for one user in [start_ts, end_ts)."""
+        end_ts = end_ts if end_ts is not None else time.time() + 1
+        rows = self._connection().execute(
+            "SELECT COALESCE(tilt_type, 'other') AS tilt_type, COUNT(*) AS n FROM alerts "
+            "WHERE user_id = ? AND ts >= ? AND ts < ? GROUP BY tilt_type",
+            (user_id, start_ts, end_ts))
+        counts = {row['tilt_type']: row['n'] for row in rows}
+        counts['total'] = sum(counts.values())
+        return counts
+
+    def since(self, last_id, limit=500):
+        """Alerts stored after last_id (by any process), oldest first."""
+        rows = self._connection().execute(
+            "SELECT * FROM alerts WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit))
+        return [dict(row) for row in rows]
+
+    def last_change(self):
+        """(id, ts) of the newest alert, or (0, None) when there are none."""
+        row = self._connection().execute("SELECT id, ts FROM alerts ORDER BY id DESC LIMIT 1").fetchone()
+        return (row['id'], row['ts']) if row else (0, None)
+
+    def last_id(self):
+        row = self._connection().execute("SELECT MAX(id) AS id FROM alerts").fetchone()
+        return row['id'] or 0
@@ -0,0 +1,142 @@
+# alert_stream.py
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+from alert_store import ALERT_TIMESTAMP_FORMAT
+
+# --- CONFIGURATION ---
+SUBSCRIBER_QUEUE_SIZE = 100     # Alerts buffered per dashboard before it is considered stalled
+HEARTBEAT_SECONDS = 15          # Keeps proxies from closing idle event streams
+STORE_POLL_INTERVAL_SECONDS = 0.5   # How often new alerts are picked up from the shared alert store
+
+logger = logging.getLogger(__name__)
+
+
+def alert_event(row):
+    """The SSE payload of an alert row from the alert store."""
+    return {
+        "id": row['id'],
+        "timestamp": datetime.fromtimestamp(row['ts']).strftime(ALERT_TIMESTAMP_FORMAT),
+        "message": row['message'],
+        "user_id": row['user_id'],
+        "device_id": row['device_id'],
+        "tilt_type": row['tilt_type'],
+        "angle": row['angle'],
+        "display": row['display']
+    }
+
+
+class AlertBroadcaster:
+    """Fans new alerts out to every connected server-sent events stream.
+
+    The request that stored an alert publishes it at once (publish_stored).
+    With a store, a poller thread also reads every alert added to the shared
+    store after the last one it saw, so each process's streams see the
+    alerts received by other worker processes too; the ones this process
+    already published are skipped. The poller starts with the first
+    subscriber, i.e. after the server has forked its workers.
+
+    Frames carry the alert id, so a client reconnecting with Last-Event-ID
+    is first sent the alerts it missed.
+    """
+
+    def __init__(self, store=None, poll_interval=STORE_POLL_INTERVAL_SECONDS):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._poller = None
+        self._published = set()     # Ids published by this process that the poller has not reached yet
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+            if self.store is not None and self._poller is None:
+                # Read before the stream starts, so nothing stored after the first subscriber connected is missed
+                self._poller = threading.Thread(target=self._poll_store, args=(self.store.last_id(),),
+                                                name="alert-store-poller", daemon=True)
+                self._poller.start()
+        logger.info(f"Alert stream subscriber connected ({len(self._subscribers)} total).")
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+        logger.info(f"Alert stream subscriber disconnected ({len(self._subscribers)} total).")
+
+    def publish(self, alert):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(alert)
+            except queue.Full:
+                # A stalled client must not hold up ingestion; it can resync via /get_alerts_data
+                logger.warning("Alert stream subscriber is not keeping up. Dropping alert for it.")
+
+    def publish_stored(self, rows):
+        """Publishes alert rows this process just stored, ahead of the store poll."""
+        if not self._subscribers:
+            return
+        with self._lock:
+            if self.store is not None:
+                self._published.update(row['id'] for row in rows)
+        for row in rows:
+            self.publish(alert_event(row))
+
+    def _poll_store(self, last_id):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                if not self._subscribers:
+                    # Nobody is listening: skip ahead instead of replaying old alerts later
+                    last_id = self.store.last_id()
+                    with self._lock:
+                        self._published.clear()
+                    continue
+                for row in self.store.since(last_id):
+                    last_id = row['id']
+                    with self._lock:
+                        if row['id'] in self._published:
+                            self._published.discard(row['id'])
+                            continue
+                    self.publish(alert_event(row))
+                with self._lock:
+                    self._published = {alert_id for alert_id in self._published if alert_id > last_id}
+            except Exception as e:
+                logger.error(f"Failed to poll the alert store: {e}")
+
+    def stream(self, last_event_id=None):
+        """Generator yielding SSE frames for one subscriber until the client goes away.
+
+        With last_event_id (the Last-Event-ID of a reconnecting client), the
+        stored alerts after it are sent first.
+        """
+        q = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            replayed_id = 0
+            if last_event_id is not None and self.store is not None:
+                for row in self.store.since(last_event_id):
+                    replayed_id = row['id']
+                    yield _frame(alert_event(row))
+            while True:
+                try:
+                    alert = q.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                if alert.get('id') is not None and alert['id'] <= replayed_id:
+                    continue    # Queued while the replay ran
+                yield _frame(alert)
+        finally:
+            self.unsubscribe(q)
+
+
+def _frame(alert):
+    event_id = f"id: {alert['id']}\n" if alert.get('id') is not None else ""
+    return f"{event_id}event: alert\ndata: {json.dumps(alert)}\n\n"
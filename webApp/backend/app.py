@@ -1,31 +1,82 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, stream_with_context, g
 import datetime
 import os
 from flask_cors import CORS
 import google.generativeai as genai
 import time 
 import threading
-from collections import deque
 import logging
 import json
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 import glob
 import sys
 import google_drive_utils as drive_utils
+import posture_analytics
+import session_store
+from stats_cache import SessionAggregateCache, PostureSummaryCache
+import rollups
+import local_ingest
+from session_catalog import SessionCatalog
+import metrics
+from alert_stream import AlertBroadcaster
+from leader_lock import FileLeaderLock
+from http_cache import conditional_json, compress_response
+from alert_store import AlertStore, DEFAULT_USER_ID
+from llm_cache import LLMResponseCache, StubModel, make_cache_key
+from pose_buffer import PoseStore, pose_records, DEFAULT_WINDOW_SECONDS
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+app.after_request(compress_response)
 
 # --- Configuration ---
 GOOGLE_DRIVE_CSV_FOLDER_ID = "1eT3I5RGrzFJRERu72Lw-N6YjeNgyzUD2"
 LOCAL_DOWNLOAD_DIR = "downloaded_csvs"
+DRIVE_SYNC_STATE_FILE = os.path.join(LOCAL_DOWNLOAD_DIR, ".drive_sync_state.json")
+ARCHIVE_SESSIONS_AS_NPY = True # Convert downloaded CSVs to the memory-mappable binary session format
 MAX_MESSAGES = 3
-received_alerts = deque(maxlen=MAX_MESSAGES)
+MAX_ALERTS_PER_BATCH = 500
+ALERT_HISTORY_DEFAULT_LIMIT = 1000
+ALERT_HISTORY_MAX_LIMIT = 10000
+ALERT_DB_PATH = "alerts.db"
+alert_store = AlertStore(ALERT_DB_PATH)
+alert_broadcaster = AlertBroadcaster(alert_store) # Streams alerts stored by any worker process
+# Finished session files are moved into LOCAL_DOWNLOAD_DIR/sessions/<user>/<device>/<day>/
+session_catalog = SessionCatalog(LOCAL_DOWNLOAD_DIR)
+rollup_store = rollups.RollupStore(LOCAL_DOWNLOAD_DIR, catalog=session_catalog)
+stats_cache = SessionAggregateCache(LOCAL_DOWNLOAD_DIR, rollup_store=rollup_store, catalog=session_catalog)
+pose_store = PoseStore() # Last minutes of live orientation per device, pushed by the BLE receivers
+MAX_POSE_SAMPLES_PER_BATCH = 5000
+MAX_POSE_WINDOW_SECONDS = 60
+TIMESERIES_DEFAULT_POINTS = 500
+TIMESERIES_MAX_POINTS = 5000
 API_KEY_FILE_PATH = "../../config/google_API_key.txt"
+LLM_MODEL = os.getenv('LLM_MODEL', 'gemini-2.0-flash') # "stub" answers locally without calling Gemini
+LLM_STUB_LATENCY_SECONDS = float(os.getenv('LLM_STUB_LATENCY_SECONDS', "0"))
+llm_cache = LLMResponseCache()
+
+# Prometheus metrics served at /metrics, merged over the worker processes through files in METRICS_DIR
+METRICS_DIR = os.getenv('METRICS_DIR', "metrics")
+HTTP_REQUEST_SECONDS = metrics.Histogram('posture_http_request_duration_seconds',
+                                         'Time to build a response (until the first byte for streams)', ['endpoint'])
+ALERTS_RECEIVED = metrics.Counter('posture_alerts_received_total', 'Alerts stored from the BLE receivers')
+DRIVE_SYNC_SECONDS = metrics.Histogram('posture_drive_sync_duration_seconds', 'Duration of one Drive fetch cycle')
+DRIVE_FILES_DOWNLOADED = metrics.Counter('posture_drive_files_downloaded_total', 'Session files downloaded from Drive')
+DRIVE_DOWNLOAD_FAILURES = metrics.Counter('posture_drive_download_failures_total', 'Drive downloads that failed')
+LLM_UPSTREAM_SECONDS = metrics.Histogram('posture_llm_upstream_seconds',
+                                         'Latency of upstream LLM calls (first_chunk/stream for streamed replies)',
+                                         ['phase'])
+LOCAL_SEGMENTS_INGESTED = metrics.Counter('posture_local_segments_ingested_total',
+                                          'Session segments taken from the local spool directory')
+LOCAL_INGEST_LAG_SECONDS = metrics.Histogram('posture_local_ingest_lag_seconds',
+                                             'Age of the newest spool segment when it reached the data directory')
+LLM_UPSTREAM_ERRORS = metrics.Counter('posture_llm_upstream_errors_total', 'Upstream LLM calls that failed')
+POSE_SAMPLES_RECEIVED = metrics.Counter('posture_pose_samples_received_total', 'Live pose samples pushed by the receivers')
 
 # Load Google API key from file
 GOOGLE_API_KEY = None
@@ -42,16 +93,33 @@ except Exception as e:
     print(f"ATTENZIONE: Errore durante la lettura del file API key '{API_KEY_FILE_PATH}': {e}")
 
 # Initialize Google Generative AI client if API key is available
-if GOOGLE_API_KEY:
+if LLM_MODEL == 'stub':
+    logger.info("Using the local stub LLM model.")
+    model_gemini = StubModel(latency_seconds=LLM_STUB_LATENCY_SECONDS)
+elif GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
-    model_gemini = genai.GenerativeModel('gemini-2.0-flash') 
+    model_gemini = genai.GenerativeModel(LLM_MODEL) 
 else:
     print("ATTENZIONE: La variabile d'ambiente GOOGLE_API_KEY non è impostata.")
     model_gemini = None 
 
 # Configuration for background task
 DRIVE_FETCH_INTERVAL_SECONDS = 20 
+# leader: one web worker runs the fetcher, elected through FETCHER_LOCK_FILE
+# external: run `python drive_fetcher.py` as its own process; off: never fetch automatically
+DRIVE_FETCHER_MODE = os.getenv('DRIVE_FETCHER_MODE', 'leader')
+FETCHER_LOCK_FILE = os.path.join(LOCAL_DOWNLOAD_DIR, ".drive_fetcher.lock")
 background_thread_stop_event = threading.Event() 
+fetcher_thread = None
+# Local-first ingest: with LOCAL_INGEST_DIR set, sessions from a receiver on this host arrive through
+# that spool within about LOCAL_INGEST_POLL_SECONDS, and Drive only serves as their backup
+INGEST_LOCK_FILE = os.path.join(LOCAL_DOWNLOAD_DIR, ".local_ingest.lock")
+local_ingester = None
+if local_ingest.LOCAL_INGEST_DIR:
+    local_ingester = local_ingest.LocalIngester(
+        local_ingest.LOCAL_INGEST_DIR, LOCAL_DOWNLOAD_DIR,
+        on_part_closed=lambda path: place_session_file(path))
+ingest_thread = None
 
 # Topic-specific prompt templates
 TOPIC_PROMPTS = {
@@ -98,37 +166,52 @@ TOPIC_PROMPTS = {
     Be encouraging while staying realistic about progress."""
 }
 
-def get_posture_summary_for_llm(user_id="default_user"):
-    return """Posture Analysis Summary for Student (June 18, 2025):
-    
-    Current Session Data:
-    - Total monitoring time today: 4.2 hours
-    - Good posture maintained: 78% of time (3.3 hours)
-    - Poor posture detected: 22% of time (52 minutes)
-    - Total alerts generated: 12
-    
-    Primary Issues Detected:
-    - Forward head posture: 60% of poor posture time (mainly 2-6 PM)
-    - Left shoulder drop: 25% of poor posture time
-    - Excessive forward lean: 15% of poor posture time
-    
-    Patterns Observed:
-    - Posture deteriorates significantly after 2 hours of continuous work
-    - Worst posture period: 3:00-4:00 PM (likely afternoon fatigue)
-    - Best posture: Morning sessions (9-11 AM)
-    
-    Weekly Trends:
-    - 15% improvement in good posture time vs last week
-    - 30% reduction in severe forward head posture incidents
-    - Consistent improvement in break-taking behavior
-    
-    Workspace Notes:
-    - Frequent mouse-heavy tasks correlate with right shoulder tension
-    - Extended reading periods show increased forward lean"""
+def build_user_summary(user_id, hourly):
+    """Builds the LLM posture summary of one user from the cached aggregates and their stored alerts."""
+    alert_counts = alert_store.count(user_id, time.time() - 7 * 86400)
+    return posture_analytics.build_llm_summary(hourly, alert_counts=alert_counts)
+
+summary_cache = PostureSummaryCache(stats_cache, build_user_summary)
+
+def get_posture_summary_for_llm(user_id=DEFAULT_USER_ID):
+    return summary_cache.get(user_id)
  
+def place_session_file(path):
+    """Archives a finished session file as .npy (if enabled) and moves it into its user/device/day partition."""
+    if ARCHIVE_SESSIONS_AS_NPY:
+        try:
+            path = session_store.convert_csv_to_session(path, remove_csv=True)
+        except Exception as e:
+            logger.error(f"Failed to convert '{os.path.basename(path)}' to a binary session: {e}")
+    try:
+        session_catalog.place(path)
+    except OSError as e:
+        logger.error(f"Failed to place '{os.path.basename(path)}' in its partition: {e}")
+
+def load_drive_sync_state():
+    try:
+        with open(DRIVE_SYNC_STATE_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Could not read Drive sync state '{DRIVE_SYNC_STATE_FILE}': {e}. Doing a full listing.")
+        return {}
+
+def save_drive_sync_state(state):
+    tmp_path = DRIVE_SYNC_STATE_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, DRIVE_SYNC_STATE_FILE)
+
 def perform_drive_csv_fetch():
     
-    """Fetches CSVs from Google Drive and saves them locally."""
+    """Fetches new CSVs from Google Drive and saves them locally.
+
+    After the first full listing only the Drive changes since the persisted
+    start page token are examined, so a cycle costs the same however many
+    sessions the folder already holds.
+    """
     
     logger.info("Background task: Starting CSV fetch from Google Drive.")
     drive_service = drive_utils.get_drive_service()
@@ -140,32 +223,62 @@ def perform_drive_csv_fetch():
         logger.error("Background task: GOOGLE_DRIVE_CSV_FOLDER_ID is not configured.")
         return {"status": "error", "message": "Google Drive folder ID not configured on server."}
 
-    csv_files = drive_utils.list_csv_files_in_folder(drive_service, GOOGLE_DRIVE_CSV_FOLDER_ID)
-
-    if not csv_files:
-        logger.info("Background task: No new CSV files found in the Google Drive folder.")
-        return {"status": "success", "message": "No new CSV files found.", "downloaded_files": 0, "files": []}
-
-    downloaded_count = 0
-    downloaded_file_names = []
     os.makedirs(LOCAL_DOWNLOAD_DIR, exist_ok=True)
-
+    sync_state = load_drive_sync_state()
+    csv_files, next_page_token = None, None
+    if sync_state.get('folder_id') == GOOGLE_DRIVE_CSV_FOLDER_ID and sync_state.get('start_page_token'):
+        csv_files, next_page_token = drive_utils.list_changed_csv_files(
+            drive_service, GOOGLE_DRIVE_CSV_FOLDER_ID, sync_state['start_page_token'])
+    if csv_files is None:
+        # First run or unusable token: take the token before listing so nothing added meanwhile is missed
+        logger.info("Background task: Doing a full listing of the Google Drive folder.")
+        next_page_token = drive_utils.get_start_page_token(drive_service)
+        csv_files = drive_utils.list_csv_files_in_folder(drive_service, GOOGLE_DRIVE_CSV_FOLDER_ID)
+        if csv_files is None:
+            # Saving the token after a failed listing would skip every file already in the folder for good
+            logger.error("Background task: Could not list the Google Drive folder. Retrying next cycle.")
+            return {"status": "error", "message": "Failed to list the Google Drive folder."}
+
+    downloads = []
+    # Includes sessions still in the spool, which local ingest may not have polled yet (e.g. after a restart)
+    local_sessions = local_ingest.local_sessions(LOCAL_DOWNLOAD_DIR)
     for item in csv_files:
         file_id = item['id']
         file_name = item['name']
         local_file_path = os.path.join(LOCAL_DOWNLOAD_DIR, file_name)
 
-        if os.path.exists(local_file_path):
-            logger.info(f"Background task: File '{file_name}' already exists locally. Skipping download.")
+        if session_catalog.contains(file_name):
+            logger.debug(f"Background task: File '{file_name}' is already in its partition. Skipping download.")
+            continue
+        if local_ingest.locally_ingested(file_name, local_sessions, session_catalog):
+            logger.debug(f"Background task: Session of '{file_name}' arrived through the local spool. Skipping download.")
             continue
 
-        logger.info(f"Background task: Attempting to download '{file_name}' (ID: {file_id})")
-        if drive_utils.download_file(drive_service, file_id, file_name, local_file_path):
-            downloaded_count += 1
-            downloaded_file_names.append(file_name)
-        else:
-            logger.error(f"Background task: Failed to download '{file_name}'.")
+        if os.path.exists(local_file_path) or os.path.exists(session_store.session_path_for(local_file_path)):
+            logger.debug(f"Background task: File '{file_name}' already exists locally. Skipping download.")
+            continue
+        downloads.append((file_id, file_name, local_file_path))
+
+    if downloads:
+        logger.info(f"Background task: Downloading {len(downloads)} new CSV file(s).")
+    downloaded = drive_utils.download_files(drive_service, downloads)
+    downloaded_file_names = []
+    for file_id, file_name, local_file_path in downloaded:
+        downloaded_file_names.append(file_name)
+        place_session_file(local_file_path)
+    downloaded_count = len(downloaded)
+    failed_count = len(downloads) - downloaded_count
+    DRIVE_FILES_DOWNLOADED.inc(downloaded_count)
+    DRIVE_DOWNLOAD_FAILURES.inc(failed_count)
+    if failed_count:
+        logger.error(f"Background task: Failed to download {failed_count} file(s). They will be retried next cycle.")
+    elif next_page_token:
+        # Only advance past these changes once every file from them is stored locally
+        save_drive_sync_state({'folder_id': GOOGLE_DRIVE_CSV_FOLDER_ID, 'start_page_token': next_page_token})
     
+    if downloaded_count > 0:
+        stats_cache.refresh()
+
     message = f"Successfully downloaded {downloaded_count} CSV file(s)." if downloaded_count > 0 else "No new files were downloaded."
     logger.info(f"Background task: {message}")
     return {
@@ -175,75 +288,162 @@ def perform_drive_csv_fetch():
         "downloaded_file_names": downloaded_file_names
     }
 
-def background_drive_fetcher():
+def background_drive_fetcher(leader_lock=None):
     
-    """Periodically calls the drive fetching logic."""
+    """Periodically calls the drive fetching logic.
+
+    With a leader_lock only the process holding it fetches; the others stay
+    on standby and take over if the leader exits.
+    """
     
     logger.info("Background Drive Fetcher thread started.")
-    time.sleep(10)
-    if not background_thread_stop_event.is_set():
-        perform_drive_csv_fetch()
-
-    while not background_thread_stop_event.is_set():
-        logger.debug(f"Background Drive Fetcher sleeping for {DRIVE_FETCH_INTERVAL_SECONDS} seconds.")
-        background_thread_stop_event.wait(DRIVE_FETCH_INTERVAL_SECONDS)
-        if not background_thread_stop_event.is_set():
-            perform_drive_csv_fetch()
+    background_thread_stop_event.wait(10)
+
+    try:
+        while not background_thread_stop_event.is_set():
+            if leader_lock is None or leader_lock.try_acquire():
+                try:
+                    with DRIVE_SYNC_SECONDS.time():
+                        perform_drive_csv_fetch()
+                except Exception as e:
+                    # e.g. a socket timeout from httplib2: retry next cycle instead of losing the thread
+                    logger.error(f"Background task: Drive fetch failed: {e}", exc_info=True)
+            logger.debug(f"Background Drive Fetcher sleeping for {DRIVE_FETCH_INTERVAL_SECONDS} seconds.")
+            background_thread_stop_event.wait(DRIVE_FETCH_INTERVAL_SECONDS)
+    finally:
+        # Lets a standby process take over even if this thread dies
+        if leader_lock is not None:
+            leader_lock.release()
     logger.info("Background Drive Fetcher thread stopped.")
 
-def generate_mock_posture_data(days):
-    
-    """Generate mock data for the demo. Needs replacement with real CSV analysis."""
+def start_background_fetcher():
+    global fetcher_thread
+    if fetcher_thread is None or not fetcher_thread.is_alive():
+        fetcher_thread = threading.Thread(target=background_drive_fetcher,
+                                          args=(FileLeaderLock(FETCHER_LOCK_FILE),), daemon=True)
+        fetcher_thread.start()
+    return fetcher_thread
+
+def background_local_ingest(leader_lock=None):
     
-    daily_data = []
-    total_alerts = 0
-    total_hours = 0
+    """Moves new segments from the local spool into the data directory every LOCAL_INGEST_POLL_SECONDS."""
     
-    for i in range(days):
-        date = (datetime.now() - timedelta(days=days-i-1)).strftime('%m/%d')
-        good_posture = 60 + (i * 2) + (i % 3) * 10
-        poor_posture = 100 - good_posture
-        alert_count = 5 + (i % 4) * 3
-        hours = 4 + (i % 3) * 1.5
-        
-        daily_data.append({
-            'date': date,
-            'good_posture_percentage': good_posture,
-            'poor_posture_percentage': poor_posture,
-            'alert_count': alert_count,
-            'hours_monitored': hours
-        })
-        
-        total_alerts += alert_count
-        total_hours += hours
+    logger.info(f"Local ingest thread started, watching '{local_ingest.LOCAL_INGEST_DIR}'.")
+    try:
+        while not background_thread_stop_event.is_set():
+            if leader_lock is None or leader_lock.try_acquire():
+                try:
+                    ingested = local_ingester.poll()
+                    if ingested:
+                        LOCAL_SEGMENTS_INGESTED.inc(ingested)
+                        LOCAL_INGEST_LAG_SECONDS.observe(local_ingester.last_lag_seconds)
+                        # Closed parts change the directory and are picked up at once; the open one every few seconds
+                        stats_cache.refresh_if_changed()
+                except Exception as e:
+                    logger.error(f"Local ingest failed: {e}", exc_info=True)
+            background_thread_stop_event.wait(local_ingest.LOCAL_INGEST_POLL_SECONDS)
+    finally:
+        if leader_lock is not None:
+            leader_lock.release()
+    logger.info("Local ingest thread stopped.")
+
+def start_local_ingest():
+    global ingest_thread
+    if ingest_thread is None or not ingest_thread.is_alive():
+        ingest_thread = threading.Thread(target=background_local_ingest,
+                                         args=(FileLeaderLock(INGEST_LOCK_FILE),), daemon=True)
+        ingest_thread.start()
+    return ingest_thread
+
+def create_app():
     
-    summary = {
-        'total_hours': round(total_hours, 1),
-        'good_posture_percentage': round(sum(d['good_posture_percentage'] for d in daily_data) / len(daily_data), 1),
-        'forward_lean_percentage': 25,
-        'side_tilt_percentage': 15,
-        'total_alerts': total_alerts
-    }
+    """Prepares the shared state and returns the Flask app.
+
+    Used by wsgi.py (gunicorn, once per worker process) and by the
+    development server below. Alerts and aggregates live in stores on disk
+    that every worker reads, and only one process runs the Drive fetcher.
+    """
     
-    return {
-        'daily_data': daily_data,
-        'summary': summary
-    }
+    os.makedirs(LOCAL_DOWNLOAD_DIR, exist_ok=True)
+    metrics.start_multiprocess_writer(METRICS_DIR)
+    logger.info(f"CSV files from Drive will be saved to: {os.path.abspath(LOCAL_DOWNLOAD_DIR)}")
+    # Sessions stored flat by earlier versions (or copied in by hand) move into their partitions
+    placed = session_catalog.place_all(skip=local_ingest.open_part_names(LOCAL_DOWNLOAD_DIR))
+    if placed:
+        logger.info(f"Moved {placed} session file(s) into user/device/day partitions.")
+    stats_cache.refresh()
+    if DRIVE_FETCHER_MODE == 'leader':
+        start_background_fetcher()
+    else:
+        logger.info(f"Background Drive fetcher not started in this process (DRIVE_FETCHER_MODE={DRIVE_FETCHER_MODE}).")
+    if local_ingester is not None:
+        start_local_ingest()
+    return app
+
+
 
+def store_alerts(alerts):
+    
+    """Persists alerts in the alert store and pushes them to this process's dashboards.
 
+    alert_broadcaster picks them up from the store for the other worker processes.
+    """
+    
+    for alert in alerts:
+        if not alert.get('user_id') and alert.get('device_id'):
+            alert['user_id'] = session_catalog.device_users.user_for(alert['device_id'])
+    stored = alert_store.add_many(alerts)
+    ALERTS_RECEIVED.inc(len(alerts))
+    alert_broadcaster.publish_stored(stored)
+    return stored
+
+
+def llm_cache_metrics():
+    stats = llm_cache.stats()
+    lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+    return [
+        ('posture_llm_cache_hits_total', 'counter', 'Chat replies served from the LLM response cache', stats['hits']),
+        ('posture_llm_cache_misses_total', 'counter', 'Chat replies that needed an upstream call', stats['misses']),
+        ('posture_llm_cache_coalesced_total', 'counter', 'Chat replies that waited on an identical call',
+         stats['coalesced']),
+        ('posture_llm_cache_hit_ratio', 'gauge', 'Share of chat replies not needing their own upstream call',
+         (stats['hits'] + stats['coalesced']) / lookups if lookups else 0),
+        ('posture_llm_cache_entries', 'gauge', 'Replies held in the LLM response cache', stats['entries']),
+        ('posture_stats_cache_files', 'gauge', 'Session files in the statistics cache', len(stats_cache.entries)),
+    ]
+
+metrics.register_collector(llm_cache_metrics)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.labels(request.endpoint or 'unknown').observe(time.perf_counter() - started)
+    return response
 
 
 #______________________FLASK ROUTES_________________________________
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: the metrics of every gunicorn worker, whichever one serves the scrape."""
+    return Response(metrics.render_multiprocess(METRICS_DIR), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/dashboard')
+def alert_dashboard():
+    return render_template('dashboard.html')
+
 @app.route('/alert', methods=['POST'])
 def receive_alert_post():
-    global received_alerts
     if request.method == 'POST':
         try:
             data = request.get_json()
             if data:
                 logger.info(f"New Alert Received via POST! Data: {data}")
-                display_message = f"[{data.get('timestamp', 'No Timestamp')}] {data.get('message', 'No Message')}"
-                received_alerts.appendleft(display_message)
+                store_alerts([data])
                 return jsonify({"status": "success", "message": "Alert received", "data": data}), 200
             else:
                 logger.warning("Received POST to /alert with no JSON data.")
@@ -252,10 +452,113 @@ def receive_alert_post():
             logger.error(f"Error processing /alert POST request: {e}", exc_info=True)
             return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/alert/batch', methods=['POST'])
+def receive_alert_batch():
+    try:
+        data = request.get_json(silent=True)
+        alerts = data.get('alerts') if isinstance(data, dict) else data
+        if not isinstance(alerts, list):
+            return jsonify({"status": "error", "message": "Expected a JSON array of alerts"}), 400
+        if len(alerts) > MAX_ALERTS_PER_BATCH:
+            return jsonify({"status": "error", "message": f"At most {MAX_ALERTS_PER_BATCH} alerts per batch"}), 413
+
+        valid_alerts = [alert for alert in alerts if isinstance(alert, dict) and alert]
+        store_alerts(valid_alerts)
+        accepted = len(valid_alerts)
+        logger.info(f"Batch of {len(alerts)} alert(s) received, {accepted} accepted.")
+        return jsonify({"status": "success", "accepted": accepted, "rejected": len(alerts) - accepted}), 200
+    except Exception as e:
+        logger.error(f"Error processing /alert/batch POST request: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/alerts/stream')
+def stream_alerts():
+    """Server-sent events stream pushing each new alert as it arrives."""
+    # EventSource sends the id of the last frame it got when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+    response = Response(stream_with_context(alert_broadcaster.stream(last_event_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/get_alerts_data', methods=['GET'])
 def get_alerts_data_json():
-    alerts_list = list(received_alerts)
-    return jsonify({"alerts": alerts_list})
+    last_id, last_ts = alert_store.last_change()
+    return conditional_json(
+        [last_id],
+        lambda: {"alerts": [alert['display'] for alert in alert_store.latest(MAX_MESSAGES)]},
+        last_modified=last_ts)
+
+@app.route('/api/alerts')
+def get_alert_history():
+    """Alert history of one user, by `days` back from now or an explicit [start, end) epoch range."""
+    try:
+        user_id = request.args.get('user', DEFAULT_USER_ID)
+        # Clamped: SQLite reads a negative LIMIT as no limit at all
+        limit = max(1, min(int(request.args.get('limit', ALERT_HISTORY_DEFAULT_LIMIT)), ALERT_HISTORY_MAX_LIMIT))
+        if 'start' in request.args:
+            start_ts = float(request.args['start'])
+            end_ts = float(request.args['end']) if 'end' in request.args else None
+        else:
+            start_ts = time.time() - int(request.args.get('days', 7)) * 86400
+            end_ts = None
+        last_id, last_ts = alert_store.last_change()
+        # A window relative to now also changes as old alerts leave it
+        window_tag = int(time.time() // 60) if end_ts is None else None
+        return conditional_json(
+            [last_id, window_tag],
+            lambda: {"user_id": user_id,
+                     "alerts": alert_store.query_range(user_id, start_ts, end_ts, limit=limit),
+                     "counts": alert_store.count(user_id, start_ts, end_ts)})
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+
+@app.route('/api/pose/batch', methods=['POST'])
+def receive_pose_batch():
+    """Live samples from a BLE receiver: {"devices": {device_id: [[time, timestamp, pitch, roll, yaw], ...]}}."""
+    data = request.get_json(silent=True)
+    devices = data.get('devices') if isinstance(data, dict) else None
+    if not isinstance(devices, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object of devices"}), 400
+    if sum(len(rows) for rows in devices.values() if isinstance(rows, list)) > MAX_POSE_SAMPLES_PER_BATCH:
+        return jsonify({"status": "error", "message": f"At most {MAX_POSE_SAMPLES_PER_BATCH} samples per batch"}), 413
+    accepted = {}
+    try:
+        # Check every device's samples first, so a bad payload stores nothing
+        records = {device_id: pose_records(rows) for device_id, rows in devices.items()}
+        for device_id, device_records in records.items():
+            accepted[device_id] = pose_store.push(device_id, device_records)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e), "accepted": accepted}), 400
+    POSE_SAMPLES_RECEIVED.inc(sum(accepted.values()))
+    return jsonify({"status": "success", "accepted": accepted}), 200
+
+@app.route('/api/pose/latest')
+def get_latest_pose():
+    """Latest pose and `window`-second statistics of one device, or of every live device without `device_id`.
+
+    Served from the in-memory ring buffers only, never from disk or Drive.
+    """
+    try:
+        window = float(request.args.get('window', DEFAULT_WINDOW_SECONDS))
+        if not np.isfinite(window) or window <= 0:
+            raise ValueError(f"window must be a positive number of seconds, not {window}")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    window = min(window, MAX_POSE_WINDOW_SECONDS)
+    now = time.time()
+    device_id = request.args.get('device_id')
+    if device_id:
+        snapshot = pose_store.snapshot(device_id, window, now)
+        if snapshot is None:
+            return jsonify({"error": f"No live data for device {device_id}"}), 404
+        response = jsonify(snapshot)
+    else:
+        snapshots = [pose_store.snapshot(d, window, now) for d in pose_store.device_ids()]
+        response = jsonify({"devices": [s for s in snapshots if s is not None]})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/fetch_drive_csvs_manual', methods=['GET'])
 def fetch_drive_csvs_route_manual():
@@ -263,24 +566,12 @@ def fetch_drive_csvs_route_manual():
     result = perform_drive_csv_fetch()
     return jsonify(result), 200 if result.get("status") == "success" else 500
 
-@app.route('/chat_ai', methods=['POST'])
-def chat_ai_endpoint():
-    data = request.get_json()
-    user_question = data.get('question')
-    topic_id = data.get('topic', 'general')
-    topic_context = data.get('context', '')
-
-    if not user_question:
-        return jsonify({"error": "Question not provided"}), 400
-
-    # Get posture data summary
-    posture_context = get_posture_summary_for_llm()
-
+def build_chat_prompt(topic_id, topic_context, user_question, posture_context):
     # Get topic-specific system prompt
     system_prompt = TOPIC_PROMPTS.get(topic_id, TOPIC_PROMPTS['tips'])
 
     # Enhanced prompt with topic context
-    full_prompt = f"""  {system_prompt}
+    return f"""  {system_prompt}
 
                         User's Current Posture Data:
                         {posture_context}
@@ -291,10 +582,67 @@ def chat_ai_endpoint():
 
                         Provide a helpful, specific response as PosturAI focusing on this topic. Be encouraging but realistic, and base your advice on the provided posture data when possible."""
 
+def generate_llm_text(prompt):
+    """Text of a complete (non-streamed) Gemini completion."""
+    try:
+        with LLM_UPSTREAM_SECONDS.labels('complete').time():
+            return model_gemini.generate_content(prompt).text
+    except Exception:
+        LLM_UPSTREAM_ERRORS.inc()
+        raise
+
+def stream_llm_text(prompt):
+    """Yields the text of each chunk of a streamed Gemini completion."""
+    started = time.perf_counter()
+    first_chunk = True
+    try:
+        for chunk in model_gemini.generate_content(prompt, stream=True):
+            if first_chunk:
+                LLM_UPSTREAM_SECONDS.labels('first_chunk').observe(time.perf_counter() - started)
+                first_chunk = False
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only safety metadata)
+                continue
+            if text:
+                yield text
+    except Exception:
+        LLM_UPSTREAM_ERRORS.inc()
+        raise
+    LLM_UPSTREAM_SECONDS.labels('stream').observe(time.perf_counter() - started)
+
+def sse_event(data, event=None):
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/chat_ai', methods=['POST'])
+def chat_ai_endpoint():
+    data = request.get_json()
+    user_question = data.get('question')
+    topic_id = data.get('topic', 'general')
+    topic_context = data.get('context', '')
+    wants_stream = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+    if not user_question:
+        return jsonify({"error": "Question not provided"}), 400
+
+    # Get posture data summary
+    posture_context = get_posture_summary_for_llm(data.get('user_id') or DEFAULT_USER_ID)
+    full_prompt = build_chat_prompt(topic_id, topic_context, user_question, posture_context)
+    # Identical questions about the same data are answered once; concurrent duplicates share the call
+    cache_key = make_cache_key(topic_id, user_question, topic_context, posture_context)
+
+    if wants_stream and model_gemini:
+        return Response(stream_with_context(stream_chat_reply(cache_key, full_prompt)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     try:
         if model_gemini:
-            response = model_gemini.generate_content(full_prompt)
-            ai_reply = response.text
+            ai_reply, source = llm_cache.get_or_generate(cache_key, lambda: generate_llm_text(full_prompt))
+            if source != 'generated':
+                logger.info(f"Answered /chat_ai from the response cache ({source}).")
         else:
             ai_reply = f"I'd love to help with {topic_id}, but I'm having trouble connecting to my AI services right now. Please try again later!"
 
@@ -304,39 +652,160 @@ def chat_ai_endpoint():
 
     return jsonify({"reply": ai_reply})
 
+def stream_chat_reply(cache_key, full_prompt):
+    """SSE frames for a streamed /chat_ai reply: one `data: {"delta": ...}` per chunk, then `event: done`."""
+    reply = []
+    try:
+        for text in llm_cache.stream_or_generate(cache_key, lambda: stream_llm_text(full_prompt)):
+            reply.append(text)
+            yield sse_event({"delta": text})
+        yield sse_event({"reply": ''.join(reply)}, event="done")
+    except Exception as e:
+        logger.error(f"Error during streamed LLM call: {e}")
+        yield sse_event({"error": "I'm having some difficulty processing your request right now. Please try again in a moment."},
+                        event="error")
+
 @app.route('/api/posture-stats')
 def get_posture_statistics():
     """API endpoint to get posture statistics for the frontend graphs"""
     try:
         days = int(request.args.get('days', 7))
-        mock_data = generate_mock_posture_data(days)
-        return jsonify(mock_data)
+        user_id = request.args.get('user', DEFAULT_USER_ID)
+        stats_cache.refresh_if_changed()
+        last_id, last_ts = alert_store.last_change()
+
+        def build():
+            # Only the user's partitions of the window (and the day before, for sessions running past midnight)
+            since = datetime.now() - timedelta(days=days)
+            stats = posture_analytics.build_posture_stats(stats_cache.get_daily(user_id, since), days)
+            stats['summary']['alert_categories'] = alert_store.count(user_id, time.time() - days * 86400)
+            return stats
+
+        # The day window moves at midnight and alert counts drift as alerts age, so the hour is part of the tag
+        return conditional_json(
+            [stats_cache.data_tag, last_id, user_id, datetime.now().strftime('%Y%m%d%H')],
+            build,
+            last_modified=max(stats_cache.last_modified or 0, last_ts or 0) or None)
     except Exception as e:
         logger.error(f"Error getting posture statistics: {e}")
         return jsonify({"error": "Failed to fetch statistics"}), 500
 
+@app.route('/api/posture-episodes')
+def get_posture_episodes():
+    """Debounced poor-posture episodes (start, end, type, peak angle) of the last `days` days.
+
+    An optional `type` (side_tilt, forward_lean or both) filters the list.
+    """
+    try:
+        days = int(request.args.get('days', 7))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    episode_type = request.args.get('type')
+    user_id = request.args.get('user', DEFAULT_USER_ID)
+    stats_cache.refresh_if_changed()
+
+    def build():
+        since = (datetime.now() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        episodes = stats_cache.get_episodes(since.isoformat(), user_id)
+        if episode_type:
+            episodes = [ep for ep in episodes if ep['type'] == episode_type]
+        return {
+            'days': days,
+            'summary': posture_analytics.summarize_episodes(episodes),
+            'episodes': [{key: ep[key] for key in ('start', 'end', 'duration_seconds', 'type', 'peak_angle',
+                                                    'peak_side', 'peak_forward')} for ep in episodes],
+        }
+
+    return conditional_json([stats_cache.data_tag, days, episode_type, user_id, datetime.now().strftime('%Y%m%d')], build,
+                            last_modified=stats_cache.last_modified or None)
+
+
+def parse_time_param(name, default):
+    """An ISO time from the query string as naive local time, like the session clocks."""
+    value = request.args.get(name)
+    if not value:
+        return default
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def choose_bucket_minutes(span_minutes, points):
+    """Finest rollup resolution with at most `points` buckets in the span; whole days beyond that."""
+    for resolution, bucket_minutes in rollups.RESOLUTIONS.items():
+        if -(-span_minutes // bucket_minutes) <= points:
+            return resolution, bucket_minutes
+    day = rollups.RESOLUTIONS['day']
+    return 'day', day * -(-span_minutes // (day * points))
+
+@app.route('/api/posture-timeseries')
+def get_posture_timeseries():
+    """Pitch/roll and posture over time for intraday charts, with a bounded number of points.
+
+    Query parameters: user, start/end (ISO, default the last `hours`=24
+    hours), points (budget, default 500) and resolution (auto, raw, minute,
+    hour or day). auto returns raw samples when they fit the budget and
+    otherwise the finest rollup that does; raw downsamples with LTTB on
+    `metric`. Only the sessions of that user are read.
+    """
+    try:
+        user_id = request.args.get('user', DEFAULT_USER_ID)
+        end = parse_time_param('end', datetime.now())
+        start = parse_time_param('start', end - timedelta(hours=float(request.args.get('hours', 24))))
+        points = max(3, min(int(request.args.get('points', TIMESERIES_DEFAULT_POINTS)), TIMESERIES_MAX_POINTS))
+        resolution = request.args.get('resolution', 'auto')
+        metric = request.args.get('metric', 'pitch')
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    if end <= start or metric not in ('pitch', 'roll') or resolution not in ('auto', 'raw', *rollups.RESOLUTIONS):
+        return jsonify({"error": "Invalid time range, metric or resolution"}), 400
+
+    stats_cache.refresh_if_changed()
+    return conditional_json(
+        [stats_cache.data_tag, user_id, None if 'end' in request.args else int(time.time() // 60)],
+        lambda: build_timeseries(start, end, points, resolution, metric, user_id))
+
+def build_timeseries(start, end, points, resolution, metric, user_id=None):
+    start_minute = int(np.datetime64(start, 'm').astype(np.int64))
+    end_minute = -(-int(np.datetime64(end, 's').astype(np.int64)) // 60)
+    span_minutes = end_minute - start_minute
+    response = {'user_id': user_id, 'start': start.isoformat(), 'end': end.isoformat(), 'points_budget': points}
+
+    raw_fits = (end - start).total_seconds() * 1000 // posture_analytics.SAMPLE_PERIOD_MS <= points
+    if resolution == 'raw' or (resolution == 'auto' and raw_fits):
+        raw = rollup_store.raw_samples(start, end, user_id=user_id)
+        if raw is not None:
+            kept = rollups.lttb_indices(raw['time'].astype(np.int64), raw[metric], points)
+            response.update(resolution='raw', downsampled=len(kept) < len(raw['time']), series={
+                't': [str(t) for t in raw['time'][kept]],
+                'pitch': np.round(raw['pitch'][kept].astype(np.float64), 2).tolist(),
+                'roll': np.round(raw['roll'][kept].astype(np.float64), 2).tolist(),
+            })
+            return response
+        resolution = 'auto'     # Too many samples to load: fall back to rollups
+
+    if resolution == 'auto' or -(-span_minutes // rollups.RESOLUTIONS[resolution]) > points:
+        resolution, bucket_minutes = choose_bucket_minutes(span_minutes, points)
+    else:
+        bucket_minutes = rollups.RESOLUTIONS[resolution]
+
+    rows = rollup_store.query(start_minute, end_minute, bucket_minutes, user_id)
+    response.update(resolution=resolution, series=rollups.rollup_series(rows, bucket_minutes))
+    return response
+
 
 if __name__ == '__main__':
+    # Development server. In production serve wsgi:app with gunicorn (see gunicorn.conf.py)
     logger.info("Flask Alert Server Starting with Google Drive integration...")
-    os.makedirs(LOCAL_DOWNLOAD_DIR, exist_ok=True)
-    logger.info(f"CSV files from Drive will be saved to: {os.path.abspath(LOCAL_DOWNLOAD_DIR)}")
-
-    logger.info("Attempting to initialize Google Drive service for background thread setup...")
-    drive_service_init = drive_utils.get_drive_service()
-    if drive_service_init:
-        logger.info("Google Drive service initialized successfully. Starting background fetcher.")
-        fetcher_thread = threading.Thread(target=background_drive_fetcher, daemon=True)
-        fetcher_thread.start()
-    else:
-        logger.error("Failed to initialize Google Drive service. Background fetcher NOT started.")
+    create_app()
 
     try:
-        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False if drive_service_init else True)
+        app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG', '0') == '1', use_reloader=False, threaded=True)
     except KeyboardInterrupt:
         logger.info("Flask server shutting down...")
     finally:
         logger.info("Signaling background thread to stop...")
         background_thread_stop_event.set()
-        if 'fetcher_thread' in locals() and fetcher_thread.is_alive():
+        if fetcher_thread is not None and fetcher_thread.is_alive():
             fetcher_thread.join(timeout=5)
-        logger.info("Flask application terminated.")
\ No newline at end of file
+        logger.info("Flask application terminated.")
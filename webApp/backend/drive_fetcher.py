@@ -0,0 +1,18 @@
+# drive_fetcher.py
+# Runs the Google Drive fetcher as its own process. Start the web workers with
+# DRIVE_FETCHER_MODE=external (or keep "leader": the shared lock still lets only one process fetch).
+import os
+import logging
+from app import background_drive_fetcher, background_thread_stop_event, FETCHER_LOCK_FILE, LOCAL_DOWNLOAD_DIR
+from leader_lock import FileLeaderLock
+
+logger = logging.getLogger(__name__)
+
+
+if __name__ == '__main__':
+    os.makedirs(LOCAL_DOWNLOAD_DIR, exist_ok=True)
+    try:
+        background_drive_fetcher(FileLeaderLock(FETCHER_LOCK_FILE))
+    except KeyboardInterrupt:
+        background_thread_stop_event.set()
+        logger.info("Drive fetcher stopped by user.")
@@ -1,13 +1,19 @@
 # google_drive_utils.py
 import os
 import io
+import json
 import logging
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient import discovery_cache
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # --- CONFIGURATION ---
 # If modifying these scopes, delete the file token.json.
@@ -18,96 +24,245 @@ SCOPES = [
 ]
 CREDENTIALS_FILE = '../../config/credentials.json'
 TOKEN_FILE = '../../config/token.json'
+LIST_PAGE_SIZE = 1000 # Maximum allowed by the Drive API
+DOWNLOAD_WORKERS = 4
+HTTP_TIMEOUT_SECONDS = 60
 
 # Setup basic logging for this module
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
-def get_drive_service():
-    
-    """Authenticates and returns the Google Drive API service client."""
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            logger.info("Refreshing expired Google Drive token.")
-            creds.refresh(Request())
-        else:
-            logger.info("Google Drive token not found or invalid. Initiating new auth flow.")
-            if not os.path.exists(CREDENTIALS_FILE):
-                logger.error(f"{CREDENTIALS_FILE} not found. Cannot authenticate.")
-                return None
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-    
-            try:
-                creds = flow.run_local_server(port=0) # Will open a browser for auth on first run
-            except Exception as e:
-                logger.error(f"Failed to run local server for OAuth: {e}. Try run_console() instead in get_drive_service().")
-                logger.info("Attempting run_console() as a fallback...")
+class DriveServiceHolder:
+    """Long-lived, thread-safe owner of the Drive credentials and service clients.
+
+    Credentials are loaded once and refreshed (and saved back to the token
+    file) only when they expire. The static discovery document is parsed
+    once, and every thread gets its own service client bound to its own
+    keep-alive HTTP connection, since httplib2 connections must not be
+    shared between threads.
+    """
+
+    def __init__(self, scopes=None, token_file=TOKEN_FILE, credentials_file=CREDENTIALS_FILE):
+        self.scopes = scopes or SCOPES
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        self._creds = None
+        self._discovery_doc = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def get_credentials(self):
+        """Returns valid credentials, running the OAuth flow only when there is no usable token."""
+        with self._lock:
+            creds = self._creds
+            if creds is None and os.path.exists(self.token_file):
+                creds = Credentials.from_authorized_user_file(self.token_file, self.scopes)
+            if creds and creds.valid:
+                self._creds = creds
+                return creds
+
+            if creds and creds.expired and creds.refresh_token:
+                logger.info("Refreshing expired Google Drive token.")
                 try:
-                    creds = flow.run_console()
-                except Exception as e_console:
-                    logger.error(f"run_console() also failed: {e_console}")
+                    creds.refresh(Request())
+                except Exception as e:
+                    logger.error(f"Failed to refresh Google Drive token: {e}")
+                    return None
+            else:
+                logger.info("Google Drive token not found or invalid. Initiating new auth flow.")
+                if not os.path.exists(self.credentials_file):
+                    logger.error(f"{self.credentials_file} not found. Cannot authenticate.")
                     return None
+                flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, self.scopes)
+        
+                try:
+                    creds = flow.run_local_server(port=0) # Will open a browser for auth on first run
+                except Exception as e:
+                    logger.error(f"Failed to run local server for OAuth: {e}. Try run_console() instead in get_drive_service().")
+                    logger.info("Attempting run_console() as a fallback...")
+                    try:
+                        creds = flow.run_console()
+                    except Exception as e_console:
+                        logger.error(f"run_console() also failed: {e_console}")
+                        return None
 
-        with open(TOKEN_FILE, 'w') as token:
-            token.write(creds.to_json())
-            logger.info(f"Google Drive token saved to {TOKEN_FILE}")
+            with open(self.token_file, 'w') as token:
+                token.write(creds.to_json())
+                logger.info(f"Google Drive token saved to {self.token_file}")
+            self._creds = creds
+            return creds
 
-    try:
-        service = build('drive', 'v3', credentials=creds)
-        logger.info("Google Drive service created successfully.")
-        return service
-    except HttpError as error:
-        logger.error(f'An error occurred building the Drive service: {error}')
-        return None
-    except Exception as e:
-        logger.error(f'An unexpected error occurred: {e}')
-        return None
+    def thread_http(self):
+        """Returns this thread's authorized keep-alive HTTP connection."""
+        creds = self.get_credentials()
+        if creds is None:
+            return None
+        http = getattr(self._local, 'http', None)
+        if http is None or http.credentials is not creds:
+            http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS))
+            self._local.http = http
+            self._local.service = None
+        return http
+
+    def get_service(self):
+        """Returns this thread's Drive service client, building it on first use."""
+        http = self.thread_http()
+        if http is None:
+            return None
+        service = getattr(self._local, 'service', None)
+        if service is not None:
+            return service
+        try:
+            with self._lock:
+                if self._discovery_doc is None:
+                    self._discovery_doc = json.loads(discovery_cache.get_static_doc('drive', 'v3'))
+            service = build_from_document(self._discovery_doc, http=http)
+            self._local.service = service
+            logger.info("Google Drive service created successfully.")
+            return service
+        except HttpError as error:
+            logger.error(f'An error occurred building the Drive service: {error}')
+            return None
+        except Exception as e:
+            logger.error(f'An unexpected error occurred: {e}')
+            return None
+
+
+drive_service_holder = DriveServiceHolder()
+
+
+def get_drive_service():
+    
+    """Returns the calling thread's cached Google Drive API service client."""
+    return drive_service_holder.get_service()
 
 
 def list_csv_files_in_folder(service, folder_id):
-    """Lists CSV files in a specific Google Drive folder."""
+    """Lists all CSV files in a specific Google Drive folder, following every result page.
+
+    Returns None on errors, so a failed listing is never mistaken for an empty folder.
+    """
     if not service:
         logger.error("Drive service is not available.")
-        return []
+        return None
     try:
         query = f"'{folder_id}' in parents and mimeType='text/csv' and trashed=false"
-        results = service.files().list(
-            q=query,
-            pageSize=100, # Adjust as needed
-            fields="nextPageToken, files(id, name)"
-        ).execute()
-        items = results.get('files', [])
+        items = []
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=query,
+                pageSize=LIST_PAGE_SIZE,
+                pageToken=page_token,
+                fields="nextPageToken, files(id, name)"
+            ).execute()
+            items.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
         logger.info(f"Found {len(items)} CSV files in folder '{folder_id}'.")
         return items
     except HttpError as error:
         logger.error(f'An error occurred listing files: {error}')
-        return []
+        return None
+
+def get_start_page_token(service):
+    """Returns the Drive changes token marking 'now', or None on error."""
+    try:
+        return service.changes().getStartPageToken().execute().get('startPageToken')
+    except HttpError as error:
+        logger.error(f'An error occurred getting the changes start page token: {error}')
+        return None
+
+def list_changed_csv_files(service, folder_id, page_token):
+    """Lists CSV files added to or changed in the folder since page_token.
+
+    Returns (files, new_start_page_token), or (None, None) if the token could
+    not be used and the caller should fall back to a full listing.
+    """
+    if not service:
+        logger.error("Drive service is not available.")
+        return None, None
+    items = {}
+    try:
+        while True:
+            results = service.changes().list(
+                pageToken=page_token,
+                pageSize=LIST_PAGE_SIZE,
+                spaces='drive',
+                fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, trashed))"
+            ).execute()
+            for change in results.get('changes', []):
+                file = change.get('file')
+                if change.get('removed') or not file or file.get('trashed'):
+                    continue
+                if file.get('mimeType') == 'text/csv' and folder_id in file.get('parents', []):
+                    items[file['id']] = {'id': file['id'], 'name': file['name']}
+            if 'newStartPageToken' in results:
+                logger.info(f"Found {len(items)} new or changed CSV files in folder '{folder_id}'.")
+                return list(items.values()), results['newStartPageToken']
+            page_token = results.get('nextPageToken')
+    except HttpError as error:
+        logger.error(f'An error occurred listing Drive changes: {error}')
+        return None, None
+
+def download_file(service, file_id, file_name, local_download_path, http=None):
+    """Downloads a file from Google Drive to a local path.
 
-def download_file(service, file_id, file_name, local_download_path):
-    """Downloads a file from Google Drive to a local path."""
+    The file is written to a temporary name and renamed into place once
+    complete, so other readers never see a partial download. Pass `http`
+    to use a dedicated connection (required when downloading from several
+    threads, as httplib2 connections are not thread-safe).
+    """
     if not service:
         logger.error("Drive service is not available.")
         return False
+    tmp_path = local_download_path + ".part"
     try:
         request = service.files().get_media(fileId=file_id)
-        os.makedirs(os.path.dirname(local_download_path), exist_ok=True) # Ensure directory exists
-        fh = io.FileIO(local_download_path, 'wb')
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
+        if http is not None:
+            request.http = http
+        os.makedirs(os.path.dirname(local_download_path) or '.', exist_ok=True) # Ensure directory exists
         logger.info(f"Starting download of '{file_name}' (ID: {file_id}) to '{local_download_path}'")
-        while done is False:
-            status, done = downloader.next_chunk()
-            if status:
-                logger.info(f"Download {int(status.progress() * 100)}%.")
+        with io.FileIO(tmp_path, 'wb') as fh:
+            downloader = MediaIoBaseDownload(fh, request)
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk()
+                if status:
+                    logger.debug(f"Download of '{file_name}' {int(status.progress() * 100)}%.")
+        os.replace(tmp_path, local_download_path)
         logger.info(f"Successfully downloaded '{file_name}' to '{local_download_path}'.")
         return True
     except HttpError as error:
         logger.error(f'An error occurred downloading file ID {file_id}: {error}')
-        return False
     except Exception as e:
         logger.error(f"An unexpected error occurred during download of {file_id}: {e}")
-        return False
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return False
+
+_download_pool = None
+_download_pool_lock = threading.Lock()
+
+def download_files(service, downloads, holder=None):
+    """Downloads [(file_id, file_name, local_path), ...] on a bounded, long-lived thread pool.
+
+    Each worker thread reuses its own keep-alive connection from the holder
+    across fetch cycles. Returns the list of downloads that succeeded.
+    """
+    global _download_pool
+    if not downloads:
+        return []
+    holder = holder or drive_service_holder
+    with _download_pool_lock:
+        if _download_pool is None:
+            _download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='drive-download')
+
+    def worker(download):
+        file_id, file_name, local_path = download
+        return download if download_file(service, file_id, file_name, local_path, http=holder.thread_http()) else None
+
+    results = list(_download_pool.map(worker, downloads))
+    return [r for r in results if r is not None]
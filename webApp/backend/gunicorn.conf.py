@@ -0,0 +1,15 @@
+# gunicorn.conf.py
+import os
+import multiprocessing
+
+bind = os.getenv('BIND', "0.0.0.0:5000")
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# Threaded workers: a slow Gemini call or an open alert stream only occupies one thread
+worker_class = "gthread"
+threads = int(os.getenv('GUNICORN_THREADS', "16"))
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+# No preload: every worker opens its own database connections and background threads after the fork
+preload_app = False
+accesslog = "-"
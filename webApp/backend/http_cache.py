@@ -0,0 +1,71 @@
+# http_cache.py
+import gzip
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+from flask import request, jsonify, Response
+from werkzeug.http import is_resource_modified
+
+try:
+    import brotli   # Optional: pip install Brotli
+except ImportError:
+    brotli = None
+
+# --- CONFIGURATION ---
+COMPRESS_MIN_BYTES = 1024       # Smaller bodies are not worth compressing
+COMPRESS_MIMETYPES = ('application/json', 'text/html', 'text/css', 'text/plain', 'application/javascript')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+logger = logging.getLogger(__name__)
+
+
+def make_etag(*parts):
+    """Short hash of the values that determine a response body."""
+    return hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:20]
+
+
+def conditional_json(etag_parts, build, last_modified=None):
+    """JSON response validated by ETag (and Last-Modified, epoch seconds).
+
+    build() is only called, and the body only serialized, when the client's
+    copy is stale; otherwise the response is an empty 304 Not Modified.
+    """
+    etag = make_etag(request.full_path, *etag_parts)
+    modified_at = datetime.fromtimestamp(last_modified, timezone.utc) if last_modified else None
+    if not is_resource_modified(request.environ, etag=etag, last_modified=modified_at):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    # Weak: the body may be sent gzip or brotli encoded
+    response.set_etag(etag, weak=True)
+    if modified_at:
+        response.last_modified = modified_at
+    # Browsers keep the body but revalidate on every request
+    response.cache_control.no_cache = True
+    return response
+
+
+def compress_response(response):
+    """after_request hook: brotli or gzip encodes large textual responses the client accepts."""
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    # Whether or not this body gets encoded, the same URL may be for another client, so caches must
+    # key on Accept-Encoding (304s included: they describe the response that would have been sent)
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
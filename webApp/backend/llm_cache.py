@@ -0,0 +1,186 @@
+# llm_cache.py
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+LLM_CACHE_MAX_ENTRIES = 256
+LLM_CACHE_TTL_SECONDS = 3600
+LLM_SINGLE_FLIGHT_TIMEOUT_SECONDS = 120     # Followers stop waiting on a stuck upstream call after this long
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question):
+    """Case, whitespace and trailing punctuation do not change the answer."""
+    return re.sub(r'\s+', ' ', (question or '').strip().lower()).rstrip('?!. ')
+
+
+def make_cache_key(topic, question, topic_context, summary):
+    """Hash of the normalized request and the posture summary it is answered from."""
+    summary_version = hashlib.sha1((summary or '').encode('utf-8')).hexdigest()
+    parts = [topic or '', normalize_question(question), (topic_context or '').strip(), summary_version]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMResponseCache:
+    """LRU + TTL cache of LLM replies with single-flight request coalescing.
+
+    get_or_generate(key, generate) returns a cached reply when there is a
+    fresh one. Otherwise the first caller runs generate() and concurrent
+    callers with the same key wait for its result instead of issuing their
+    own upstream call. Failed generations are not cached.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()   # key -> (expires, reply)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._get_locked(key)
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _claim(self, key):
+        """Returns (cached reply, flight, is_leader) for key."""
+        with self._lock:
+            reply = self._get_locked(key)
+            if reply is not None:
+                self.hits += 1
+                return reply, None, False
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return None, flight, False
+            flight = self._in_flight[key] = _Flight()
+            self.misses += 1
+            return None, flight, True
+
+    def _wait(self, flight):
+        if not flight.done.wait(LLM_SINGLE_FLIGHT_TIMEOUT_SECONDS):
+            raise TimeoutError("Timed out waiting for an identical in-flight LLM request")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _finish(self, key, flight):
+        if flight.error is None:
+            self.put(key, flight.result)
+        with self._lock:
+            del self._in_flight[key]
+        flight.done.set()
+
+    def get_or_generate(self, key, generate):
+        """Returns (reply, source) where source is 'cache', 'coalesced' or 'generated'."""
+        reply, flight, leader = self._claim(key)
+        if reply is not None:
+            return reply, 'cache'
+        if not leader:
+            return self._wait(flight), 'coalesced'
+        try:
+            flight.result = generate()
+            return flight.result, 'generated'
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._finish(key, flight)
+
+    def stream_or_generate(self, key, stream):
+        """Generator variant: yields reply chunks, from the cache or as stream() produces them.
+
+        Callers that coalesce onto an in-flight request get its full reply as
+        one chunk once it is done. A leader that is closed early (the client
+        went away) does not cache its partial reply.
+        """
+        reply, flight, leader = self._claim(key)
+        if reply is not None:
+            yield reply
+            return
+        if not leader:
+            yield self._wait(flight)
+            return
+        chunks = []
+        try:
+            for chunk in stream():
+                chunks.append(chunk)
+                yield chunk
+            flight.result = ''.join(chunks)
+        except BaseException as e:
+            flight.error = e if isinstance(e, Exception) else RuntimeError("LLM stream was closed early")
+            raise
+        finally:
+            self._finish(key, flight)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+            }
+
+
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Offline stand-in for the Gemini model (LLM_MODEL=stub) for local testing and load tests."""
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.calls += 1
+        question = prompt.rsplit("User's Question:", 1)[-1].strip().splitlines()[0] if prompt else ''
+        text = f"[stub reply] You asked: {question}"
+        if stream:
+            return self._stream(text)
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return _StubResponse(text)
+
+    def _stream(self, text):
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            time.sleep(self.latency_seconds / len(words))
+            yield _StubResponse(word if i == 0 else ' ' + word)
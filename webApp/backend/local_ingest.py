@@ -0,0 +1,214 @@
+# local_ingest.py
+import os
+import json
+import time
+import logging
+import threading
+import posture_analytics
+
+# --- CONFIGURATION ---
+# Spool directory shared with auto_upload_csv.py when the receiver runs on this host ("" disables local ingest)
+LOCAL_INGEST_DIR = os.getenv('LOCAL_INGEST_DIR', "")
+LOCAL_INGEST_POLL_SECONDS = float(os.getenv('LOCAL_INGEST_POLL_SECONDS', "1.0"))
+LOCAL_PART_SECONDS = 3600       # A local part file is closed (and archived) once it is this old
+LOCAL_STATE_RETENTION_SECONDS = 24 * 3600   # Finished sessions are dropped from the ingest state after this
+INGEST_STATE_FILE_NAME = ".local_ingest_state.json"
+MANIFEST_SUFFIX = ".manifest.json"
+# Local parts get their own suffix: Drive segments of the same session (.partNNNN) must never overwrite them
+LOCAL_PART_NAME_FORMAT = "{session}.local{part:04d}.csv"
+
+logger = logging.getLogger(__name__)
+
+
+def load_ingest_state(data_dir):
+    """Sessions ingested locally, by session stem. Empty if none were."""
+    try:
+        with open(os.path.join(data_dir, INGEST_STATE_FILE_NAME), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Could not read local ingest state in '{data_dir}': {e}")
+        return {}
+
+
+def open_part_names(data_dir, state=None):
+    """File names of the local parts still being appended to."""
+    if state is None:
+        state = load_ingest_state(data_dir)
+    return {LOCAL_PART_NAME_FORMAT.format(session=session, part=entry['part']) for session, entry in state.items()
+            if entry['part_started'] is not None}
+
+
+def local_sessions(data_dir, spool_dir=LOCAL_INGEST_DIR):
+    """Stems of the sessions ingested locally or still waiting in the spool to be."""
+    sessions = set(load_ingest_state(data_dir))
+    if spool_dir:
+        try:
+            names = os.listdir(spool_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if name.endswith(MANIFEST_SUFFIX):
+                sessions.add(name[:-len(MANIFEST_SUFFIX)])
+            else:
+                session, _ = posture_analytics.segment_of(name)
+                if session is not None:
+                    sessions.add(session)
+    return sessions
+
+
+def locally_ingested(file_name, sessions, catalog=None):
+    """True if file_name is a Drive segment of a session in sessions (see local_sessions).
+
+    With a catalog, sessions whose local parts were archived (and since
+    dropped from the ingest state) count too.
+    """
+    session, _ = posture_analytics.segment_of(file_name)
+    session = session or os.path.splitext(file_name)[0]
+    if session in sessions:
+        return True
+    return catalog is not None and catalog.contains(LOCAL_PART_NAME_FORMAT.format(session=session, part=0))
+
+
+class LocalIngester:
+    """Moves session segments from a local spool directory into the data directory.
+
+    auto_upload_csv.py drops `<session>.partNNNN.csv` segments (complete
+    lines, renamed into place atomically) into the spool about once a
+    second and a `<session>.manifest.json` when the session ends. Each poll
+    appends the new segments of a session, in order, to its current local
+    part `<session>.localNNNN.csv` in data_dir, in place (segments hold
+    complete lines and load_orientation_csv ignores an unterminated last
+    line). A part is closed after LOCAL_PART_SECONDS (or when the session
+    ends) and handed to on_part_closed, so a session adds one catalogued
+    file per hour.
+
+    Which spool segment comes next and which local part is open are kept in
+    a state file in data_dir; the Drive fetcher reads it (and the spool, for
+    sessions not polled yet) to skip the backup copies of these sessions.
+    Sessions that ended LOCAL_STATE_RETENTION_SECONDS ago are dropped from
+    it. Only one process should poll (see leader_lock).
+    """
+
+    def __init__(self, spool_dir, data_dir, on_part_closed=None, part_seconds=LOCAL_PART_SECONDS):
+        self.spool_dir = spool_dir
+        self.data_dir = data_dir
+        self.on_part_closed = on_part_closed
+        self.part_seconds = part_seconds
+        self.state_file = os.path.join(data_dir, INGEST_STATE_FILE_NAME)
+        self.state = load_ingest_state(data_dir)
+        self.last_lag_seconds = None    # Age of the newest segment at the time it was ingested
+        self._lock = threading.Lock()
+
+    def _save_state(self):
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def _part_path(self, session, entry):
+        return os.path.join(self.data_dir, LOCAL_PART_NAME_FORMAT.format(session=session, part=entry['part']))
+
+    def _scan_spool(self):
+        """Returns ({session: [(index, path), ...] sorted}, {session: manifest path})."""
+        segments, manifests = {}, {}
+        try:
+            names = os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return segments, manifests
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            if name.startswith('.'):
+                continue    # Files still being written
+            if name.endswith(MANIFEST_SUFFIX):
+                manifests[name[:-len(MANIFEST_SUFFIX)]] = path
+                continue
+            session, index = posture_analytics.segment_of(name)
+            if session is not None and name.endswith('.csv'):
+                segments.setdefault(session, []).append((index, path))
+        for items in segments.values():
+            items.sort()
+        return segments, manifests
+
+    def poll(self):
+        """Ingests everything in the spool. Returns the number of segments appended to the data directory."""
+        with self._lock:
+            os.makedirs(self.data_dir, exist_ok=True)
+            segments, manifests = self._scan_spool()
+            now = time.time()
+            ingested = 0
+            consumed = []
+            closed = []
+            pruned = 0
+            for session in sorted(set(segments) | set(manifests) | set(self.state)):
+                entry = self.state.get(session)
+                if entry is None:
+                    # A session dropped from the state and then resumed continues where its segments do. It had
+                    # fewer parts than segments, so numbering the next part after the first segment never collides.
+                    first = min((index for index, _ in segments.get(session, [])), default=0)
+                    entry = self.state[session] = {'next_segment': first, 'part': first, 'part_started': None,
+                                                   'finalized': False}
+                data = []
+                for index, path in segments.get(session, []):
+                    if index < entry['next_segment']:
+                        consumed.append(path)   # Already appended before a restart
+                        continue
+                    if index > entry['next_segment']:
+                        break                   # Wait for the missing segment
+                    try:
+                        with open(path, 'rb') as f:
+                            data.append(f.read())
+                        self.last_lag_seconds = now - os.path.getmtime(path)
+                    except OSError as e:
+                        logger.error(f"Could not read spool segment '{path}': {e}")
+                        break
+                    consumed.append(path)
+                    entry['next_segment'] += 1
+                    ingested += 1
+
+                if data:
+                    if entry['finalized']:
+                        # The receiver resumed a session that had ended: continue in a new part
+                        entry['finalized'] = False
+                        entry.pop('finished_at', None)
+                    self._append(self._part_path(session, entry), b''.join(data))
+                    if entry['part_started'] is None:
+                        entry['part_started'] = now
+
+                session_ended = session in manifests and all(index < entry['next_segment']
+                                                             for index, _ in segments.get(session, []))
+                if entry['part_started'] is not None and (session_ended or now - entry['part_started'] >= self.part_seconds):
+                    closed.append(self._part_path(session, entry))
+                    entry['part'] += 1
+                    entry['part_started'] = None
+                if session_ended:
+                    entry['finalized'] = True
+                    entry['finished_at'] = now
+                    consumed.append(manifests[session])
+                elif entry['finalized'] and now - entry.setdefault('finished_at', now) >= LOCAL_STATE_RETENTION_SECONDS:
+                    del self.state[session]     # Its parts are catalogued, which the Drive fetcher also checks
+                    pruned += 1
+
+            if ingested or closed or consumed or pruned:
+                self._save_state()
+            # Spool files go only once the state says they are in data_dir, so a crash never loses a segment
+            for path in consumed:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            for path in closed:
+                if self.on_part_closed and os.path.exists(path):
+                    try:
+                        self.on_part_closed(path)
+                    except Exception as e:
+                        logger.error(f"Failed to archive local part '{path}': {e}")
+            if ingested:
+                logger.debug(f"Ingested {ingested} local segment(s); newest was {self.last_lag_seconds:.2f}s old.")
+            return ingested
+
+    def _append(self, path, data):
+        """Appends data to path in one write, so the cost does not grow with the part."""
+        with open(path, 'ab') as f:
+            f.write(data)
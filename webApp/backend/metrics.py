@@ -0,0 +1,380 @@
+# metrics.py
+import os
+import time
+import atexit
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Windows: a single server process is assumed there
+    fcntl = None
+
+# --- CONFIGURATION ---
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', "1") == "1"  # "0" turns every update into a no-op
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_DUMP_INTERVAL_SECONDS = 15
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+WORKER_FILE_PREFIX = "worker-"          # <directory>/worker-<pid>.prom, one per server process
+DEAD_WORKERS_FILE_NAME = "dead_workers.prom"   # Counters of processes that exited, summed
+
+logger = logging.getLogger(__name__)
+
+_metrics = []           # Every metric created in this process, in creation order
+_collectors = []        # Callables returning extra samples at render time
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+        if not self.labelnames:
+            self.labels()       # Unlabelled metrics are exported (as zero) before their first update
+
+    def labels(self, *values):
+        """The child metric for one combination of label values (created on first use)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _Value:
+    def __init__(self, lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount=1):
+        if METRICS_ENABLED:
+            with self._lock:
+                self.value += amount
+
+    def set(self, value):
+        if METRICS_ENABLED:
+            self.value = value
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """Monotonic counter. Use inc() directly, or labels(...).inc() when it has labels."""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _HistogramValue:
+    def __init__(self, lock, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, value):
+        if METRICS_ENABLED:
+            index = bisect.bisect_left(self.buckets, value)
+            with self._lock:
+                self.counts[index] += 1
+                self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observes the duration of the with-block in seconds."""
+        if not METRICS_ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labelnames, key):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames + ('le',), key + (_format_value(float(bound)),))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Distribution of durations (or sizes) over fixed buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self._lock, self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+def register_collector(collect):
+    """Adds a callable evaluated at render time, for values another component already tracks.
+
+    collect() returns a list of (name, kind, documentation, value) tuples.
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+def render():
+    """All metrics of this process in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collect in collectors:
+        try:
+            samples = collect()
+        except Exception as e:
+            logger.error(f"Metrics collector failed: {e}")
+            continue
+        for name, kind, documentation, value in samples:
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}",
+                          f"{name} {_format_value(float(value))}"])
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    """Writes render() to path atomically (node_exporter textfile collector format)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+def start_textfile_writer(path, interval_seconds=METRICS_DUMP_INTERVAL_SECONDS):
+    """Rewrites the metrics file every interval_seconds on a daemon thread. Returns its stop event."""
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                write_textfile(path)
+            except OSError as e:
+                logger.error(f"Could not write metrics file {path}: {e}")
+            if stop.wait(interval_seconds):
+                break
+
+    if METRICS_ENABLED:
+        threading.Thread(target=run, name='metrics-writer', daemon=True).start()
+    return stop
+
+
+def _parse_textfile(text):
+    """{family name: [kind, documentation, {series: value}]} of a render() output."""
+    families = {}
+    family = None
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            name, _, documentation = line[len('# HELP '):].partition(' ')
+            family = families.setdefault(name, ['untyped', documentation, {}])
+        elif line.startswith('# TYPE '):
+            name, _, kind = line[len('# TYPE '):].partition(' ')
+            family = families.setdefault(name, ['untyped', '', {}])
+            family[0] = kind
+        elif line and family is not None:
+            series, _, value = line.rpartition(' ')
+            family[2][series] = float(value)
+    return families
+
+
+def _with_label(series, name, value):
+    label = f'{name}="{value}"'
+    return series[:-1] + ',' + label + '}' if series.endswith('}') else series + '{' + label + '}'
+
+
+def _merge_families(merged, families, worker=None):
+    """Adds counters and histograms into merged; gauges only for a live worker, labelled with its pid."""
+    for name, (kind, documentation, samples) in families.items():
+        target = merged.setdefault(name, [kind, documentation, {}])
+        for series, value in samples.items():
+            if kind == 'gauge':
+                if worker is not None:
+                    target[2][_with_label(series, 'worker', worker)] = value
+            else:
+                target[2][series] = target[2].get(series, 0.0) + value
+
+
+def _render_families(families):
+    lines = []
+    for name, (kind, documentation, samples) in families.items():
+        lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"])
+        lines.extend(f"{series} {_format_value(value)}" for series, value in samples.items())
+    return '\n'.join(lines) + '\n'
+
+
+def _read_families(path):
+    try:
+        with open(path, 'r') as f:
+            return _parse_textfile(f.read())
+    except FileNotFoundError:
+        return {}
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _directory_lock(directory):
+    fd = os.open(os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)    # Also releases the flock
+
+
+def _fold_dead_workers(directory, paths):
+    """Adds the counters of exited processes to the dead workers file and removes their files. Lock held."""
+    if not paths:
+        return
+    dead_path = os.path.join(directory, DEAD_WORKERS_FILE_NAME)
+    merged = {}
+    _merge_families(merged, _read_families(dead_path))
+    for path in paths:
+        _merge_families(merged, _read_families(path))
+    tmp_path = dead_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(_render_families(merged))
+    os.replace(tmp_path, dead_path)
+    for path in paths:
+        os.remove(path)
+
+
+def _worker_file(directory, pid):
+    return os.path.join(directory, f"{WORKER_FILE_PREFIX}{pid}.prom")
+
+
+def start_multiprocess_writer(directory, interval_seconds=METRICS_DUMP_INTERVAL_SECONDS):
+    """Dumps this process' metrics into directory for render_multiprocess(). Returns the writer's stop event.
+
+    For servers with several worker processes (gunicorn), where each
+    scrape reaches a random worker.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = _worker_file(directory, os.getpid())
+    with _directory_lock(directory):
+        # A file under this pid was left by an earlier process that got the same pid
+        _fold_dead_workers(directory, [path] if os.path.exists(path) else [])
+
+    def write_at_exit():
+        try:
+            write_textfile(path)
+        except OSError as e:
+            logger.error(f"Could not write metrics file {path}: {e}")
+
+    if METRICS_ENABLED:
+        atexit.register(write_at_exit)
+    return start_textfile_writer(path, interval_seconds)
+
+
+def render_multiprocess(directory):
+    """Metrics of every process writing to directory, merged.
+
+    Counters and histograms are summed over all processes, including those
+    that exited, so they never go down while the server runs. Gauges are
+    kept per live process, labelled worker="<pid>". Values of other
+    processes are at most the writer interval old.
+    """
+    write_textfile(_worker_file(directory, os.getpid()))
+    merged = {}
+    with _directory_lock(directory):
+        dead = []
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith(WORKER_FILE_PREFIX) and name.endswith('.prom')):
+                continue
+            try:
+                pid = int(name[len(WORKER_FILE_PREFIX):-len('.prom')])
+            except ValueError:
+                continue
+            path = os.path.join(directory, name)
+            if _process_alive(pid):
+                _merge_families(merged, _read_families(path), worker=pid)
+            else:
+                dead.append(path)
+        _fold_dead_workers(directory, dead)
+        _merge_families(merged, _read_families(os.path.join(directory, DEAD_WORKERS_FILE_NAME)))
+    return _render_families(merged)
@@ -0,0 +1,249 @@
+# pose_buffer.py
+import os
+import re
+import time
+import logging
+import threading
+import numpy as np
+import posture_analytics
+
+try:
+    import fcntl
+except ImportError:     # Windows: buffers are per process there
+    fcntl = None
+
+# --- CONFIGURATION ---
+POSE_BUFFER_SECONDS = int(os.getenv('POSE_BUFFER_SECONDS', "300"))    # History kept per device
+POSE_MAX_RATE_HZ = 50                   # Highest sample rate of the firmware (binary stream)
+POSE_MAX_DEVICES = int(os.getenv('POSE_MAX_DEVICES', "64"))
+# Buffers in a shared memory directory are seen by every server process; without one they are per process
+POSE_BUFFER_DIR = os.getenv('POSE_BUFFER_DIR', "/dev/shm/posture_pose" if os.path.isdir("/dev/shm") else "")
+POSE_STALE_SECONDS = 10                 # A device with no newer sample is reported as not live
+DEFAULT_WINDOW_SECONDS = 10
+
+POSE_DTYPE = np.dtype([
+    ('time', '<f8'),            # Receiver wall clock (epoch seconds) when the sample arrived
+    ('timestamp', '<i8'),       # Device millis()
+    ('pitch', '<f4'),
+    ('roll', '<f4'),
+    ('yaw', '<f4'),
+])
+HEADER_BYTES = 16               # int64 total samples ever written, int64 capacity
+DEVICE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+logger = logging.getLogger(__name__)
+
+
+class PoseRingBuffer:
+    """Fixed-size ring of the latest orientation samples of one device.
+
+    Storage is preallocated once (capacity samples), so memory stays bounded
+    however long a session runs. With a path the ring lives in a
+    memory-mapped file (e.g. under /dev/shm) shared by all processes;
+    writers serialize on a file lock and readers never lock: the sample
+    count is published after the samples it covers. If another process
+    removes the file, replaced() tells that this mapping is orphaned.
+    """
+
+    def __init__(self, capacity, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._identity = None
+        if path is None:
+            raw = np.zeros(HEADER_BYTES + capacity * POSE_DTYPE.itemsize, dtype=np.uint8)
+        else:
+            size = HEADER_BYTES + capacity * POSE_DTYPE.itemsize
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._file_lock(True)
+            try:
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, 0)   # New, or created with another capacity: start over
+                    os.ftruncate(self._fd, size)
+                st = os.fstat(self._fd)
+                self._identity = (st.st_dev, st.st_ino)
+            finally:
+                self._file_lock(False)
+            raw = np.memmap(path, dtype=np.uint8, mode='r+', shape=(size,))
+        self._header = raw[:HEADER_BYTES].view('<i8')
+        self.samples = raw[HEADER_BYTES:].view(POSE_DTYPE)
+        self.capacity = len(self.samples)
+        self._header[1] = self.capacity
+
+    def _file_lock(self, acquire):
+        if self._fd is not None and fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if acquire else fcntl.LOCK_UN)
+
+    @property
+    def total(self):
+        return int(self._header[0])
+
+    def push(self, rows):
+        """Appends samples (a POSE_DTYPE array, oldest first)."""
+        if len(rows) == 0:
+            return
+        count = len(rows)
+        rows = rows[-self.capacity:]    # Older ones would be overwritten within this push anyway
+        with self._lock:
+            self._file_lock(True)
+            try:
+                total = int(self._header[0]) + count
+                self.samples[(total - len(rows) + np.arange(len(rows))) % self.capacity] = rows
+                self._header[0] = total
+            finally:
+                self._file_lock(False)
+
+    def latest(self, n):
+        """The newest min(n, stored) samples, oldest first."""
+        total = self.total
+        n = min(n, total, self.capacity)
+        if n <= 0:
+            return self.samples[:0]
+        return self.samples[(total - n + np.arange(n)) % self.capacity]
+
+    def replaced(self):
+        """True if the shared file was removed or replaced since this buffer mapped it."""
+        if self.path is None:
+            return False
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (st.st_dev, st.st_ino) != self._identity
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def window_stats(samples, window_seconds):
+    """Mean/min/max of pitch and roll and the poor-posture share over the last window_seconds of samples."""
+    if len(samples) == 0:
+        return None
+    samples = samples[samples['time'] >= samples['time'][-1] - window_seconds]
+    side_tilt, forward_lean = posture_analytics.classify_samples(samples['pitch'], samples['roll'])
+    stats = {'seconds': window_seconds, 'samples': len(samples),
+             'poor_pct': round(100.0 * float(np.mean(side_tilt | forward_lean)), 1)}
+    for name in ('pitch', 'roll'):
+        values = samples[name].astype(np.float64)
+        stats[name] = {'mean': round(float(values.mean()), 2), 'min': round(float(values.min()), 2),
+                       'max': round(float(values.max()), 2)}
+    return stats
+
+
+def pose_records(rows):
+    """Converts [[time, timestamp, pitch, roll, yaw], ...] to a POSE_DTYPE array.
+
+    Raises ValueError unless every row is a list of exactly that many numbers.
+    """
+    if not isinstance(rows, list):
+        raise ValueError("Expected a list of samples")
+    if not rows:
+        return np.empty(0, dtype=POSE_DTYPE)
+    fields = len(POSE_DTYPE.names)
+    if not all(isinstance(row, list) and len(row) == fields for row in rows):
+        raise ValueError(f"Each sample must be [{', '.join(POSE_DTYPE.names)}]")
+    try:
+        values = np.asarray(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("Sample fields must be numbers")
+    records = np.empty(len(values), dtype=POSE_DTYPE)
+    for i, name in enumerate(POSE_DTYPE.names):
+        records[name] = values[:, i]
+    return records
+
+
+class PoseStore:
+    """Ring buffers of every live device, keyed by device id.
+
+    At most max_devices buffers are open per process; the one updated least
+    recently is closed to make room for a new device (and its shared file
+    removed once it holds no sample newer than the buffer length). Other
+    processes may still have that file mapped: get() notices the removal
+    and remaps the device's current file, so no process keeps writing to
+    or reading from an orphaned copy.
+    """
+
+    def __init__(self, directory=POSE_BUFFER_DIR, seconds=POSE_BUFFER_SECONDS, max_devices=POSE_MAX_DEVICES):
+        self.directory = directory or None
+        self.capacity = seconds * POSE_MAX_RATE_HZ
+        self.max_devices = max_devices
+        self.buffers = {}
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, device_id):
+        return os.path.join(self.directory, f"{device_id}.pose") if self.directory else None
+
+    def device_ids(self):
+        if not self.directory:
+            return sorted(self.buffers)
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.pose'))
+
+    def get(self, device_id, create=False):
+        if not DEVICE_ID_PATTERN.match(device_id or ''):
+            return None
+        with self._lock:
+            buffer = self.buffers.get(device_id)
+            if buffer is not None:
+                if not buffer.replaced():
+                    return buffer
+                buffer.close()  # Evicted by another process
+                del self.buffers[device_id]
+            path = self._path(device_id)
+            if not create and (path is None or not os.path.exists(path)):
+                return None
+            if len(self.buffers) >= self.max_devices:
+                self._evict()
+            buffer = self.buffers[device_id] = PoseRingBuffer(self.capacity, path)
+            return buffer
+
+    def _evict(self):
+        def last_time(item):
+            newest = item[1].latest(1)
+            return newest['time'][0] if len(newest) else 0.0
+        device_id, buffer = min(self.buffers.items(), key=last_time)
+        idle = time.time() - last_time((device_id, buffer)) > self.capacity / POSE_MAX_RATE_HZ
+        buffer.close()
+        del self.buffers[device_id]
+        if buffer.path and idle:    # Other processes may still be using a device that is not idle
+            try:
+                os.remove(buffer.path)
+            except OSError:
+                pass
+        logger.info(f"Dropped the pose buffer of idle device {device_id}.")
+
+    def push(self, device_id, records):
+        """Stores samples (see pose_records) for a device. Returns the number of samples."""
+        buffer = self.get(device_id, create=True)
+        if buffer is None:
+            raise ValueError(f"Invalid device id {device_id!r}")
+        buffer.push(records)
+        return len(records)
+
+    def snapshot(self, device_id, window_seconds=DEFAULT_WINDOW_SECONDS, now=None):
+        """Latest pose and window statistics of one device, or None if it has no samples."""
+        buffer = self.get(device_id)
+        if buffer is None:
+            return None
+        window = buffer.latest(int(window_seconds * POSE_MAX_RATE_HZ))
+        if len(window) == 0:
+            return None
+        newest = window[-1]
+        side_tilt, forward_lean = posture_analytics.classify_samples(newest['pitch'], newest['roll'])
+        age = (now if now is not None else time.time()) - float(newest['time'])
+        return {
+            'device_id': device_id,
+            'time': float(newest['time']),
+            'age_seconds': round(age, 3),
+            'live': age <= POSE_STALE_SECONDS,
+            'timestamp': int(newest['timestamp']),
+            'pitch': round(float(newest['pitch']), 2),
+            'roll': round(float(newest['roll']), 2),
+            'yaw': round(float(newest['yaw']), 2),
+            'side_tilt': bool(side_tilt),
+            'forward_lean': bool(forward_lean),
+            'window': window_stats(window, window_seconds),
+        }
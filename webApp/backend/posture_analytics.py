@@ -0,0 +1,549 @@
+# posture_analytics.py
+import io
+import os
+import re
+import glob
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import session_store
+import posture_signal
+# Thresholds of the firmware alert rule, defined next to the signal-processing stage
+from posture_signal import PITCH_LIMIT, ROLL_MIN, ROLL_MAX
+
+# --- CONFIGURATION ---
+ALERT_INTERVAL_MS = 1000        # The firmware sends at most one alert per second
+SAMPLE_PERIOD_MS = 200          # Nominal firmware sample period (5 Hz)
+MAX_SAMPLE_GAP_MS = 2000        # Longer gaps (disconnects) do not count as monitored time
+MS_PER_HOUR = 3600 * 1000
+CSV_COLUMNS = ['timestamp', 'pitch', 'roll', 'yaw']
+SESSION_NAME_PATTERN = re.compile(r'(\d{8}_\d{6})')
+# Append-only segments uploaded by auto_upload_csv.py: <session>.part0000.csv, <session>.part0001.csv, ...
+# and the parts local ingest builds from them: <session>.local0000.csv, ...
+SEGMENT_NAME_PATTERN = re.compile(r'^(?P<session>.+)\.(?P<kind>part|local)(?P<index>\d{4,})$')
+SUMMARY_WINDOW_DAYS = 14                # History the LLM summary looks at (this week and last week)
+MIN_RANKED_HOUR_SECONDS = 10 * 60       # Hours of day with less data are not ranked best/worst
+CONTINUOUS_WORK_HOUR_SECONDS = 30 * 60  # An hour monitored this long counts as an hour of work
+SEGMENT_ORIGIN_CACHE_SIZE = 4096        # First segments whose origin is remembered
+
+logger = logging.getLogger(__name__)
+
+
+def session_start_from_filename(path):
+    """Returns the wall-clock start of a session encoded in its file name, or None."""
+    match = SESSION_NAME_PATTERN.search(os.path.basename(path))
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+
+
+def segment_of(path):
+    """Returns (session stem, part index) for a session segment file, or (None, None)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    match = SEGMENT_NAME_PATTERN.match(stem)
+    if not match:
+        return None, None
+    return match.group('session'), int(match.group('index'))
+
+
+_segment_origins = {}  # (path, mtime_ns) of a first segment -> its first timestamp
+
+
+def first_segment_path(path, catalog=None):
+    """Path of part 0 of the session a later segment belongs to, or None if it is not stored (yet).
+
+    Looks in the segment's directory and, with a session_catalog.SessionCatalog,
+    in its partition and the flat data directory. Whole session files and
+    part 0 itself return None.
+    """
+    session, index = segment_of(path)
+    if not index:
+        return None
+    directory = os.path.dirname(path)
+    kind = SEGMENT_NAME_PATTERN.match(os.path.splitext(os.path.basename(path))[0]).group('kind')
+    first_segment = f"{session}.{kind}{0:04d}"
+    candidates = [os.path.join(directory, first_segment + extension)
+                  for extension in (session_store.SESSION_EXTENSION, '.csv')]
+    if catalog is not None:
+        # Part 0 may already be in its partition while this segment lies flat, or the other way round
+        candidates.append(catalog.find(first_segment))
+        candidates.extend(os.path.join(catalog.data_dir, first_segment + extension)
+                          for extension in (session_store.SESSION_EXTENSION, '.csv'))
+    for candidate in candidates:
+        if candidate and os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def is_provisional_segment(path, catalog=None):
+    """True if path is a later segment whose part 0 is not stored yet, so its origin is only a guess."""
+    _, index = segment_of(path)
+    return bool(index) and first_segment_path(path, catalog) is None
+
+
+def session_origin_timestamp(path, timestamps, catalog=None):
+    """The device timestamp (ms) at which the session in path started.
+
+    For a whole session file that is its first sample. A later segment only
+    holds part of the session, so the origin comes from the first sample of
+    part 0 (see first_segment_path); if that is missing the segment's own
+    first sample is used (see is_provisional_segment). Origins are
+    remembered per path and mtime of part 0, so a replaced part 0 is read
+    again.
+    """
+    first_segment = first_segment_path(path, catalog)
+    if first_segment is not None:
+        try:
+            key = (first_segment, os.stat(first_segment).st_mtime_ns)
+        except OSError:
+            key = None
+        if key in _segment_origins:
+            return _segment_origins[key]
+        first_timestamps = load_samples(first_segment)['timestamp'] if key else []
+        if len(first_timestamps):
+            while len(_segment_origins) >= SEGMENT_ORIGIN_CACHE_SIZE:
+                del _segment_origins[next(iter(_segment_origins))]     # Oldest entry first
+            _segment_origins[key] = int(first_timestamps[0])
+            return _segment_origins[key]
+    if segment_of(path)[1]:
+        logger.debug(f"First segment of {os.path.basename(path)} not found; using its own first sample.")
+    return int(timestamps[0])
+
+
+def load_orientation_csv(path):
+    """Loads a `timestamp,pitch,roll,yaw` CSV written by ble_receiver.py into NumPy arrays.
+
+    The header row is optional (the firmware only sends it as the initial
+    characteristic value); truncated lines and rows with a garbled value
+    (the receiver writes text rows unvalidated) are dropped. An unterminated
+    last line is ignored: it may be an append still in progress.
+    """
+    with open(path, 'rb') as f:
+        first_line = f.readline()
+        source = path
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.seek(0)
+                data = f.read()
+                source = io.BytesIO(data[:data.rfind(b'\n') + 1])
+    if not first_line.strip() or (source is not path and not source.getbuffer().nbytes):
+        return _empty_samples()
+    skiprows = 0 if first_line.lstrip()[:1].isdigit() else 1
+
+    options = dict(header=None, names=CSV_COLUMNS, skiprows=skiprows, engine='c', on_bad_lines='skip')
+    try:
+        df = pd.read_csv(source, dtype='float64', **options)
+    except ValueError:
+        # A garbled value: read as text (several times slower) and drop the rows that do not parse
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        df = pd.read_csv(source, dtype=str, **options).apply(pd.to_numeric, errors='coerce')
+    df = df.dropna()
+    return {
+        'timestamp': df['timestamp'].to_numpy(dtype=np.int64),
+        'pitch': df['pitch'].to_numpy(dtype=np.float32),
+        'roll': df['roll'].to_numpy(dtype=np.float32),
+        'yaw': df['yaw'].to_numpy(dtype=np.float32),
+    }
+
+
+def load_samples(path):
+    """Loads a session from either its binary (memory-mapped) or CSV representation."""
+    if path.endswith(session_store.SESSION_EXTENSION):
+        return session_store.load_session_samples(path)
+    return load_orientation_csv(path)
+
+
+def _empty_samples():
+    return {
+        'timestamp': np.empty(0, dtype=np.int64),
+        'pitch': np.empty(0, dtype=np.float32),
+        'roll': np.empty(0, dtype=np.float32),
+        'yaw': np.empty(0, dtype=np.float32),
+    }
+
+
+def classify_samples(pitch, roll):
+    """Vectorized posture classification. Returns (side_tilt, forward_lean) boolean masks."""
+    side_tilt = np.abs(pitch) > PITCH_LIMIT
+    abs_roll = np.abs(roll)
+    forward_lean = (abs_roll > ROLL_MAX) | (abs_roll < ROLL_MIN)
+    return side_tilt, forward_lean
+
+
+def sample_durations_ms(timestamps, gaps=None):
+    """Time each sample stands for: the gap to the next sample, capped to drop disconnects."""
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=np.float32)
+    if gaps is None:
+        gaps = np.diff(timestamps)
+    durations = np.empty(len(timestamps), dtype=np.float32)
+    durations[:-1] = gaps
+    durations[-1] = SAMPLE_PERIOD_MS
+    durations[(durations < 0) | (durations > MAX_SAMPLE_GAP_MS)] = 0
+    return durations
+
+
+def session_clock(path, timestamps, catalog=None):
+    """Returns (start datetime, origin timestamp): the sample at origin_ts was taken at start.
+
+    timestamps must be sorted and non-empty; catalog helps find the first
+    part of a segmented session (see session_origin_timestamp).
+    """
+    start = session_start_from_filename(path)
+    if start is not None:
+        return start, session_origin_timestamp(path, timestamps, catalog)
+    # Fall back to the file's mtime as the end of the session
+    end = datetime.fromtimestamp(os.path.getmtime(path))
+    return end - timedelta(milliseconds=int(timestamps[-1] - timestamps[0])), int(timestamps[0])
+
+
+def sample_times(path, timestamps, catalog=None):
+    """Wall-clock time (datetime64[ms]) of each sample of a session. timestamps must be sorted."""
+    if len(timestamps) == 0:
+        return np.empty(0, dtype='datetime64[ms]')
+    start, origin_ts = session_clock(path, timestamps, catalog)
+    return np.datetime64(start, 'ms') + (timestamps - origin_ts).astype('timedelta64[ms]')
+
+
+def sorted_samples(samples):
+    """Returns samples ordered by device timestamp (unchanged if they already are)."""
+    timestamps = samples['timestamp']
+    if len(timestamps) < 2 or not np.any(np.diff(timestamps) < 0):
+        return samples
+    order = np.argsort(timestamps, kind='stable')
+    return {name: values[order] for name, values in samples.items()}
+
+
+def aggregate_session(path, samples=None, catalog=None):
+    """Computes hourly partial aggregates for one session file.
+
+    Returns a DataFrame indexed by hour with the monitored, good, forward-lean,
+    side-tilt and combined-tilt seconds plus the number of alerts the firmware
+    would have raised. Hourly partials are additive, so they can be cached per
+    file and merged into daily totals later.
+    """
+    if samples is None:
+        samples = load_samples(path)
+    timestamps = samples['timestamp']
+    if len(timestamps) == 0:
+        return empty_aggregates()
+
+    pitch = samples['pitch']
+    roll = samples['roll']
+    gaps = np.diff(timestamps)
+    if np.any(gaps < 0):
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, pitch, roll = timestamps[order], pitch[order], roll[order]
+        gaps = np.diff(timestamps)
+
+    start, origin_ts = session_clock(path, timestamps, catalog)
+
+    # Samples are time-ordered, so each hour is a contiguous slice found by binary search
+    first_hour = start.replace(minute=0, second=0, microsecond=0)
+    first_hour_ts = origin_ts - int((start - first_hour).total_seconds() * 1000)
+    first_hour_index = max(0, (int(timestamps[0]) - first_hour_ts) // MS_PER_HOUR)
+    first_hour_ts += first_hour_index * MS_PER_HOUR
+    first_hour += timedelta(hours=int(first_hour_index))
+    n_hours = (int(timestamps[-1]) - first_hour_ts) // MS_PER_HOUR + 1
+    boundaries = first_hour_ts + MS_PER_HOUR * np.arange(n_hours, dtype=np.int64)
+    hour_starts = np.searchsorted(timestamps, boundaries)
+    hours = np.datetime64(first_hour, 'h') + np.arange(n_hours)
+
+    side_tilt, forward_lean = classify_samples(pitch, roll)
+    poor = side_tilt | forward_lean
+    durations = sample_durations_ms(timestamps, gaps) * np.float32(0.001)
+
+    monitored = _sum_per_bucket(durations, hour_starts)
+    side_seconds = _sum_per_bucket(durations * side_tilt, hour_starts)
+    forward_seconds = _sum_per_bucket(durations * forward_lean, hour_starts)
+    both_seconds = _sum_per_bucket(durations * (side_tilt & forward_lean), hour_starts)
+
+    # One alert per one-second window containing at least one poor sample
+    poor_ts = timestamps.take(np.flatnonzero(poor))
+    poor_windows = poor_ts // ALERT_INTERVAL_MS
+    new_window = np.ones(len(poor_windows), dtype=np.int32)
+    new_window[1:] = poor_windows[1:] != poor_windows[:-1]
+    alerts = _sum_per_bucket(new_window, np.searchsorted(poor_ts, boundaries))
+
+    aggregates = pd.DataFrame({
+        'samples': np.diff(np.append(hour_starts, len(timestamps))),
+        'monitored_seconds': monitored.astype(np.float64),
+        'good_seconds': (monitored - side_seconds - forward_seconds + both_seconds).astype(np.float64),
+        'forward_lean_seconds': (forward_seconds - both_seconds).astype(np.float64),
+        'side_tilt_seconds': (side_seconds - both_seconds).astype(np.float64),
+        'both_tilt_seconds': both_seconds.astype(np.float64),
+        'alerts': alerts.astype(np.int64),
+    }, index=pd.DatetimeIndex(hours, name='hour'))
+    return aggregates[aggregates['samples'] > 0]
+
+
+def session_episodes(path, samples=None, catalog=None):
+    """Debounced poor-posture episodes of one session file, with wall-clock start/end times.
+
+    Episodes come from posture_signal.detect_episodes, so a noisy angle
+    hovering at a threshold yields one episode instead of a burst of alerts.
+    """
+    if samples is None:
+        samples = load_samples(path)
+    samples = sorted_samples(samples)
+    timestamps = samples['timestamp']
+    if len(timestamps) == 0:
+        return []
+    start, origin_ts = session_clock(path, timestamps, catalog)
+    episodes = posture_signal.detect_episodes(timestamps, samples['pitch'], samples['roll'])
+    for episode in episodes:
+        episode['start'] = (start + timedelta(milliseconds=episode['start_ts'] - origin_ts)).isoformat(timespec='milliseconds')
+        episode['end'] = (start + timedelta(milliseconds=episode['end_ts'] - origin_ts)).isoformat(timespec='milliseconds')
+        episode['duration_seconds'] = round((episode['end_ts'] - episode['start_ts']) / 1000, 1)
+    return episodes
+
+
+def summarize_episodes(episodes):
+    """Number of episodes and total and longest duration per episode type."""
+    summary = {}
+    for episode in episodes:
+        entry = summary.setdefault(episode['type'], {'count': 0, 'total_seconds': 0.0, 'longest_seconds': 0.0})
+        entry['count'] += 1
+        entry['total_seconds'] = round(entry['total_seconds'] + episode['duration_seconds'], 1)
+        entry['longest_seconds'] = max(entry['longest_seconds'], episode['duration_seconds'])
+    return summary
+
+
+def _sum_per_bucket(values, bucket_starts):
+    """Sums contiguous time-bucket slices of values, in float64.
+
+    reduceat adds each slice sequentially, so a float32 accumulator would
+    drift over an hour of 50 Hz samples.
+    """
+    if len(values) == 0:
+        return np.zeros(len(bucket_starts), dtype=np.float64)
+    # The trailing zero lets buckets start at len(values) without cutting the previous one short
+    sums = np.add.reduceat(np.append(values, 0), bucket_starts, dtype=np.float64)
+    ends = np.append(bucket_starts[1:], len(values))
+    sums[ends <= bucket_starts] = 0
+    return sums
+
+
+def empty_aggregates():
+    return pd.DataFrame({
+        'samples': pd.Series(dtype='int64'),
+        'monitored_seconds': pd.Series(dtype='float64'),
+        'good_seconds': pd.Series(dtype='float64'),
+        'forward_lean_seconds': pd.Series(dtype='float64'),
+        'side_tilt_seconds': pd.Series(dtype='float64'),
+        'both_tilt_seconds': pd.Series(dtype='float64'),
+        'alerts': pd.Series(dtype='int64'),
+    }, index=pd.DatetimeIndex([], name='hour'))
+
+
+def list_session_files(data_dir):
+    """Lists session files in data_dir, preferring the binary copy when a CSV was converted."""
+    binary = glob.glob(os.path.join(data_dir, '*' + session_store.SESSION_EXTENSION))
+    converted = {os.path.splitext(p)[0] for p in binary}
+    csvs = [p for p in glob.glob(os.path.join(data_dir, '*.csv')) if os.path.splitext(p)[0] not in converted]
+    return sorted(binary + csvs)
+
+
+def merge_aggregates(frames):
+    """Merges partial aggregates from several sessions into one hourly DataFrame."""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return empty_aggregates()
+    return pd.concat(frames).groupby(level='hour').sum()
+
+
+def to_daily(hourly):
+    """Rolls hourly partial aggregates up into per-day totals."""
+    daily = hourly.groupby(hourly.index.floor('D')).sum()
+    daily.index.name = 'day'
+    return daily
+
+
+def aggregate_directory(data_dir):
+    """Aggregates every session file in data_dir into a single hourly DataFrame."""
+    frames = []
+    for path in list_session_files(data_dir):
+        try:
+            frames.append(aggregate_session(path))
+        except Exception as e:
+            logger.error(f"Failed to analyze '{path}': {e}")
+    return merge_aggregates(frames)
+
+
+def _percentage(part, total):
+    return round(float(100.0 * part / total), 1) if total > 0 else 0
+
+
+def build_posture_stats(daily, days, today=None):
+    """Shapes per-day aggregates into the /api/posture-stats response for the last `days` days."""
+    today = (today or datetime.now()).date()
+    first_day = today - timedelta(days=days - 1)
+    window = pd.date_range(first_day, today, freq='D', name='day')
+    daily = daily.reindex(window, fill_value=0)
+
+    daily_data = []
+    for day, row in daily.iterrows():
+        monitored = row['monitored_seconds']
+        good_pct = _percentage(row['good_seconds'], monitored)
+        daily_data.append({
+            'date': day.strftime('%m/%d'),
+            'good_posture_percentage': good_pct,
+            'poor_posture_percentage': round(100 - good_pct, 1) if monitored > 0 else 0,
+            'alert_count': int(row['alerts']),
+            'hours_monitored': round(float(monitored) / 3600.0, 1)
+        })
+
+    totals = daily.sum()
+    total_monitored = totals['monitored_seconds']
+    summary = {
+        'total_hours': round(float(total_monitored) / 3600.0, 1),
+        'good_posture_percentage': _percentage(totals['good_seconds'], total_monitored),
+        'forward_lean_percentage': _percentage(totals['forward_lean_seconds'], total_monitored),
+        'side_tilt_percentage': _percentage(totals['side_tilt_seconds'], total_monitored),
+        'total_alerts': int(totals['alerts'])
+    }
+
+    return {
+        'daily_data': daily_data,
+        'summary': summary
+    }
+
+
+def compute_posture_stats(data_dir, days):
+    """Computes posture statistics for the last `days` days from the session files in data_dir."""
+    return build_posture_stats(to_daily(aggregate_directory(data_dir)), days)
+
+
+def _poor_share(frame):
+    monitored = frame['monitored_seconds']
+    return 1.0 - frame['good_seconds'] / monitored.where(monitored > 0)
+
+
+def _summary_totals(totals):
+    monitored = totals['monitored_seconds']
+    poor = monitored - totals['good_seconds']
+    return [
+        f"- Monitoring time: {monitored / 3600.0:.1f} hours",
+        f"- Good posture maintained: {_percentage(totals['good_seconds'], monitored)}% of time",
+        f"- Poor posture detected: {_percentage(poor, monitored)}% of time ({poor / 60.0:.0f} minutes)",
+        f"- Alerts (estimated from samples): {int(totals['alerts'])}",
+    ]
+
+
+def _hour_label(hour):
+    return f"{hour:02d}:00-{(hour + 1) % 24:02d}:00"
+
+
+def continuous_work_profile(hourly):
+    """Poor-posture share by hour of continuous work (1st, 2nd, 3rd and later hour).
+
+    Consecutive clock hours monitored for at least CONTINUOUS_WORK_HOUR_SECONDS
+    form one stretch of work. Returns a Series indexed 1..3 (3 = third hour or
+    later); positions without data are omitted.
+    """
+    worked = hourly[hourly['monitored_seconds'] >= CONTINUOUS_WORK_HOUR_SECONDS]
+    if worked.empty:
+        return pd.Series(dtype='float64')
+    hours = worked.index.to_numpy(dtype='datetime64[h]').astype(np.int64)
+    new_stretch = np.ones(len(hours), dtype=bool)
+    new_stretch[1:] = np.diff(hours) != 1
+    stretch_start = np.maximum.accumulate(np.where(new_stretch, np.arange(len(hours)), 0))
+    position = np.minimum(np.arange(len(hours)) - stretch_start + 1, 3)
+    by_position = worked[['monitored_seconds', 'good_seconds']].groupby(position).sum()
+    return _poor_share(by_position).dropna()
+
+
+def build_llm_summary(hourly, now=None, alert_counts=None):
+    """Turns hourly aggregates into the plain-text posture summary given to the LLM.
+
+    Covers today, best and worst hours of the day, deterioration during
+    continuous work, the dominant tilt type and the week-over-week trend.
+    alert_counts optionally holds this week's received alerts per tilt type.
+    """
+    now = now or datetime.now()
+    today = pd.Timestamp(now.date())
+    lines = [f"Posture Analysis Summary ({now:%B %d, %Y}):", ""]
+    if hourly.empty:
+        lines.append("- No posture data has been recorded yet.")
+        return "\n".join(lines)
+
+    window = hourly[hourly.index >= today - pd.Timedelta(days=SUMMARY_WINDOW_DAYS - 1)]
+    this_week = window[window.index >= today - pd.Timedelta(days=6)]
+    last_week = window[window.index < today - pd.Timedelta(days=6)]
+
+    lines.append("Today:")
+    todays = window[window.index >= today]
+    if todays['monitored_seconds'].sum() > 0:
+        lines += _summary_totals(todays.sum())
+    else:
+        lines.append("- No monitoring recorded today yet.")
+
+    lines += ["", "Last 7 Days:"]
+    week_totals = this_week.sum()
+    if week_totals['monitored_seconds'] > 0:
+        lines += _summary_totals(week_totals)
+        poor_kinds = {
+            'Forward/backward lean': week_totals['forward_lean_seconds'],
+            'Side tilt': week_totals['side_tilt_seconds'],
+            'Both side tilt and forward lean': week_totals['both_tilt_seconds'],
+        }
+        poor_total = sum(poor_kinds.values())
+        if poor_total > 0:
+            dominant = max(poor_kinds, key=poor_kinds.get)
+            lines.append(f"- Dominant issue: {dominant} ({_percentage(poor_kinds[dominant], poor_total)}% of poor posture time)")
+            for kind, seconds in poor_kinds.items():
+                if kind != dominant and seconds > 0:
+                    lines.append(f"- {kind}: {_percentage(seconds, poor_total)}% of poor posture time")
+    else:
+        lines.append("- No monitoring recorded in the last 7 days.")
+    if alert_counts and alert_counts.get('total'):
+        received = ", ".join(f"{kind.replace('_', ' ')}: {n}" for kind, n in sorted(alert_counts.items()) if kind != 'total')
+        lines.append(f"- Alerts received from the device: {alert_counts['total']} ({received})")
+
+    lines += ["", "Patterns Observed:"]
+    by_hour = window.groupby(window.index.hour).sum()
+    by_hour = by_hour[by_hour['monitored_seconds'] >= MIN_RANKED_HOUR_SECONDS]
+    if len(by_hour) >= 2:
+        poor_by_hour = _poor_share(by_hour)
+        worst, best = int(poor_by_hour.idxmax()), int(poor_by_hour.idxmin())
+        lines.append(f"- Worst posture period: {_hour_label(worst)} (poor posture {poor_by_hour[worst] * 100:.0f}% of the time)")
+        lines.append(f"- Best posture period: {_hour_label(best)} (poor posture {poor_by_hour[best] * 100:.0f}% of the time)")
+    else:
+        lines.append("- Not enough data yet to compare hours of the day.")
+
+    profile = continuous_work_profile(window)
+    if 1 in profile.index and len(profile) > 1:
+        names = {1: "1st hour", 2: "2nd hour", 3: "3rd hour and later"}
+        lines.append("- Poor posture by hour of continuous work: "
+                     + ", ".join(f"{names[p]} {profile[p] * 100:.0f}%" for p in profile.index))
+        last = profile.index[-1]
+        change = (profile[last] - profile[1]) * 100
+        if change >= 5:
+            lines.append(f"- Posture deteriorates with continuous work (+{change:.0f} points by the {names[last]})")
+        elif change <= -5:
+            lines.append(f"- Posture does not deteriorate with continuous work ({change:.0f} points by the {names[last]})")
+        else:
+            lines.append("- Posture stays roughly stable during continuous work")
+
+    lines += ["", "Weekly Trends:"]
+    last_totals = last_week.sum()
+    if week_totals['monitored_seconds'] > 0 and last_totals['monitored_seconds'] > 0:
+        good_now = _percentage(week_totals['good_seconds'], week_totals['monitored_seconds'])
+        good_before = _percentage(last_totals['good_seconds'], last_totals['monitored_seconds'])
+        lines.append(f"- Good posture time: {good_now}% this week vs {good_before}% last week "
+                     f"({good_now - good_before:+.1f} points)")
+        alerts_per_hour_now = week_totals['alerts'] / (week_totals['monitored_seconds'] / 3600.0)
+        alerts_per_hour_before = last_totals['alerts'] / (last_totals['monitored_seconds'] / 3600.0)
+        lines.append(f"- Alerts per monitored hour: {alerts_per_hour_now:.1f} this week vs {alerts_per_hour_before:.1f} last week")
+        lines.append(f"- Monitoring time: {week_totals['monitored_seconds'] / 3600.0:.1f} hours this week "
+                     f"vs {last_totals['monitored_seconds'] / 3600.0:.1f} hours last week")
+    else:
+        lines.append("- Not enough data yet for a week-over-week comparison.")
+    return "\n".join(lines)
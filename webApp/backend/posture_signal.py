@@ -0,0 +1,285 @@
+# posture_signal.py
+import math
+import numpy as np
+
+# --- CONFIGURATION ---
+# Thresholds mirror the "vertical NICLA" alert rule in hardware/src/main.cpp:
+#   abs(pitch) > ALERT_THRESHOLD+1  -> side tilt
+#   abs(roll) > 100 || abs(roll) < 80 -> forward/backward tilt
+ALERT_THRESHOLD = 5.0
+PITCH_LIMIT = ALERT_THRESHOLD + 1
+ROLL_MIN = 80.0
+ROLL_MAX = 100.0
+UPRIGHT_ROLL = 90.0             # Roll of an upright wearer; the firmware reports 90-roll as forward tilt
+
+SMOOTHING_TIME_CONSTANT_MS = 600    # EMA time constant applied to pitch and roll
+HYSTERESIS_DEGREES = 1.0            # A tilt ends only once the angle is this far back inside the limit
+ENTER_DEBOUNCE_MS = 1000            # Poor posture must last this long to open an episode
+EXIT_DEBOUNCE_MS = 1000             # ...and good posture this long to close it
+RESET_GAP_MS = 2000                 # Longer gaps (disconnects) restart the filter and close open episodes
+EMA_BLOCK_TIME_CONSTANTS = 200      # Block length of the vectorized EMA (exp(200) is far below float64 overflow)
+
+
+class EmaFilter:
+    """Exponential moving average with a time constant, so irregular sample spacing is handled."""
+
+    def __init__(self, time_constant_ms=SMOOTHING_TIME_CONSTANT_MS):
+        self.time_constant_ms = time_constant_ms
+        self.value = None
+        self.last_ts = None
+
+    def reset(self):
+        self.value = None
+        self.last_ts = None
+
+    def update(self, timestamp, value):
+        if self.value is None or self.time_constant_ms <= 0:
+            self.value = value
+        else:
+            alpha = 1.0 - math.exp(-max(timestamp - self.last_ts, 0) / self.time_constant_ms)
+            self.value += alpha * (value - self.value)
+        self.last_ts = timestamp
+        return self.value
+
+
+class PostureSignal:
+    """Streaming posture state machine: smoothing, hysteresis and debouncing, O(1) per sample.
+
+    update(timestamp, pitch, roll) takes one sample (device milliseconds,
+    degrees) and returns the episode that ended with it, if any. Episodes
+    are dicts with start_ts, end_ts, type ('side_tilt', 'forward_lean' or
+    'both'), peak_side (max |pitch|), peak_forward (max |90-roll|),
+    peak_angle and samples.
+    """
+
+    def __init__(self, time_constant_ms=SMOOTHING_TIME_CONSTANT_MS, hysteresis=HYSTERESIS_DEGREES,
+                 enter_ms=ENTER_DEBOUNCE_MS, exit_ms=EXIT_DEBOUNCE_MS, reset_gap_ms=RESET_GAP_MS):
+        self.pitch_filter = EmaFilter(time_constant_ms)
+        self.roll_filter = EmaFilter(time_constant_ms)
+        self.hysteresis = hysteresis
+        self.enter_ms = enter_ms
+        self.exit_ms = exit_ms
+        self.reset_gap_ms = reset_gap_ms
+        self._reset_state()
+
+    def _reset_state(self):
+        self.last_ts = None
+        self.side = False           # Hysteresis-band state of each tilt kind
+        self.forward = False
+        self.candidate_since = None # When the current, not yet debounced, state change started
+        self.episode = None         # Open episode, or None while posture is good
+
+    @property
+    def in_episode(self):
+        return self.episode is not None
+
+    def update(self, timestamp, pitch, roll):
+        finished = None
+        if self.last_ts is not None and timestamp - self.last_ts > self.reset_gap_ms:
+            finished = self.flush()
+        self.last_ts = timestamp
+
+        pitch = self.pitch_filter.update(timestamp, pitch)
+        roll = self.roll_filter.update(timestamp, roll)
+
+        # Hysteresis: enter at the firmware limit, leave only once clearly back inside it
+        abs_pitch = abs(pitch)
+        abs_roll = abs(roll)
+        if self.side:
+            self.side = abs_pitch > PITCH_LIMIT - self.hysteresis
+        else:
+            self.side = abs_pitch > PITCH_LIMIT
+        if self.forward:
+            self.forward = abs_roll > ROLL_MAX - self.hysteresis or abs_roll < ROLL_MIN + self.hysteresis
+        else:
+            self.forward = abs_roll > ROLL_MAX or abs_roll < ROLL_MIN
+        poor = self.side or self.forward
+
+        # Debounce: a change of state only counts once it has lasted long enough
+        if poor == self.in_episode:
+            self.candidate_since = None
+        elif self.candidate_since is None:
+            self.candidate_since = timestamp
+        if not self.in_episode and self.candidate_since is not None and timestamp - self.candidate_since >= self.enter_ms:
+            self.episode = {
+                'start_ts': self.candidate_since, 'end_ts': timestamp, 'side': False, 'forward': False,
+                'both': False, 'peak_side': 0.0, 'peak_forward': 0.0, 'samples': 0,
+            }
+            self.candidate_since = None
+        elif self.in_episode and self.candidate_since is not None and timestamp - self.candidate_since >= self.exit_ms:
+            self.episode['end_ts'] = self.candidate_since
+            finished = self._close()
+
+        if self.episode is not None and poor:
+            episode = self.episode
+            episode['end_ts'] = timestamp
+            episode['samples'] += 1
+            episode['side'] |= self.side
+            episode['forward'] |= self.forward
+            episode['both'] |= self.side and self.forward
+            episode['peak_side'] = max(episode['peak_side'], abs_pitch)
+            episode['peak_forward'] = max(episode['peak_forward'], abs(UPRIGHT_ROLL - abs_roll))
+        return finished
+
+    def flush(self):
+        """Closes the open episode (e.g. at the end of a session) and restarts the filters."""
+        finished = self._close() if self.episode is not None else None
+        self.pitch_filter.reset()
+        self.roll_filter.reset()
+        self._reset_state()
+        return finished
+
+    def _close(self):
+        episode, self.episode = self.episode, None
+        self.candidate_since = None
+        if episode['both'] or (episode['side'] and episode['forward']):
+            kind = 'both'
+        elif episode['side']:
+            kind = 'side_tilt'
+        else:
+            kind = 'forward_lean'
+        return {
+            'start_ts': int(episode['start_ts']),
+            'end_ts': int(episode['end_ts']),
+            'type': kind,
+            'peak_side': round(episode['peak_side'], 1),
+            'peak_forward': round(episode['peak_forward'], 1),
+            'peak_angle': round(max(episode['peak_side'], episode['peak_forward']), 1),
+            'samples': episode['samples'],
+        }
+
+
+def ema(timestamps, values, segment_starts, time_constant_ms=SMOOTHING_TIME_CONSTANT_MS):
+    """Vectorized EmaFilter over a whole session; the filter restarts at each index in segment_starts.
+
+    values is one series or a (k, n) stack of series sharing the timestamps,
+    which shares the decay factors between them. y[i] = y[i-1] + a[i] *
+    (x[i] - y[i-1]) unrolls into a cumulative sum of x[k] * a[k] *
+    exp(t[k] / tau) scaled back by exp(-t[i] / tau). The sum is taken over
+    blocks spanning at most EMA_BLOCK_TIME_CONSTANTS time constants, so the
+    exponentials stay far from float64 overflow.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if time_constant_ms <= 0 or values.shape[-1] == 0:
+        return values.copy()
+    t = np.asarray(timestamps, dtype=np.float64)
+    alpha = -np.expm1(-np.diff(t, prepend=t[0]).clip(min=0) / time_constant_ms)
+    alpha[segment_starts] = 1.0
+    weighted = alpha * values
+    smoothed = np.empty_like(values)
+    block_span = EMA_BLOCK_TIME_CONSTANTS * time_constant_ms
+    for start, end in zip(segment_starts, np.append(segment_starts[1:], len(t))):
+        carry = 0.0
+        while start < end:
+            stop = min(max(int(np.searchsorted(t, t[start] + block_span, 'left')), start + 1), end)
+            growth = np.exp((t[start:stop] - t[start]) / time_constant_ms)
+            block = np.cumsum(weighted[..., start:stop] * growth, axis=-1)
+            block += np.multiply(carry, 1.0 - alpha[start])[..., None]
+            block /= growth
+            smoothed[..., start:stop] = block
+            carry = smoothed[..., stop - 1]
+            start = stop
+    return smoothed
+
+
+def _hysteresis(enter, stay, segment_starts):
+    """Vectorized hysteresis band: a state turns on where enter holds and stays on while stay holds."""
+    decisive = enter | ~stay
+    decisive[segment_starts] = True     # Each segment starts from the off state
+    last_decisive = np.maximum.accumulate(np.where(decisive, np.arange(len(enter)), 0))
+    return enter[last_decisive]
+
+
+def detect_episodes(timestamps, pitch, roll, time_constant_ms=SMOOTHING_TIME_CONSTANT_MS,
+                    hysteresis=HYSTERESIS_DEGREES, enter_ms=ENTER_DEBOUNCE_MS, exit_ms=EXIT_DEBOUNCE_MS,
+                    reset_gap_ms=RESET_GAP_MS):
+    """Episodes of a whole (time-ordered) session, the same ones PostureSignal would emit sample by sample.
+
+    Vectorized over the samples: smoothing and hysteresis are array
+    operations, and debouncing works on the runs of the poor-posture mask,
+    so only the (few) episodes are handled in Python.
+    """
+    t = np.asarray(timestamps, dtype=np.int64)
+    n = len(t)
+    if n == 0:
+        return []
+    segment_starts = np.r_[0, np.flatnonzero(np.diff(t) > reset_gap_ms) + 1]
+    segment_ends = np.append(segment_starts[1:], n)
+
+    def segment_of(indices):
+        return np.searchsorted(segment_starts, indices, 'right') - 1
+
+    abs_pitch, abs_roll = np.abs(ema(t, np.stack([pitch, roll]), segment_starts, time_constant_ms))
+    side = _hysteresis(abs_pitch > PITCH_LIMIT, abs_pitch > PITCH_LIMIT - hysteresis, segment_starts)
+    forward = _hysteresis((abs_roll > ROLL_MAX) | (abs_roll < ROLL_MIN),
+                          (abs_roll > ROLL_MAX - hysteresis) | (abs_roll < ROLL_MIN + hysteresis), segment_starts)
+    poor = side | forward
+
+    # Runs of equal posture within a segment; a run long enough is a debounced change of state
+    boundaries = np.empty(n, dtype=bool)
+    boundaries[0] = True
+    np.not_equal(poor[1:], poor[:-1], out=boundaries[1:])
+    boundaries[segment_starts] = True
+    run_starts = np.flatnonzero(boundaries)
+    run_ends = np.append(run_starts[1:], n)
+    run_poor = poor[run_starts]
+    reach = t[run_ends - 1] - t[run_starts]
+    qualifying = np.flatnonzero(np.where(run_poor, reach >= enter_ms, reach >= exit_ms))
+    # Only the first qualifying run after each change of state counts: poor (opens), good (closes), ...
+    kinds = run_poor[qualifying]
+    segments = segment_of(run_starts[qualifying])
+    previous = np.r_[False, kinds[:-1]]
+    previous[np.r_[True, segments[1:] != segments[:-1]]] = False
+    changes = qualifying[kinds != previous]
+
+    bounds = []
+    for k, run in enumerate(changes):
+        if not run_poor[run]:
+            continue
+        start_ts = t[run_starts[run]]
+        open_index = max(int(np.searchsorted(t, start_ts + enter_ms, 'left')), run_starts[run])
+        closing = changes[k + 1] if k + 1 < len(changes) else None
+        if closing is not None and segment_of(run_starts[closing]) == segment_of(run_starts[run]):
+            end_ts = t[run_starts[closing]]
+            stop = max(int(np.searchsorted(t, end_ts + exit_ms, 'left')), run_starts[closing])
+        else:
+            # Still open at the end of the segment: flushed, ending at its last poor sample
+            stop = segment_ends[segment_of(run_starts[run])]
+            # The run itself is poor, so the search never leaves the episode
+            last_poor = stop - 1 - int(np.argmax(poor[run_starts[run]:stop][::-1]))
+            end_ts = t[last_poor]
+        bounds.append((open_index, stop, int(start_ts), int(end_ts)))
+    if not bounds:
+        return []
+
+    # Per-episode reductions over the poor samples from the opening sample up to the closing one
+    ranges = np.array([(b[0], b[1]) for b in bounds]).ravel()
+    if ranges[-1] == n:
+        ranges = ranges[:-1]    # reduceat runs the last slice to the end of the array
+    def per_episode(ufunc, values, dtype=None):
+        return ufunc.reduceat(values, ranges, dtype=dtype)[::2]
+    samples = per_episode(np.add, poor, np.int64)
+    any_side = per_episode(np.logical_or, poor & side)
+    any_forward = per_episode(np.logical_or, poor & forward)
+    any_both = per_episode(np.logical_or, poor & side & forward)
+    peak_side = per_episode(np.maximum, np.where(poor, abs_pitch, 0.0))
+    peak_forward = per_episode(np.maximum, np.where(poor, np.abs(UPRIGHT_ROLL - abs_roll), 0.0))
+
+    episodes = []
+    for i, (_, _, start_ts, end_ts) in enumerate(bounds):
+        if any_both[i] or (any_side[i] and any_forward[i]):
+            kind = 'both'
+        elif any_side[i]:
+            kind = 'side_tilt'
+        else:
+            kind = 'forward_lean'
+        episodes.append({
+            'start_ts': start_ts,
+            'end_ts': end_ts,
+            'type': kind,
+            'peak_side': round(float(peak_side[i]), 1),
+            'peak_forward': round(float(peak_forward[i]), 1),
+            'peak_angle': round(float(max(peak_side[i], peak_forward[i])), 1),
+            'samples': int(samples[i]),
+        })
+    return episodes
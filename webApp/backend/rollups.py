@@ -0,0 +1,357 @@
+# rollups.py
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+import posture_analytics
+
+# --- CONFIGURATION ---
+ROLLUP_DIR_NAME = ".rollups"
+MERGED_FILE_NAME = "merged.npz"     # Hourly/daily rollups of all sessions, so a new process need not re-merge them
+MERGED_SAVE_SECONDS = 60            # The merged rollups are saved at most this often
+# Bucket sizes in minutes, finest first
+RESOLUTIONS = {
+    'minute': 1,
+    'hour': 60,
+    'day': 24 * 60,
+}
+RAW_MAX_SAMPLES = 500000        # Raw views load at most this many samples before downsampling
+
+# One row per session minute; sums (not means) so buckets merge exactly
+ROLLUP_DTYPE = np.dtype([
+    ('minute', '<i8'),          # Wall-clock minutes since 1970-01-01 (local time, like the session file names)
+    ('count', '<u4'),
+    ('poor', '<u4'),
+    ('pitch_min', '<f4'),
+    ('pitch_max', '<f4'),
+    ('pitch_sum', '<f8'),
+    ('roll_min', '<f4'),
+    ('roll_max', '<f4'),
+    ('roll_sum', '<f8'),
+])
+
+logger = logging.getLogger(__name__)
+
+
+def compute_minute_rollup(path, samples=None, catalog=None):
+    """Min/max/sum of pitch and roll plus the number of poor-posture samples per minute of one session."""
+    if samples is None:
+        samples = posture_analytics.load_samples(path)
+    samples = posture_analytics.sorted_samples(samples)
+    timestamps = samples['timestamp']
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+
+    minutes = posture_analytics.sample_times(path, timestamps, catalog).astype('datetime64[m]').astype(np.int64)
+    side_tilt, forward_lean = posture_analytics.classify_samples(samples['pitch'], samples['roll'])
+    rows = np.empty(len(minutes), dtype=ROLLUP_DTYPE)
+    rows['minute'] = minutes
+    rows['count'] = 1
+    rows['poor'] = side_tilt | forward_lean
+    rows['pitch_min'] = rows['pitch_max'] = rows['pitch_sum'] = samples['pitch']
+    rows['roll_min'] = rows['roll_max'] = rows['roll_sum'] = samples['roll']
+    return merge_rollup_rows(rows, 1)
+
+
+def merge_rollup_rows(rows, bucket_minutes):
+    """Merges rollup rows into buckets of bucket_minutes (rows need not be sorted)."""
+    if len(rows) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+    keys = rows['minute'] // bucket_minutes * bucket_minutes
+    if np.any(np.diff(keys) < 0):
+        order = np.argsort(keys, kind='stable')
+        rows, keys = rows[order], keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+    merged = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    merged['minute'] = keys[starts]
+    for name in ('count', 'poor', 'pitch_sum', 'roll_sum'):
+        merged[name] = np.add.reduceat(rows[name], starts)
+    for name in ('pitch_min', 'roll_min'):
+        merged[name] = np.minimum.reduceat(rows[name], starts)
+    for name in ('pitch_max', 'roll_max'):
+        merged[name] = np.maximum.reduceat(rows[name], starts)
+    return merged
+
+
+def rollup_series(rows, bucket_minutes):
+    """Column-oriented JSON-ready series (means and percent bad) for rollup rows."""
+    counts = rows['count'].astype(np.float64)
+    return {
+        't': [str(t) for t in (rows['minute'] * 60).astype('datetime64[s]')],
+        'bucket_seconds': bucket_minutes * 60,
+        'count': rows['count'].tolist(),
+        'pitch_min': np.round(rows['pitch_min'].astype(np.float64), 2).tolist(),
+        'pitch_mean': np.round(rows['pitch_sum'] / counts, 2).tolist(),
+        'pitch_max': np.round(rows['pitch_max'].astype(np.float64), 2).tolist(),
+        'roll_min': np.round(rows['roll_min'].astype(np.float64), 2).tolist(),
+        'roll_mean': np.round(rows['roll_sum'] / counts, 2).tolist(),
+        'roll_max': np.round(rows['roll_max'].astype(np.float64), 2).tolist(),
+        'bad_pct': np.round(100.0 * rows['poor'] / counts, 1).tolist(),
+    }
+
+
+def lttb_indices(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling. Returns the indices of the kept points."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean() if next_hi > next_lo else x[-1]
+        avg_y = y[next_lo:next_hi].mean() if next_hi > next_lo else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+class RollupStore:
+    """Minute/hour/day rollups of every session file in a data directory.
+
+    Each session's minute rollup is computed once and saved next to the
+    data as `.rollups/<session>.npy`, so every server process shares it.
+    Hourly and daily rollups are merged in memory per user (and for all
+    users); minute buckets and raw samples are read from the files of the
+    sessions a query overlaps, so a query for one user never opens another
+    user's sessions.
+
+    sync() folds the rows of new sessions into the merged rollups and
+    rebuilds only the hours and days of changed or removed ones. The
+    merged rollups are saved to `.rollups/merged.npz` with the sessions
+    they cover, so a new process starts from them instead of reloading
+    every minute rollup.
+    """
+
+    def __init__(self, data_dir, catalog=None):
+        self.data_dir = data_dir
+        self.catalog = catalog      # Optional session_catalog.SessionCatalog, to find the first part of a session
+        self.rollup_dir = os.path.join(data_dir, ROLLUP_DIR_NAME)
+        self.merged_file = os.path.join(self.rollup_dir, MERGED_FILE_NAME)
+        self.spans = {}             # session file name -> (first minute, last minute, path, user, stamp)
+        self.hourly = {None: np.empty(0, dtype=ROLLUP_DTYPE)}     # user (None: all users) -> hour rows
+        self.daily = {None: np.empty(0, dtype=ROLLUP_DTYPE)}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._saved_at = None
+
+    def _rollup_path(self, name):
+        return os.path.join(self.rollup_dir, name + ".npy")
+
+    def update(self, path, samples=None):
+        """Computes and saves the minute rollup of one session file."""
+        rows = compute_minute_rollup(path, samples, self.catalog)
+        os.makedirs(self.rollup_dir, exist_ok=True)
+        rollup_path = self._rollup_path(os.path.basename(path))
+        tmp_path = rollup_path + f".{os.getpid()}.tmp.npy"
+        np.save(tmp_path, rows)
+        os.replace(tmp_path, rollup_path)
+        return rows
+
+    def _session_rows(self, path, mtime_ns=None):
+        """The saved minute rollup of a session file, rebuilt first if it is older than the file."""
+        rollup_path = self._rollup_path(os.path.basename(path))
+        try:
+            if mtime_ns is None or os.stat(rollup_path).st_mtime_ns >= mtime_ns:
+                return np.load(rollup_path)
+        except OSError:
+            pass
+        return self.update(path)
+
+    def sync(self, files):
+        """Brings the merged hour/day rollups in line with the given (path, user, stamp) session files.
+
+        stamp identifies a version of the file (e.g. its size and mtime_ns);
+        a session is rebuilt when its stamp or user changes.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load_merged()
+                self._remove_orphans({os.path.basename(path) for path, _, _ in files})
+
+            wanted = {os.path.basename(path): (path, user, list(stamp)) for path, user, stamp in files}
+            stale = {}      # user -> hour starts to rebuild
+            for name, (first, last, path, user, stamp) in list(self.spans.items()):
+                if name not in wanted or wanted[name][1] != user or wanted[name][2] != stamp:
+                    del self.spans[name]
+                    hours = np.arange(first // 60 * 60, last // 60 * 60 + 1, 60)
+                    stale.setdefault(user, []).append(hours)
+                    if name not in wanted:
+                        try:
+                            os.remove(self._rollup_path(name))
+                        except OSError:
+                            pass    # Already removed by another process
+                elif wanted[name][0] != path:
+                    self.spans[name] = (first, last, wanted[name][0], user, stamp)  # Moved into its partition
+
+            if stale:
+                stale = {user: np.unique(np.concatenate(hours)) for user, hours in stale.items()}
+                stale[None] = np.unique(np.concatenate(list(stale.values())))
+                for user, hours in stale.items():
+                    if len(hours):
+                        self._rebuild_hours(user, hours)
+
+            added = {}      # user -> hour rows of the new sessions
+            for name, (path, user, stamp) in wanted.items():
+                if name in self.spans:
+                    continue
+                try:
+                    rows = self._session_rows(path, stamp[1] if len(stamp) > 1 else None)
+                except Exception as e:
+                    logger.error(f"Failed to build the rollup of '{path}': {e}")
+                    continue
+                if not len(rows):
+                    self.spans[name] = (0, -1, path, user, stamp)   # No minutes: never overlaps a query
+                    continue
+                self.spans[name] = (int(rows['minute'][0]), int(rows['minute'][-1]), path, user, stamp)
+                added.setdefault(user, []).append(merge_rollup_rows(rows, RESOLUTIONS['hour']))
+            if not stale and not added:
+                return
+            if added:
+                added = {user: np.concatenate(rows) for user, rows in added.items()}
+                added[None] = np.concatenate(list(added.values()))
+                for user, rows in added.items():
+                    current = self.hourly.get(user, np.empty(0, dtype=ROLLUP_DTYPE))
+                    self.hourly[user] = merge_rollup_rows(np.concatenate([current, rows]), RESOLUTIONS['hour'])
+
+            day = RESOLUTIONS['day']
+            for user in set(stale) | set(added):
+                days = []
+                if user in stale:
+                    days.append(stale[user] // day * day)
+                if user in added:
+                    days.append(added[user]['minute'] // day * day)
+                days = np.unique(np.concatenate(days))
+                hourly = self.hourly.get(user, np.empty(0, dtype=ROLLUP_DTYPE))
+                daily = self.daily.get(user, np.empty(0, dtype=ROLLUP_DTYPE))
+                rebuilt = merge_rollup_rows(hourly[np.isin(hourly['minute'] // day * day, days)], day)
+                daily = np.concatenate([daily[~np.isin(daily['minute'], days)], rebuilt])
+                self.daily[user] = daily[np.argsort(daily['minute'], kind='stable')]
+            for user in [user for user in self.hourly if user is not None and not len(self.hourly[user])]:
+                del self.hourly[user]
+                self.daily.pop(user, None)
+
+            if self._saved_at is None or time.monotonic() - self._saved_at >= MERGED_SAVE_SECONDS:
+                self._save_merged()
+
+    def _rebuild_hours(self, user_id, hours):
+        """Recomputes the hour rows of one user (None: all users) at the given hour starts from the sessions left."""
+        hourly = self.hourly.get(user_id, np.empty(0, dtype=ROLLUP_DTYPE))
+        kept = hourly[~np.isin(hourly['minute'], hours)]
+        parts = []
+        for name in self.sessions_between(int(hours[0]), int(hours[-1]) + 60, user_id):
+            try:
+                rows = np.load(self._rollup_path(name), mmap_mode='r')
+            except OSError:
+                continue
+            parts.append(rows[np.isin(rows['minute'] // 60 * 60, hours)])
+        rebuilt = merge_rollup_rows(np.concatenate(parts), RESOLUTIONS['hour']) if parts else kept[:0]
+        self.hourly[user_id] = merge_rollup_rows(np.concatenate([kept, rebuilt]), RESOLUTIONS['hour'])
+
+    def _save_merged(self):
+        """Saves the merged rollups with the sessions they cover (see _load_merged)."""
+        users = list(self.hourly)
+        arrays = {}
+        for i, user in enumerate(users):
+            arrays[f'hourly_{i}'] = self.hourly[user]
+            arrays[f'daily_{i}'] = self.daily.get(user, np.empty(0, dtype=ROLLUP_DTYPE))
+        meta = {'users': users, 'spans': self.spans}
+        try:
+            os.makedirs(self.rollup_dir, exist_ok=True)
+            tmp_path = self.merged_file + f".{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(tmp_path, self.merged_file)
+            self._saved_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Failed to save the merged rollups '{self.merged_file}': {e}")
+
+    def _load_merged(self):
+        try:
+            with np.load(self.merged_file) as stored:
+                meta = json.loads(str(stored['meta']))
+                hourly = {user: stored[f'hourly_{i}'] for i, user in enumerate(meta['users'])}
+                daily = {user: stored[f'daily_{i}'] for i, user in enumerate(meta['users'])}
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Failed to load the merged rollups '{self.merged_file}': {e}. Rebuilding them.")
+            return
+        self.hourly, self.daily = hourly, daily
+        self.hourly.setdefault(None, np.empty(0, dtype=ROLLUP_DTYPE))
+        self.daily.setdefault(None, np.empty(0, dtype=ROLLUP_DTYPE))
+        self.spans = {name: tuple(span) for name, span in meta['spans'].items()}
+        logger.info(f"Loaded merged rollups of {len(self.spans)} session(s).")
+
+    def _remove_orphans(self, names):
+        """Deletes the minute rollups of sessions that are gone (e.g. removed while no server ran)."""
+        if not os.path.isdir(self.rollup_dir):
+            return
+        for file_name in os.listdir(self.rollup_dir):
+            if file_name.endswith(".npy") and not file_name.endswith(".tmp.npy") and file_name[:-4] not in names:
+                try:
+                    os.remove(os.path.join(self.rollup_dir, file_name))
+                except OSError:
+                    pass    # Already removed by another process
+
+    def sessions_between(self, start_minute, end_minute, user_id=None):
+        """Session files (of one user, or all users) with at least one minute in [start_minute, end_minute)."""
+        return sorted(name for name, (first, last, _, user, _) in self.spans.items()
+                      if first < end_minute and last >= start_minute and (user_id is None or user == user_id))
+
+    def query(self, start_minute, end_minute, bucket_minutes, user_id=None):
+        """Rollup rows (of one user, or all users) in [start_minute, end_minute) merged into buckets of bucket_minutes."""
+        empty = np.empty(0, dtype=ROLLUP_DTYPE)
+        if bucket_minutes >= RESOLUTIONS['day']:
+            source = self.daily.get(user_id, empty)
+        elif bucket_minutes >= RESOLUTIONS['hour']:
+            source = self.hourly.get(user_id, empty)
+        else:
+            parts = []
+            for name in self.sessions_between(start_minute, end_minute, user_id):
+                try:
+                    parts.append(np.load(self._rollup_path(name), mmap_mode='r'))
+                except OSError:
+                    continue
+            source = np.concatenate(parts) if parts else empty
+        selected = source[(source['minute'] >= start_minute) & (source['minute'] < end_minute)]
+        return merge_rollup_rows(selected, bucket_minutes)
+
+    def raw_samples(self, start, end, limit=RAW_MAX_SAMPLES, user_id=None):
+        """Raw samples (of one user, or all users) taken in [start, end) (datetimes), or None if there are more than limit."""
+        times, pitch, roll = [], [], []
+        total = 0
+        start = np.datetime64(start, 'ms')
+        end = np.datetime64(end, 'ms')
+        start_minute = int(start.astype('datetime64[m]').astype(np.int64))
+        end_minute = int(end.astype('datetime64[m]').astype(np.int64)) + 1
+        for name in self.sessions_between(start_minute, end_minute, user_id):
+            path = self.spans[name][2]
+            samples = posture_analytics.sorted_samples(posture_analytics.load_samples(path))
+            sample_times = posture_analytics.sample_times(path, samples['timestamp'], self.catalog)
+            mask = (sample_times >= start) & (sample_times < end)
+            total += int(mask.sum())
+            if total > limit:
+                return None
+            times.append(sample_times[mask])
+            pitch.append(samples['pitch'][mask])
+            roll.append(samples['roll'][mask])
+        if not times:
+            return {'time': np.empty(0, dtype='datetime64[ms]'),
+                    'pitch': np.empty(0, dtype=np.float32), 'roll': np.empty(0, dtype=np.float32)}
+        time_values = np.concatenate(times)
+        order = np.argsort(time_values, kind='stable')
+        return {
+            'time': time_values[order],
+            'pitch': np.concatenate(pitch)[order],
+            'roll': np.concatenate(roll)[order],
+        }
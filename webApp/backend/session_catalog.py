@@ -0,0 +1,336 @@
+# session_catalog.py
+import os
+import re
+import sys
+import json
+import glob
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from alert_store import DEFAULT_USER_ID
+
+try:
+    import fcntl
+except ImportError:     # Windows: a single writer process is assumed there
+    fcntl = None
+
+# --- CONFIGURATION ---
+PARTITION_ROOT_NAME = "sessions"    # <data_dir>/sessions/<user>/<device>/<YYYYMMDD>/<session files>
+CATALOG_FILE_NAME = "catalog.log"          # Append-only: a format header, then one JSON line per placement
+LEGACY_CATALOG_FILE_NAME = "catalog.json"  # Whole-manifest file of earlier versions, converted on the first write
+CATALOG_FORMAT_VERSION = 2
+# {"<device id>": "<user id>"}; devices not listed belong to DEFAULT_USER_ID
+DEVICE_USERS_FILE = os.getenv('DEVICE_USERS_FILE', "../../config/device_users.json")
+UNKNOWN_DEVICE = "unknown"          # Sessions recorded before file names carried the device id
+SESSION_FILE_PATTERN = re.compile(
+    r'^nicla_orientation_(?P<day>\d{8})_\d{6}(?:_(?P<device>[A-Za-z0-9]+))?(?:\.(?:part|local)\d{4,})?\.(?:csv|npy)$')
+UNSAFE_KEY_CHARACTERS = re.compile(r'[^A-Za-z0-9_.@-]')
+
+logger = logging.getLogger(__name__)
+
+
+def session_identity(name):
+    """Returns (device id, start day as YYYYMMDD) of a session file name, or (None, None).
+
+    All segments of a session share its start day, so they land in the same
+    partition even when the session runs past midnight.
+    """
+    match = SESSION_FILE_PATTERN.match(name)
+    if not match:
+        return None, None
+    return match.group('device') or UNKNOWN_DEVICE, match.group('day')
+
+
+def safe_key(value):
+    """A user or device id usable as a directory name."""
+    return UNSAFE_KEY_CHARACTERS.sub('_', str(value)) or '_'
+
+
+class DeviceUserMap:
+    """Device to user assignments, read from DEVICE_USERS_FILE and reloaded when it changes."""
+
+    def __init__(self, path=DEVICE_USERS_FILE):
+        self.path = path
+        self.users = {}
+        self._mtime_ns = None
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns == self._mtime_ns:
+            return
+        with self._lock:
+            self._mtime_ns = mtime_ns
+            if mtime_ns is None:
+                self.users = {}
+                return
+            try:
+                with open(self.path, 'r') as f:
+                    self.users = {str(device).upper(): str(user) for device, user in json.load(f).items()}
+                logger.info(f"Loaded {len(self.users)} device assignment(s) from '{self.path}'.")
+            except Exception as e:
+                logger.error(f"Could not read device assignments '{self.path}': {e}")
+
+    def user_for(self, device_id):
+        self._reload()
+        if not device_id:
+            return DEFAULT_USER_ID
+        return self.users.get(str(device_id).upper(), DEFAULT_USER_ID)
+
+
+class SessionCatalog:
+    """Session files partitioned by user, device and start day, with a manifest of every partition.
+
+    New files arrive flat in data_dir (Drive downloads, local ingest);
+    place() moves a finished one into
+    `sessions/<user>/<device>/<YYYYMMDD>/` and appends one line for it to
+    `sessions/catalog.log`. The user is the device's owner at the time the
+    file is placed, so reassigning a device later keeps the old sessions
+    with their student. Queries for one user and a range of days pick
+    their partitions from the manifest and never list or open the others.
+
+    Writers (the Drive fetcher and local ingest, possibly in different
+    processes) append under a file lock; readers read only the lines added
+    since their last look. rebuild() replaces the log with a snapshot,
+    after which readers reload it in full.
+    """
+
+    def __init__(self, data_dir, device_users=None):
+        self.data_dir = data_dir
+        self.root = os.path.join(data_dir, PARTITION_ROOT_NAME)
+        self.catalog_file = os.path.join(self.root, CATALOG_FILE_NAME)
+        self.device_users = device_users or DeviceUserMap()
+        self.partitions = {}    # "<user>/<device>/<day>" -> {'user', 'device', 'day', 'files': [...]}
+        self._stems = set()     # Stems of every catalogued file, for duplicate checks
+        self._log_id = None     # (device, inode) of the log read so far, or the mtime of a legacy manifest
+        self._offset = 0        # Bytes of the log applied so far
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            fd = os.open(os.path.join(self.root, ".catalog.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                self._load()
+                yield
+            finally:
+                os.close(fd)    # Also releases the flock
+
+    def _load(self):
+        """Applies the lines appended to the log since the last call. Returns True if the manifest changed."""
+        try:
+            st = os.stat(self.catalog_file)
+        except OSError:
+            return self._load_legacy()
+        log_id = (st.st_dev, st.st_ino)
+        reset = log_id != self._log_id or st.st_size < self._offset
+        if not reset and st.st_size == self._offset:
+            return False
+        if reset:   # A new snapshot (or the first look)
+            self.partitions, self._stems, self._offset, self._log_id = {}, set(), 0, log_id
+        with open(self.catalog_file, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1    # A line still being appended is read next time
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                logger.error(f"Skipping a bad line in catalog '{self.catalog_file}': {e}")
+                continue
+            if 'format' in record:
+                if record['format'] != CATALOG_FORMAT_VERSION:
+                    logger.warning(f"Catalog '{self.catalog_file}' has another format. Run `python session_catalog.py` to rebuild it.")
+                continue
+            self._apply(record)
+        self._offset += end
+        return reset or end > 0
+
+    def _load_legacy(self):
+        """Reads the whole-manifest catalog.json of earlier versions, if there is one."""
+        legacy_file = os.path.join(self.root, LEGACY_CATALOG_FILE_NAME)
+        try:
+            mtime_ns = os.stat(legacy_file).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns == self._log_id:
+            return False
+        partitions = {}
+        if mtime_ns is not None:
+            try:
+                with open(legacy_file, 'r') as f:
+                    stored = json.load(f)
+                partitions = stored['partitions']
+            except Exception as e:
+                logger.error(f"Could not read catalog '{legacy_file}': {e}")
+        self.partitions = partitions
+        self._stems = {os.path.splitext(name)[0] for p in partitions.values() for name in p['files']}
+        self._log_id, self._offset = mtime_ns, 0
+        return True
+
+    def _apply(self, record):
+        """Adds the files of a log record to its partition; a converted session replaces its CSV."""
+        partition = self.partitions.setdefault(record['key'], {'user': record['user'], 'device': record['device'],
+                                                               'day': record['day'], 'files': []})
+        stems = {os.path.splitext(name)[0] for name in record['files']}
+        partition['files'] = sorted({f for f in partition['files'] if os.path.splitext(f)[0] not in stems}
+                                    | set(record['files']))
+        self._stems |= stems
+
+    def _write_snapshot(self, partitions):
+        """Replaces the log with one line per partition (under the write lock)."""
+        lines = [json.dumps({'format': CATALOG_FORMAT_VERSION})]
+        lines.extend(json.dumps({'key': key, 'user': p['user'], 'device': p['device'], 'day': p['day'],
+                                 'files': p['files']}) for key, p in sorted(partitions.items()))
+        tmp_path = self.catalog_file + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.catalog_file)
+        try:
+            os.remove(os.path.join(self.root, LEGACY_CATALOG_FILE_NAME))
+        except OSError:
+            pass
+        self._log_id = None     # Read the snapshot back like any reader would
+        self._load()
+
+    def _append(self, record):
+        """Appends one placement to the log (under the write lock)."""
+        if not os.path.exists(self.catalog_file):
+            self._write_snapshot(self.partitions)   # First write, possibly converting a legacy manifest
+        data = (json.dumps(record) + '\n').encode('utf-8')
+        with open(self.catalog_file, 'ab') as f:
+            f.write(data)
+        self._apply(record)
+        self._offset += len(data)
+
+    def refresh(self):
+        """Reloads the manifest if another process changed it. Returns True if it was reloaded."""
+        with self._lock:
+            return self._load()
+
+    @property
+    def version(self):
+        return self._log_id, self._offset
+
+    def partition_dir(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def contains(self, name):
+        """True if a session file of this name (as .csv or .npy) is already in a partition."""
+        self.refresh()
+        return os.path.splitext(name)[0] in self._stems
+
+    def user_of(self, name):
+        """The user a flat session file will be placed under."""
+        device_id, _ = session_identity(name)
+        return self.device_users.user_for(device_id)
+
+    def place(self, path):
+        """Moves a finished session file from the flat data directory into its partition.
+
+        Returns the new path, or None if the name carries no session start.
+        """
+        name = os.path.basename(path)
+        device_id, day = session_identity(name)
+        if day is None:
+            logger.warning(f"'{name}' is not a session file name; leaving it unpartitioned.")
+            return None
+        user_id = self.device_users.user_for(device_id)
+        key = f"{safe_key(user_id)}/{safe_key(device_id)}/{day}"
+        directory = self.partition_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        destination = os.path.join(directory, name)
+        with self._write_lock():
+            os.replace(path, destination)
+            self._append({'key': key, 'user': user_id, 'device': device_id, 'day': day, 'files': [name]})
+        return destination
+
+    def place_all(self, skip=()):
+        """Places every session file still lying flat in data_dir, except the names in skip. Returns the count."""
+        placed = 0
+        for pattern in ('*.csv', '*.npy'):
+            for path in sorted(glob.glob(os.path.join(self.data_dir, pattern))):
+                name = os.path.basename(path)
+                if name in skip or session_identity(name)[1] is None:
+                    continue
+                try:
+                    if self.place(path):
+                        placed += 1
+                except OSError as e:
+                    logger.error(f"Could not place '{name}' in its partition: {e}")
+        return placed
+
+    def select(self, user_id=None, since_day=None):
+        """Partition keys of one user (or all users) holding sessions started on or after since_day (YYYYMMDD)."""
+        self.refresh()
+        return sorted(key for key, p in self.partitions.items()
+                      if (user_id is None or p['user'] == user_id) and (since_day is None or p['day'] >= since_day))
+
+    def files(self, user_id=None, since_day=None):
+        """Returns [(partition key, path)] of the selected partitions' session files."""
+        selected = []
+        for key in self.select(user_id, since_day):
+            directory = self.partition_dir(key)
+            selected.extend((key, os.path.join(directory, name)) for name in self.partitions[key]['files'])
+        return selected
+
+    def users(self):
+        self.refresh()
+        return sorted({p['user'] for p in self.partitions.values()})
+
+    def find(self, stem):
+        """Path of a partitioned session file with this stem, or None. Looks only at the manifest."""
+        device_id, day = session_identity(stem + '.csv')
+        if day is None or not self.contains(stem):
+            return None
+        for key, partition in self.partitions.items():
+            if partition['device'] != device_id or partition['day'] != day:
+                continue
+            for extension in ('.npy', '.csv'):
+                if stem + extension in partition['files']:
+                    return os.path.join(self.partition_dir(key), stem + extension)
+        return None
+
+    def rebuild(self):
+        """Rewrites the manifest from the partition directories on disk. Returns the number of partitions."""
+        with self._write_lock():
+            partitions = {}
+            for directory in sorted(glob.glob(os.path.join(self.root, '*', '*', '*'))):
+                if not os.path.isdir(directory):
+                    continue
+                names = sorted(n for n in os.listdir(directory) if session_identity(n)[1] is not None)
+                # Keep the binary copy when both exist
+                stems_with_npy = {os.path.splitext(n)[0] for n in names if n.endswith('.npy')}
+                names = [n for n in names if n.endswith('.npy') or os.path.splitext(n)[0] not in stems_with_npy]
+                if not names:
+                    continue
+                user_dir, device_dir, day = os.path.relpath(directory, self.root).split(os.sep)
+                previous = self.partitions.get(f"{user_dir}/{device_dir}/{day}", {})
+                partitions[f"{user_dir}/{device_dir}/{day}"] = {
+                    'user': previous.get('user', user_dir), 'device': previous.get('device', device_dir),
+                    'day': day, 'files': names,
+                }
+            self._write_snapshot(partitions)
+        return len(partitions)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Move flat session files into user/device/day partitions and rebuild the catalog.")
+    parser.add_argument('data_dir', nargs='?', default='downloaded_csvs', help="Directory holding the session files")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        logger.error(f"Directory '{args.data_dir}' does not exist.")
+        sys.exit(1)
+    catalog = SessionCatalog(args.data_dir)
+    placed = catalog.place_all()
+    count = catalog.rebuild()
+    logger.info(f"Placed {placed} session file(s); the catalog lists {count} partition(s).")
@@ -0,0 +1,101 @@
+# session_store.py
+import os
+import sys
+import glob
+import logging
+import argparse
+import numpy as np
+
+# --- CONFIGURATION ---
+# Fixed-width little-endian records: 16 bytes per sample instead of ~30 bytes of CSV text.
+SESSION_DTYPE = np.dtype([
+    ('timestamp', '<u4'),
+    ('pitch', '<f4'),
+    ('roll', '<f4'),
+    ('yaw', '<f4'),
+])
+SESSION_EXTENSION = '.npy'
+
+logger = logging.getLogger(__name__)
+
+
+def session_path_for(csv_path):
+    """Returns the binary session path that sits next to a CSV session file."""
+    return os.path.splitext(csv_path)[0] + SESSION_EXTENSION
+
+
+def convert_csv_to_session(csv_path, session_path=None, remove_csv=False):
+    """Converts a `nicla_orientation_*.csv` file into the binary session format."""
+    import posture_analytics  # Deferred: posture_analytics reads sessions through this module
+
+    session_path = session_path or session_path_for(csv_path)
+    samples = posture_analytics.load_orientation_csv(csv_path)
+
+    records = np.empty(len(samples['timestamp']), dtype=SESSION_DTYPE)
+    for name in SESSION_DTYPE.names:
+        records[name] = samples[name]
+
+    # Write to a temporary file first so readers never see a half-written session
+    tmp_path = session_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, records, allow_pickle=False)
+    os.replace(tmp_path, session_path)
+
+    # Keep the CSV's mtime so cache entries and retention policies see the original age
+    st = os.stat(csv_path)
+    os.utime(session_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    if remove_csv:
+        os.remove(csv_path)
+    logger.info(f"Converted '{os.path.basename(csv_path)}' to '{os.path.basename(session_path)}' ({len(records)} samples).")
+    return session_path
+
+
+def open_session(path):
+    """Memory-maps a binary session file. Returns a read-only structured array."""
+    records = np.load(path, mmap_mode='r', allow_pickle=False)
+    if records.dtype != SESSION_DTYPE:
+        raise ValueError(f"'{path}' is not an orientation session file (dtype {records.dtype}).")
+    return records
+
+
+def load_session_samples(path):
+    """Returns the columns of a binary session as zero-copy NumPy views.
+
+    Timestamps are widened to int64 so that time arithmetic in the analytics
+    cannot wrap around; the angle columns stay backed by the memory map.
+    """
+    records = open_session(path)
+    return {
+        'timestamp': records['timestamp'].astype(np.int64),
+        'pitch': records['pitch'],
+        'roll': records['roll'],
+        'yaw': records['yaw'],
+    }
+
+
+def convert_directory(data_dir, remove_csv=False):
+    """Converts every CSV session in data_dir that has no binary counterpart yet."""
+    converted = 0
+    for csv_path in sorted(glob.glob(os.path.join(data_dir, 'nicla_orientation_*.csv'))):
+        if os.path.exists(session_path_for(csv_path)):
+            continue
+        try:
+            convert_csv_to_session(csv_path, remove_csv=remove_csv)
+            converted += 1
+        except Exception as e:
+            logger.error(f"Failed to convert '{csv_path}': {e}")
+    return converted
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert nicla_orientation_*.csv sessions to the binary session format.")
+    parser.add_argument('data_dir', nargs='?', default='downloaded_csvs', help="Directory holding the CSV sessions")
+    parser.add_argument('--remove-csv', action='store_true', help="Delete each CSV after a successful conversion")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        logger.error(f"Directory '{args.data_dir}' does not exist.")
+        sys.exit(1)
+    count = convert_directory(args.data_dir, remove_csv=args.remove_csv)
+    logger.info(f"Converted {count} session file(s) in '{args.data_dir}'.")
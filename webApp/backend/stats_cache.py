@@ -0,0 +1,450 @@
+# stats_cache.py
+import os
+import json
+import time
+import heapq
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+import pandas as pd
+import posture_analytics
+import metrics
+from alert_store import DEFAULT_USER_ID
+
+# --- CONFIGURATION ---
+CACHE_FILE_NAME = ".stats_cache.json"          # Entries of the session files lying flat in the data directory
+PARTITION_CACHE_FILE_NAME = ".stats.json"       # Entries of one catalog partition, saved in its directory
+CACHE_FORMAT_VERSION = 5
+SUMMARY_TTL_SECONDS = 300       # Upper bound on the age of a cached LLM summary
+FLAT_RECHECK_SECONDS = 10       # Files appended in place (open local parts) do not touch the directory mtime
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = metrics.Histogram('posture_stats_refresh_seconds',
+                                    'Time to analyze new session files and rebuild the merged aggregates')
+
+
+class SessionAggregateCache:
+    """Persistent per-file cache of hourly posture aggregates.
+
+    Downloaded session files never change once written, so each file is
+    analyzed once and its hourly partials and posture episodes are stored
+    under its name, size and mtime. Queries read the merged hourly/daily
+    frames kept in memory and never touch raw samples; a refresh adds the
+    partials of new files to them and subtracts those of removed ones.
+
+    Entries are saved next to their files: a `.stats.json` per catalog
+    partition, and the cache file in data_dir for files lying flat there.
+    Several server processes can share one data directory: a process
+    notices new files through the catalog or the directory's mtime
+    (confirmed by the names, sizes and mtimes of the session files in it;
+    state and lock files saved there do not count), and first reuses the
+    aggregates another process already saved for their partition.
+
+    With a session_catalog.SessionCatalog, files placed in user/device/day
+    partitions are found through its manifest and never stat'ed again (they
+    do not change once placed), and per-user queries merge only the entries
+    of that user's partitions in the requested range.
+    """
+
+    def __init__(self, data_dir, cache_file=None, rollup_store=None, catalog=None):
+        self.data_dir = data_dir
+        self.rollup_store = rollup_store    # Optional rollups.RollupStore kept in step with the session files
+        self.catalog = catalog
+        self.cache_file = cache_file or os.path.join(data_dir, CACHE_FILE_NAME)
+        self.entries = {}
+        self.version = 0
+        self.data_tag = None        # Same value in every process for the same set of analyzed files
+        self.last_modified = None   # Newest analyzed file (epoch seconds)
+        self.hourly = posture_analytics.empty_aggregates()
+        self.daily = posture_analytics.to_daily(self.hourly)
+        self.episodes = []          # Posture episodes of all files, by start time
+        self._flat_keys = set()     # Entries of files not placed in a partition yet
+        self._views = {}            # (user, since day) -> merged aggregates of that selection
+        self._lock = threading.Lock()
+        self._dir_mtime_ns = None
+        self._flat_signature = None     # Session files lying flat in data_dir at the last refresh
+        self._flat_checked = 0.0
+        self._tag_sum = 0               # Sum of the entry fingerprints, from which data_tag is derived
+        self._provisional = set()       # Entries of later segments analyzed before part 0 of their session was stored
+
+    def _load(self, entry_file):
+        """Entries saved in entry_file by file name, or {} if there are none."""
+        try:
+            with open(entry_file, 'r') as f:
+                stored = json.load(f)
+            if stored.get('format') != CACHE_FORMAT_VERSION:
+                logger.info(f"Stats cache format of '{entry_file}' changed. Rebuilding its entries.")
+                return {}
+            entries = {
+                name: {
+                    'size': entry['size'],
+                    'mtime_ns': entry['mtime_ns'],
+                    'hourly': _frame_from_json(entry['hourly']),
+                    'episodes': entry['episodes'],
+                    'user': entry['user'],
+                    **({'provisional': True} if entry.get('provisional') else {}),
+                }
+                for name, entry in stored.get('files', {}).items()
+            }
+            logger.debug(f"Loaded cached aggregates for {len(entries)} session file(s) from '{entry_file}'.")
+            return entries
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Failed to load stats cache '{entry_file}': {e}. Rebuilding its entries.")
+            return {}
+
+    def _save(self, entry_file, entries):
+        """Writes entries (by file name) to entry_file."""
+        stored = {
+            'format': CACHE_FORMAT_VERSION,
+            'files': {
+                name: {
+                    'size': entry['size'],
+                    'mtime_ns': entry['mtime_ns'],
+                    'hourly': _frame_to_json(entry['hourly']),
+                    'episodes': entry['episodes'],
+                    'user': entry['user'],
+                    **({'provisional': True} if entry.get('provisional') else {}),
+                }
+                for name, entry in entries.items()
+            }
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(entry_file)), exist_ok=True)
+        tmp_path = entry_file + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, entry_file)
+
+    def _partition_cache_file(self, key):
+        return os.path.join(self.catalog.partition_dir(key), PARTITION_CACHE_FILE_NAME)
+
+    def _save_partition(self, key):
+        """Saves the entries of one catalog partition, keeping those another process saved for files placed since."""
+        entry_file = self._partition_cache_file(key)
+        entries = self._load(entry_file)
+        names = set(entries) | set(self.catalog.partitions[key]['files'] if key in self.catalog.partitions else [])
+        for name in names:
+            if f"{key}/{name}" in self.entries:
+                entries[name] = self.entries[f"{key}/{name}"]
+        self._save(entry_file, entries)
+
+    def refresh(self):
+        """Analyzes new or changed session files and drops removed ones. Returns True if anything changed."""
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                self._dir_mtime_ns = os.stat(self.data_dir).st_mtime_ns
+            except OSError:
+                self._dir_mtime_ns = None
+            self._flat_signature = self._session_file_signature()
+            self._flat_checked = time.monotonic()
+
+            current = self._current_files()
+            self._flat_keys = {name for name in current if '/' not in name}
+
+            added, removed = [], []
+            moved = {}      # Entries of files that left the flat directory, by file name
+            removed_names = [name for name in self.entries if name not in current]
+            for name in removed_names:
+                entry = self._pop(name)
+                removed.append(entry)
+                moved[os.path.basename(name)] = entry
+
+            stored_flat = None
+            stored_partitions = {}      # Partition key -> entries saved by any process, read once per refresh
+            dirty_partitions = set()
+            dirty_flat = any('/' not in name for name in removed_names)
+            reassigned = False
+            for name, (path, user) in current.items():
+                entry = self.entries.get(name)
+                flat = name in self._flat_keys
+                if entry and not flat:
+                    continue    # Partitioned files never change
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                size, mtime_ns = st.st_size, st.st_mtime_ns
+                if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+                    if entry['user'] != user:   # The device was assigned to another user
+                        entry['user'] = user
+                        reassigned = dirty_flat = True
+                    continue
+                if entry:
+                    removed.append(self._pop(name))    # A flat file that grew
+
+                file_name = os.path.basename(path)
+                key = None if flat else name.rsplit('/', 1)[0]
+                if flat:
+                    if stored_flat is None:
+                        stored_flat = self._load(self.cache_file)
+                    stored = stored_flat.get(file_name)
+                else:
+                    if key not in stored_partitions:
+                        stored_partitions[key] = self._load(self._partition_cache_file(key))
+                    stored = stored_partitions[key].get(file_name)
+                moved_entry = moved.get(file_name)
+                saved = bool(stored and stored['size'] == size and stored['mtime_ns'] == mtime_ns)
+                if saved:
+                    entry = dict(stored, user=user)     # Analyzed and saved by another process
+                elif moved_entry and moved_entry['size'] == size and moved_entry['mtime_ns'] == mtime_ns:
+                    # Placed in its partition since the last refresh: same file, no need to analyze it again
+                    entry = dict(moved_entry, user=user)
+                else:
+                    entry = self._analyze(name, path, size, mtime_ns, user)
+                    if entry is None:
+                        continue
+                if not saved:
+                    if flat:
+                        dirty_flat = True
+                    else:
+                        dirty_partitions.add(key)
+                self._add(name, entry)
+                added.append((name, entry))
+
+            if added and self._provisional:
+                # Segments analyzed before their part 0 arrived used a guessed origin: analyze them again
+                for name in list(self._provisional):
+                    path, user = current[name]
+                    if posture_analytics.first_segment_path(path, self.catalog) is None:
+                        continue
+                    old = self.entries[name]
+                    entry = self._analyze(name, path, old['size'], old['mtime_ns'], user)
+                    if entry is None:
+                        continue
+                    removed.append(self._pop(name))
+                    self._add(name, entry)
+                    added.append((name, entry))
+                    if name in self._flat_keys:
+                        dirty_flat = True
+                    else:
+                        dirty_partitions.add(name.rsplit('/', 1)[0])
+
+            changed = bool(added or removed or reassigned)
+            if changed or self.version == 0:
+                self._merge(added, removed)
+                if self.rollup_store is not None:
+                    self.rollup_store.sync([(current[name][0], e['user'],
+                                             (e['size'], e['mtime_ns'], e.get('provisional', False)))
+                                            for name, e in self.entries.items()])
+                self.data_tag = f"{self._tag_sum:016x}"
+                self.version += 1
+                self._views = {}
+            try:
+                if dirty_flat:
+                    self._save(self.cache_file, {name: self.entries[name] for name in self._flat_keys
+                                                 if name in self.entries})
+                for key in dirty_partitions:
+                    self._save_partition(key)
+            except Exception as e:
+                logger.error(f"Failed to save stats cache entries: {e}")
+            if changed:
+                REFRESH_SECONDS.observe(time.perf_counter() - started)
+            return changed
+
+    def _analyze(self, name, path, size, mtime_ns, user):
+        """Builds the cache entry of one session file (and its minute rollup). Returns None if it cannot be read."""
+        try:
+            samples = posture_analytics.load_samples(path)
+            hourly = posture_analytics.aggregate_session(path, samples, self.catalog)
+            episodes = posture_analytics.session_episodes(path, samples, self.catalog)
+            if self.rollup_store is not None:
+                self.rollup_store.update(path, samples)
+        except Exception as e:
+            logger.error(f"Failed to analyze '{path}': {e}")
+            return None
+        entry = {'size': size, 'mtime_ns': mtime_ns, 'hourly': hourly, 'episodes': episodes, 'user': user}
+        if posture_analytics.is_provisional_segment(path, self.catalog):
+            entry['provisional'] = True
+        logger.info(f"Cached aggregates for '{name}' ({len(hourly)} hour bucket(s), {len(episodes)} episode(s)).")
+        return entry
+
+    def _add(self, name, entry):
+        self.entries[name] = entry
+        if entry.get('provisional'):
+            self._provisional.add(name)
+
+    def _pop(self, name):
+        self._provisional.discard(name)
+        return self.entries.pop(name)
+
+    def _merge(self, added, removed):
+        """Adds the aggregates and episodes of the added (name, entry) pairs and takes out those of the removed entries."""
+        deltas = [e['hourly'] for _, e in added] + [-e['hourly'] for e in removed]
+        delta = posture_analytics.merge_aggregates(deltas)
+        if not delta.empty:
+            dtypes = posture_analytics.empty_aggregates().dtypes.to_dict()
+            hourly = self.hourly.add(delta, fill_value=0)
+            self.hourly = hourly[hourly['samples'] > 0].astype(dtypes)
+            daily = self.daily.add(posture_analytics.to_daily(delta), fill_value=0)
+            self.daily = daily[daily['samples'] > 0].astype(dtypes)
+
+        if removed:
+            gone = {id(ep) for e in removed for ep in e['episodes']}
+            self.episodes = [ep for ep in self.episodes if id(ep) not in gone]
+        new_episodes = sorted((ep for _, e in added for ep in e['episodes']), key=lambda ep: ep['start'])
+        if new_episodes:
+            if not self.episodes or self.episodes[-1]['start'] <= new_episodes[0]['start']:
+                self.episodes.extend(new_episodes)
+            else:
+                self.episodes = list(heapq.merge(self.episodes, new_episodes, key=lambda ep: ep['start']))
+
+        for name, e in added:
+            self._tag_sum = (self._tag_sum + _fingerprint(name, e)) % 2 ** 64
+        if removed:
+            # Removed entries are no longer keyed: recompute the sum and the newest file from what is left
+            self._tag_sum = sum(_fingerprint(name, e) for name, e in self.entries.items()) % 2 ** 64
+            self.last_modified = max((e['mtime_ns'] for e in self.entries.values()), default=0) / 1e9
+        else:
+            newest = max((e['mtime_ns'] for _, e in added), default=0) / 1e9
+            self.last_modified = max(self.last_modified or 0, newest)
+
+    def _current_files(self):
+        """{cache key: (path, user)} of the flat session files and of every catalogued one."""
+        current = {}
+        for path in posture_analytics.list_session_files(self.data_dir):
+            name = os.path.basename(path)
+            current[name] = (path, self.catalog.user_of(name) if self.catalog is not None else DEFAULT_USER_ID)
+        if self.catalog is not None:
+            for key, path in self.catalog.files():
+                current[f"{key}/{os.path.basename(path)}"] = (path, self.catalog.partitions[key]['user'])
+        return current
+
+    def _session_file_signature(self):
+        """(name, size, mtime) of every session file lying flat in data_dir."""
+        signature = []
+        for path in posture_analytics.list_session_files(self.data_dir):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature.append((os.path.basename(path), st.st_size, st.st_mtime_ns))
+        return signature
+
+    def refresh_if_changed(self):
+        """Refreshes when session files were added to, changed in or removed from the data directory or the catalog.
+
+        Files growing in place are noticed within FLAT_RECHECK_SECONDS.
+        """
+        try:
+            dir_mtime_ns = os.stat(self.data_dir).st_mtime_ns
+        except OSError:
+            dir_mtime_ns = None
+        catalog_changed = self.catalog is not None and self.catalog.refresh()
+        if self.version == 0 or catalog_changed:
+            return self.refresh()
+        if dir_mtime_ns != self._dir_mtime_ns or time.monotonic() - self._flat_checked >= FLAT_RECHECK_SECONDS:
+            # Saving a state file also bumps the mtime: only a different set of session files counts
+            self._dir_mtime_ns = dir_mtime_ns
+            self._flat_checked = time.monotonic()
+            if self._session_file_signature() != self._flat_signature:
+                return self.refresh()
+        return False
+
+    def _view(self, user_id, since):
+        """Merged aggregates and episodes of one user's sessions started on or after since (a date or None)."""
+        since_day = since.strftime('%Y%m%d') if since is not None else None
+        with self._lock:
+            view = self._views.get((user_id, since_day))
+            if view is not None:
+                return view
+            keys = [f"{key}/{os.path.basename(path)}" for key, path in self.catalog.files(user_id, since_day)] \
+                if self.catalog is not None else list(self.entries)
+            keys.extend(self._flat_keys)
+            entries = [self.entries[key] for key in set(keys)
+                       if key in self.entries and self.entries[key]['user'] == user_id]
+            hourly = posture_analytics.merge_aggregates([e['hourly'] for e in entries])
+            view = self._views[(user_id, since_day)] = {
+                'hourly': hourly,
+                'daily': posture_analytics.to_daily(hourly),
+                'episodes': sorted((ep for e in entries for ep in e['episodes']), key=lambda ep: ep['start']),
+            }
+            return view
+
+    def get_daily(self, user_id=None, since=None):
+        """Returns merged per-day aggregates (of one user's sessions started since `since`), building the cache on first use."""
+        self.refresh_if_changed()
+        return self.daily if user_id is None else self._view(user_id, since)['daily']
+
+    def get_hourly(self, user_id=None, since=None):
+        """Returns merged hourly aggregates (of one user's sessions started since `since`), building the cache on first use."""
+        self.refresh_if_changed()
+        return self.hourly if user_id is None else self._view(user_id, since)['hourly']
+
+    def get_episodes(self, since=None, user_id=None):
+        """Returns posture episodes that started at or after since (ISO string), oldest first."""
+        self.refresh_if_changed()
+        if user_id is None:
+            episodes = self.episodes
+        else:
+            # A session that started the day before can still hold episodes after since
+            first_day = datetime.fromisoformat(since) - timedelta(days=1) if since is not None else None
+            episodes = self._view(user_id, first_day)['episodes']
+        if since is None:
+            return episodes
+        return [ep for ep in episodes if ep['start'] >= since]
+
+
+class PostureSummaryCache:
+    """Per-user cache of the posture summary handed to the LLM.
+
+    A summary is reused until the aggregate cache version changes (new
+    session files were analyzed) or it is older than ttl_seconds. On expiry
+    the aggregate cache is refreshed first, which also picks up files that
+    were copied into the data directory by hand. build(user_id, hourly)
+    produces the summary text.
+    """
+
+    def __init__(self, aggregate_cache, build, ttl_seconds=SUMMARY_TTL_SECONDS):
+        self.aggregate_cache = aggregate_cache
+        self.build = build
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        self.aggregate_cache.refresh_if_changed()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            now = time.monotonic()
+            if entry and entry['version'] == self.aggregate_cache.version and now < entry['expires']:
+                return entry['summary']
+            if entry and now >= entry['expires']:
+                self.aggregate_cache.refresh()
+            since = datetime.now() - timedelta(days=posture_analytics.SUMMARY_WINDOW_DAYS)
+            hourly = self.aggregate_cache.get_hourly(user_id, since)
+            summary = self.build(user_id, hourly)
+            self._entries[user_id] = {
+                'summary': summary,
+                'version': self.aggregate_cache.version,
+                'expires': now + self.ttl_seconds,
+            }
+            return summary
+
+
+def _frame_to_json(frame):
+    return {
+        'index': [ts.isoformat() for ts in frame.index],
+        'columns': list(frame.columns),
+        'data': frame.to_numpy().tolist(),
+    }
+
+
+def _frame_from_json(stored):
+    if not stored['index']:
+        return posture_analytics.empty_aggregates()
+    frame = pd.DataFrame(
+        stored['data'],
+        columns=stored['columns'],
+        index=pd.DatetimeIndex(pd.to_datetime(stored['index']), name='hour'),
+    )
+    return frame.astype(posture_analytics.empty_aggregates().dtypes.to_dict())
+
+
+def _fingerprint(name, entry):
+    stamp = f"{name}|{entry['size']}|{entry['mtime_ns']}|{bool(entry.get('provisional'))}"
+    digest = hashlib.sha1(stamp.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
@@ -1,12 +1,27 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import Statistics from './Statistics';
 import TopicChat from './TopicChat';
 import './App.css';
 
+const FLASK_BACKEND_URL = 'http://localhost:5000';
+const MAX_LIVE_ALERTS = 3;
+
 
 function App() {
   // Add state for page navigation
   const [currentPage, setCurrentPage] = useState('chat');
+  const [liveAlerts, setLiveAlerts] = useState([]);
+
+  // Alerts are pushed by the backend as they arrive instead of being polled
+  useEffect(() => {
+    if (!window.EventSource) return undefined;
+    const source = new EventSource(`${FLASK_BACKEND_URL}/alerts/stream`);
+    source.addEventListener('alert', (event) => {
+      const alert = JSON.parse(event.data);
+      setLiveAlerts(prev => [alert, ...prev].slice(0, MAX_LIVE_ALERTS));
+    });
+    return () => source.close();
+  }, []);
 
   const renderCurrentPage = () => {
     switch(currentPage) {
@@ -87,6 +102,27 @@ function App() {
             </div>
           </div>
 
+          <div className="user-info">
+            <h3>🔔 Live Alerts</h3>
+            {liveAlerts.length === 0 ? (
+              <div className="quick-stat">
+                <div className="stat-info">
+                  <span className="stat-label">No new alerts</span>
+                </div>
+              </div>
+            ) : (
+              liveAlerts.map((alert, index) => (
+                <div key={`${alert.timestamp}-${index}`} className="quick-stat">
+                  <div className="stat-info">
+                    <span className="stat-label">{alert.timestamp}</span>
+                    <span className="stat-value alert">{alert.message}</span>
+                  </div>
+                  <div className="stat-icon">⚠️</div>
+                </div>
+              ))
+            )}
+          </div>
+
           <div className="quick-actions">
             <h3>🚀 Quick Actions</h3>
             <button className="action-btn">
@@ -9,11 +9,30 @@ function Statistics() {
   const [selectedPeriod, setSelectedPeriod] = useState(7);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [intraday, setIntraday] = useState(null);
 
   useEffect(() => {
     fetchPostureStats(selectedPeriod);
   }, [selectedPeriod]);
 
+  useEffect(() => {
+    fetchIntraday();
+  }, []);
+
+  // Last 24 hours; the backend picks a rollup resolution that fits the point budget
+  const fetchIntraday = async () => {
+    try {
+      const response = await fetch(`${FLASK_BACKEND_URL}/api/posture-timeseries?hours=24&points=300`);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      setIntraday(await response.json());
+    } catch (err) {
+      console.error('Error fetching intraday posture data:', err);
+      setIntraday(null);
+    }
+  };
+
   const fetchPostureStats = async (days) => {
     try {
       setLoading(true);
@@ -172,10 +191,19 @@ function Statistics() {
   };
 
   const renderAlertCategoriesPie = () => {
-    const totalAlerts = summaryStats.total_alerts || 0;
-    const forwardLeanAlerts = Math.round(totalAlerts * 0.6);
-    const sideTiltAlerts = Math.round(totalAlerts * 0.25);
-    const otherAlerts = totalAlerts - forwardLeanAlerts - sideTiltAlerts;
+    const categories = summaryStats.alert_categories;
+    let forwardLeanAlerts, sideTiltAlerts, otherAlerts;
+    if (categories && categories.total > 0) {
+      // Alerts received from the devices, counted per tilt type by the backend
+      forwardLeanAlerts = categories.forward_lean || 0;
+      sideTiltAlerts = categories.side_tilt || 0;
+      otherAlerts = categories.total - forwardLeanAlerts - sideTiltAlerts;
+    } else {
+      const totalAlerts = summaryStats.total_alerts || 0;
+      forwardLeanAlerts = Math.round(totalAlerts * 0.6);
+      sideTiltAlerts = Math.round(totalAlerts * 0.25);
+      otherAlerts = totalAlerts - forwardLeanAlerts - sideTiltAlerts;
+    }
 
     const alertCategories = [
       {
@@ -256,6 +284,52 @@ function Statistics() {
     );
   };
 
+  const renderIntradayChart = () => {
+    const series = intraday?.series;
+    if (!series || !series.t.length || !series.bad_pct) return null;
+
+    const width = 720;
+    const height = 200;
+    const padding = 30;
+    const start = new Date(intraday.start).getTime();
+    const end = new Date(intraday.end).getTime();
+    const x = (t) => padding + ((new Date(t).getTime() - start) / (end - start)) * (width - 2 * padding);
+    const barWidth = Math.max(2, ((series.bucket_seconds * 1000) / (end - start)) * (width - 2 * padding) - 1);
+    const pitchLimit = Math.max(10, ...series.pitch_max.map(Math.abs));
+    const pitchY = (v) => height / 2 - (v / pitchLimit) * (height / 2 - padding);
+    const pitchLine = series.t.map((t, i) => `${x(t)},${pitchY(series.pitch_mean[i])}`).join(' ');
+
+    return (
+      <div className="chart-container">
+        <h3>🕐 Last 24 Hours ({intraday.resolution} resolution)</h3>
+        <svg width="100%" viewBox={`0 0 ${width} ${height}`} className="intraday-chart">
+          {series.t.map((t, i) => (
+            <rect
+              key={t}
+              x={x(t)}
+              y={height - padding - (series.bad_pct[i] / 100) * (height - 2 * padding)}
+              width={barWidth}
+              height={(series.bad_pct[i] / 100) * (height - 2 * padding)}
+              fill="#fca5a5"
+            >
+              <title>{`${t}: ${series.bad_pct[i]}% poor posture, pitch ${series.pitch_min[i]}..${series.pitch_max[i]}°`}</title>
+            </rect>
+          ))}
+          <polyline points={pitchLine} fill="none" stroke="#3b82f6" strokeWidth="2" />
+          <line x1={padding} x2={width - padding} y1={height / 2} y2={height / 2} stroke="#d1d5db" strokeDasharray="4" />
+        </svg>
+        <div className="chart-legend">
+          <span className="legend-item">
+            <span className="legend-color poor"></span>Poor Posture %
+          </span>
+          <span className="legend-item">
+            <span className="legend-color" style={{ backgroundColor: '#3b82f6' }}></span>Mean Side Tilt (pitch)
+          </span>
+        </div>
+      </div>
+    );
+  };
+
   const renderAlertFrequency = () => {
     if (!postureData.length) return null;
 
@@ -402,6 +476,7 @@ function Statistics() {
       {/* Charts */}
       <div className="charts-section">
         {renderPostureChart()}
+        {renderIntradayChart()}
         {renderAlertFrequency()}
       </div>
 
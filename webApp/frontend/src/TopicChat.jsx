@@ -94,6 +94,48 @@ const formatMessage = (text) => {
       .replace(/\n/g, '<br>'); // Line breaks
   };
 
+// Reads the server-sent events of a streamed /chat_ai reply, calling onText with the text so far
+const readReplyStream = async (body, onText) => {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === 'error') {
+        throw new Error(payload.error);
+      }
+      if (event === 'done') {
+        onText(payload.reply);
+        return;
+      }
+      text += payload.delta;
+      onText(text);
+    }
+  }
+  if (!text) {
+    throw new Error('Reply stream ended without data');
+  }
+};
+
 function TopicChat() {
   const [selectedTopic, setSelectedTopic] = useState(null);
   const [messages, setMessages] = useState([]);
@@ -137,14 +179,28 @@ function TopicChat() {
     
     setMessages(prev => [...prev, userMessage]);
 
+    const aiMessageId = Date.now() + 1;
+    const updateAiMessage = (text) => {
+      setMessages(prev => {
+        if (prev.some(m => m.id === aiMessageId)) {
+          return prev.map(m => (m.id === aiMessageId ? { ...m, text } : m));
+        }
+        return [...prev, { id: aiMessageId, text, sender: 'ai', topic: selectedTopic.id }];
+      });
+    };
+
     try {
       const response = await fetch(`${FLASK_BACKEND_URL}/chat_ai`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+          'Content-Type': 'application/json',
+          'Accept': 'text/event-stream, application/json'
+        },
         body: JSON.stringify({ 
           question: messageText,
           topic: selectedTopic.id,
-          context: `Topic: ${selectedTopic.title} - ${selectedTopic.description}`
+          context: `Topic: ${selectedTopic.title} - ${selectedTopic.description}`,
+          stream: true
         }),
       });
 
@@ -152,23 +208,18 @@ function TopicChat() {
         throw new Error(`HTTP Error: ${response.status}`);
       }
 
-      const data = await response.json();
-      const aiMessage = {
-        id: Date.now() + 1,
-        text: data.reply,
-        sender: 'ai',
-        topic: selectedTopic.id
-      };
-      
-      setMessages(prev => [...prev, aiMessage]);
+      const contentType = response.headers.get('Content-Type') || '';
+      if (contentType.includes('text/event-stream') && response.body) {
+        // Streamed reply: render tokens as they arrive
+        await readReplyStream(response.body, updateAiMessage);
+      } else {
+        // The server answered with the full reply at once (e.g. no LLM configured)
+        const data = await response.json();
+        updateAiMessage(data.reply);
+      }
     } catch (error) {
       console.error("Error sending message:", error);
-      const errorMessage = {
-        id: Date.now() + 1,
-        text: "Sorry, I'm having trouble responding right now. Please try again.",
-        sender: 'ai'
-      };
-      setMessages(prev => [...prev, errorMessage]);
+      updateAiMessage("Sorry, I'm having trouble responding right now. Please try again.");
     } finally {
       setIsLoading(false);
     }